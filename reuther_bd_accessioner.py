@@ -1,10 +1,23 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 import sys
 
+from reuther_born_digital_utils.bag_serializer import SERIALIZATION_FORMATS
+from reuther_born_digital_utils.bag_updater import update_bags
+from reuther_born_digital_utils.bag_validator import validate_bags
 from reuther_born_digital_utils.batch_processor import process_batch, process_nimbie_batch
+from reuther_born_digital_utils.device_limits import DeviceLimits
+from reuther_born_digital_utils.dfxml_io import DFXML_COMPRESSIONS
+from reuther_born_digital_utils.holdings_index import HoldingsIndex
 from reuther_born_digital_utils.item_processor import process_item
+from reuther_born_digital_utils.pii_policy import PiiPolicy
+from reuther_born_digital_utils.probe_cache import ProbeCache
+from reuther_born_digital_utils.processing_options import ProcessingOptions
+from reuther_born_digital_utils.resource_limits import ResourceLimits
+from reuther_born_digital_utils.snapshots import SNAPSHOT_MODES, rollback_items
+from reuther_born_digital_utils.tool_runner import ToolTimeouts
 
 
 def main():
@@ -40,9 +53,189 @@ def main():
                         help="Source directory is a Nimbie batch",
                         action="store_true"
                         )
+    parser.add_argument(
+                        "-w", "--workers",
+                        help="Number of items in a batch to process at the same time (with --autotune, the most at once; "
+                             "defaults to the number of CPUs)",
+                        type=int
+                        )
+    parser.add_argument(
+                        "--autotune",
+                        help="Adjust the number of items processed at once while a batch runs, from CPU use, iowait, "
+                             "free memory and throughput, and start later batches from what worked; bulk_extractor then runs "
+                             "separately from brunnhilde so its thread count can be set",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--plan",
+                        help="Print the expected processing order and disk space footprint of a batch without processing it",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--timeouts",
+                        help="JSON file of per-tool timeouts, e.g. {\"tsk_recover\": {\"base\": 600, \"per_gb\": 300}}"
+                        )
+    parser.add_argument(
+                        "--timeout_scale",
+                        help="Multiply every tool timeout by this factor",
+                        type=float,
+                        default=1.0
+                        )
+    parser.add_argument(
+                        "--serialize",
+                        help="Write each item as a serialized bag instead of a bag directory",
+                        choices=SERIALIZATION_FORMATS
+                        )
+    parser.add_argument(
+                        "--pack_small",
+                        help="Pack items smaller than this many MB together into shared serialized bags",
+                        type=float,
+                        default=0
+                        )
+    parser.add_argument(
+                        "--nimbie_failed",
+                        help="What to do with discs the Nimbie logs report as failed or empty: process them last (default) or skip them",
+                        choices=["skip", "last"],
+                        default="last"
+                        )
+    parser.add_argument(
+                        "--image_extensions",
+                        help="Comma-separated extensions of the disk images to process (default: iso,img,001,dd,ima,raw)"
+                        )
+    parser.add_argument(
+                        "--disk_probe",
+                        help="How to find partitions and file systems in disk images: read them in process (native, the default; "
+                             "falls back to disktype when nothing is recognised) or always run disktype and mmls",
+                        choices=["native", "disktype"],
+                        default="native"
+                        )
+    parser.add_argument(
+                        "--probe_reports",
+                        help="Write the native disk probe's findings to disk_probe.txt alongside the other reports",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--fat_extractor",
+                        help="How to extract FAT file systems: in a single in-process pass that also writes DFXML, hashes and dates "
+                             "(native, the default) or with fiwalk, tsk_recover and a date fix-up pass (tsk)",
+                        choices=["native", "tsk"],
+                        default="native"
+                        )
+    parser.add_argument(
+                        "--dfxml_compression",
+                        help="Write DFXML compressed as it is generated (dfxml.xml.gz or dfxml.xml.zst) instead of as plain dfxml.xml",
+                        choices=list(DFXML_COMPRESSIONS),
+                        default="none"
+                        )
+    parser.add_argument(
+                        "--probe_cache",
+                        help="Reuse disktype, partition and fiwalk results from earlier runs on the same disk image",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--full_fingerprint",
+                        help="Identify cached disk images by a hash of the whole image rather than sampled blocks",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--holdings_index",
+                        help="Check files and disk images against a persistent index of earlier accessions and add them to it "
+                             "(optionally give the path of the index database)",
+                        nargs="?",
+                        const=True,
+                        default=None
+                        )
+    parser.add_argument(
+                        "--skip_scanned_pii",
+                        help="With --holdings_index, leave files already scanned for PII in earlier accessions out of the bulk_extractor scan",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--index_pii",
+                        help="Load bulk_extractor's feature files into an SQLite index for PII review",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--batch_report",
+                        help="Merge each item's brunnhilde reports into a batch-wide format and PII summary (HTML and CSV) "
+                             "in batch_processor_logs, updated as items finish",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--compress_pii",
+                        help="gzip bulk_extractor's raw feature files once they have been processed",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--pii_policy",
+                        help="Choose which files bulk_extractor scans by their siegfried format: text, office, email and database "
+                             "formats in full, archives sampled, media and executables skipped (optionally give a JSON policy file)",
+                        nargs="?",
+                        const=True,
+                        default=None
+                        )
+    parser.add_argument(
+                        "--io_limits",
+                        help="Limit concurrent readers and writers on each physical device across a batch "
+                             "(optionally give a JSON file of limits by mount point or device name)",
+                        nargs="?",
+                        const=True,
+                        default=None
+                        )
+    parser.add_argument(
+                        "--resource_limits",
+                        help="Limit the memory and CPU time of fiwalk, tsk_recover, unhfs, brunnhilde and bulk_extractor, and keep "
+                             "concurrent runs within a shared memory budget (optionally give a JSON file of limits)",
+                        nargs="?",
+                        const=True,
+                        default=None
+                        )
+    parser.add_argument(
+                        "--progress_endpoint",
+                        help="Serve batch progress as JSON over HTTP on [host:]port or on a Unix socket (unix:/path/to/socket)"
+                        )
+    parser.add_argument(
+                        "--snapshot",
+                        help="Snapshot each item before processing changes it, roll it back if a step fails and discard the "
+                             "snapshot once it is bagged (reflink, hardlink or journal; auto, the default, uses the cheapest that works)",
+                        nargs="?",
+                        const="auto",
+                        choices=SNAPSHOT_MODES
+                        )
+    parser.add_argument(
+                        "--rollback",
+                        help="Restore the item at the source directory (or every item in the batch with a snapshot) from its snapshot",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--validate",
+                        help="Validate every bag found under the source directory instead of processing it",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--update_bag",
+                        help="Update the manifests and Payload-Oxum of the bag at the source directory (or every bag under it) "
+                             "after files in it were edited, rehashing only the changed files",
+                        action="store_true"
+                        )
+    parser.add_argument(
+                        "--processes",
+                        help="Number of processes used to verify bag manifests (defaults to the number of CPUs)",
+                        type=int
+                        )
     args = parser.parse_args()
 
     source_dir = args.source
+    if args.validate:
+        bags_valid = validate_bags(source_dir, processes=args.processes)
+        sys.exit(0 if bags_valid else 1)
+    if args.update_bag:
+        bags_updated = update_bags(source_dir)
+        sys.exit(0 if bags_updated else 1)
+    if args.rollback:
+        items_restored = rollback_items(source_dir)
+        sys.exit(0 if items_restored else 1)
+
     if args.nimbie:
         source_type = "nimbie"
         transfer_type = "folders"
@@ -61,12 +254,67 @@ def main():
         else:
             sys.exit("Please specify either a disk image transfer [-d] or a file transfer transfer [-f]")
 
+    if args.plan and source_type == "item":
+        sys.exit("The --plan option is only available for batch [-b] and Nimbie [-n] transfers")
+
+    timeouts = ToolTimeouts.from_file(args.timeouts, scale=args.timeout_scale)
+
+    if args.pack_small and source_type == "item":
+        sys.exit("The --pack_small option is only available for batch [-b] and Nimbie [-n] transfers")
+    workers = args.workers
+    if workers is None:
+        workers = (os.cpu_count() or 1) if args.autotune else 1
+    if args.progress_endpoint and source_type == "item":
+        sys.exit("The --progress_endpoint option is only available for batch [-b] and Nimbie [-n] transfers")
+    if args.autotune and source_type == "item":
+        sys.exit("The --autotune option is only available for batch [-b] and Nimbie [-n] transfers")
+    if args.batch_report and source_type == "item":
+        sys.exit("The --batch_report option is only available for batch [-b] and Nimbie [-n] transfers")
+    if args.io_limits and source_type == "item":
+        sys.exit("The --io_limits option is only available for batch [-b] and Nimbie [-n] transfers")
+    if args.skip_scanned_pii and not args.holdings_index:
+        sys.exit("The --skip_scanned_pii option requires --holdings_index")
+    options = ProcessingOptions(
+        keep_image=args.keep_image,
+        timeouts=timeouts,
+        serialize=args.serialize,
+        snapshot=args.snapshot,
+        dfxml_compression=args.dfxml_compression,
+        index_pii=args.index_pii,
+        compress_pii=args.compress_pii,
+        skip_scanned_pii=args.skip_scanned_pii,
+        workers=workers,
+        pack_small=int(args.pack_small * 1024 * 1024),
+        nimbie_failed=args.nimbie_failed,
+        progress_endpoint=args.progress_endpoint,
+        autotune=args.autotune,
+        batch_report=args.batch_report
+    )
+    if args.io_limits:
+        options.device_limits = DeviceLimits.from_file(None if args.io_limits is True else args.io_limits)
+    if args.resource_limits:
+        options.resource_limits = ResourceLimits.from_file(None if args.resource_limits is True else args.resource_limits)
+    if args.pii_policy:
+        options.pii_policy = PiiPolicy.from_file(None if args.pii_policy is True else args.pii_policy)
+    if transfer_type == "disk_images":
+        if args.image_extensions:
+            options.image_extensions = [f".{extension.strip().lstrip('.')}" for extension in args.image_extensions.split(",") if extension.strip()]
+        options.disk_probe = args.disk_probe
+        options.probe_reports = args.probe_reports
+        options.fat_extractor = args.fat_extractor
+        if args.probe_cache:
+            options.probe_cache = ProbeCache(full_hash=args.full_fingerprint)
+    if args.holdings_index:
+        options.holdings_index = HoldingsIndex(None if args.holdings_index is True else args.holdings_index)
+
     if source_type == "nimbie":
-        process_nimbie_batch(source_dir, transfer_type, args.keep_image)
+        process_nimbie_batch(source_dir, transfer_type, options, plan_only=args.plan)
     elif source_type == "batch":
-        process_batch(source_dir, transfer_type, args.keep_image)
+        process_batch(source_dir, transfer_type, options, plan_only=args.plan)
     else:
-        process_item(source_dir, transfer_type, args.keep_image)
+        process_item(source_dir, transfer_type, options)
+    if options.holdings_index:
+        options.holdings_index.close()
 
 
 if __name__ == "__main__":
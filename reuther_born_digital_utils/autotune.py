@@ -0,0 +1,209 @@
+import datetime
+import os
+import threading
+import time
+
+from reuther_born_digital_utils.local_state import load_json, state_path, write_json_atomic
+from reuther_born_digital_utils.space_planner import format_size
+
+
+# seconds between decisions; long enough for a stage or two to finish at the current parallelism
+TUNE_INTERVAL = 30.0
+# above these the machine is overloaded and the worker count is halved
+MAX_IOWAIT = 0.35
+MIN_MEMORY_AVAILABLE = 0.10
+# below these there is room for one more item
+MAX_CPU_BUSY_TO_GROW = 0.85
+MAX_IOWAIT_TO_GROW = 0.15
+# a step up that loses this much throughput is taken back and becomes the ceiling
+THROUGHPUT_DROP = 0.10
+# median item size separating batches of floppies and discs from batches of hard drives
+LARGE_ITEM_SIZE = 1024 * 1024 * 1024
+
+
+def read_cpu_times(stat="/proc/stat"):
+    """ Returns (busy, iowait, total) jiffies across all CPUs """
+    try:
+        with open(stat, "r", encoding="utf-8") as f:
+            fields = [int(field) for field in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    user, nice, system, idle, iowait = fields[:5]
+    # guest time is already counted in user and nice
+    total = sum(fields[:8])
+    return total - idle - iowait, iowait, total
+
+
+def memory_available(meminfo="/proc/meminfo"):
+    """ Returns the share of physical memory available to new processes """
+    values = {}
+    try:
+        with open(meminfo, "r", encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                values[name] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    if not values.get("MemTotal") or "MemAvailable" not in values:
+        return None
+    return values["MemAvailable"] / values["MemTotal"]
+
+
+class SystemSampler:
+    def __init__(self):
+        self.last = read_cpu_times()
+
+    def sample(self):
+        """ Returns (cpu busy, iowait, memory available) as shares; CPU shares cover the time since the last sample """
+        current = read_cpu_times()
+        cpu_busy = iowait = None
+        if current and self.last and current[2] > self.last[2]:
+            elapsed = current[2] - self.last[2]
+            cpu_busy = (current[0] - self.last[0]) / elapsed
+            iowait = (current[1] - self.last[1]) / elapsed
+        self.last = current
+        return cpu_busy, iowait, memory_available()
+
+
+def size_class(planned_items):
+    sizes = sorted(planned_item.input_size for planned_item in planned_items)
+    if not sizes:
+        return "small"
+    return "large" if sizes[len(sizes) // 2] >= LARGE_ITEM_SIZE else "small"
+
+
+class ConcurrencyTuner:
+    """ Adjusts how many items run at once while a batch runs, by additive increase and multiplicative decrease.
+
+    Every interval it samples CPU use, iowait, available memory and the batch's throughput. Overload halves the
+    worker count; spare CPU adds one worker, unless the last step up cost throughput, in which case it is taken
+    back. The best worker count seen is kept per transfer type and item size, and later batches start from it.
+    """
+    def __init__(self, max_workers, transfer_type, planned_items, log_file, state_file=None, interval=TUNE_INTERVAL):
+        self.max_workers = max(1, max_workers)
+        self.key = f"{transfer_type}/{size_class(planned_items)}"
+        self.log_file = log_file
+        self.state_file = state_file or state_path("autotune.json")
+        self.interval = interval
+        self.learned = (load_json(self.state_file, {}) or {}).get(self.key)
+        self.workers = min(self.max_workers, self.learned["workers"]) if self.learned else 1
+        self.ceiling = self.max_workers
+        self.admission = None
+        self.progress = None
+        self.sampler = None
+        self.last_bytes = 0
+        self.last_time = None
+        self.last_throughput = None
+        self.last_action = None
+        # {workers: [seconds, bytes]} observed with all that many items running
+        self.observed = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self, admission, progress):
+        self.admission = admission
+        self.progress = progress
+        self.admission.set_workers(self.workers)
+        self.sampler = SystemSampler()
+        self.last_time = time.time()
+        source = f"learned from {self.learned['batches']} earlier batch(es)" if self.learned else "no earlier batches"
+        self.log(f"start\tworkers={self.workers}\tceiling={self.max_workers}\t{self.key}: {source}")
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.tune()
+
+    def tune(self):
+        now = time.time()
+        snapshot = self.progress.snapshot()
+        throughput = (snapshot["bytes_done"] - self.last_bytes) / max(now - self.last_time, 0.001)
+        running = len(snapshot["running"])
+        saturated = running >= self.workers
+        if saturated:
+            seconds_bytes = self.observed.setdefault(self.workers, [0.0, 0])
+            seconds_bytes[0] += now - self.last_time
+            seconds_bytes[1] += snapshot["bytes_done"] - self.last_bytes
+        self.last_bytes = snapshot["bytes_done"]
+        self.last_time = now
+        cpu_busy, iowait, memory = self.sampler.sample()
+        pending = snapshot["item_statuses"].get("pending", 0)
+
+        action, reason = "hold", "steady"
+        if memory is not None and memory < MIN_MEMORY_AVAILABLE:
+            action, reason = "decrease", f"only {memory:.0%} of memory available"
+        elif iowait is not None and iowait > MAX_IOWAIT:
+            action, reason = "decrease", f"iowait at {iowait:.0%}"
+        elif self.last_action == "increase" and self.last_throughput and throughput < self.last_throughput * (1 - THROUGHPUT_DROP):
+            action, reason = "revert", f"throughput fell from {format_size(self.last_throughput)}/s"
+        elif not pending:
+            reason = "no items waiting"
+        elif not saturated:
+            reason = f"only {running} of {self.workers} items running"
+        elif cpu_busy is not None and cpu_busy < MAX_CPU_BUSY_TO_GROW and (iowait or 0) < MAX_IOWAIT_TO_GROW:
+            if self.workers < self.ceiling:
+                action, reason = "increase", f"CPU {cpu_busy:.0%} busy"
+            else:
+                reason = f"at the ceiling of {self.ceiling}"
+        elif cpu_busy is not None:
+            reason = f"CPU {cpu_busy:.0%} busy"
+
+        if action == "decrease":
+            workers = max(1, self.workers // 2)
+        elif action == "revert":
+            workers = max(1, self.workers - 1)
+            self.ceiling = workers
+        elif action == "increase":
+            workers = self.workers + 1
+        else:
+            workers = self.workers
+        cpu_note = "n/a" if cpu_busy is None else f"{cpu_busy:.0%}"
+        iowait_note = "n/a" if iowait is None else f"{iowait:.0%}"
+        memory_note = "n/a" if memory is None else f"{memory:.0%}"
+        self.log(
+            f"{action}\tworkers={self.workers}->{workers}\tcpu={cpu_note}\tiowait={iowait_note}\t"
+            f"memory_available={memory_note}\tthroughput={format_size(throughput)}/s\t{reason}"
+        )
+        self.last_action = action if workers != self.workers else None
+        self.last_throughput = throughput
+        if workers != self.workers:
+            print(f"Autotune: {self.workers} -> {workers} workers ({reason})")
+            self.workers = workers
+            self.admission.set_workers(workers)
+            self.progress.workers = workers
+
+    def tool_threads(self):
+        """ Threads for a multithreaded tool (bulk_extractor, bag hashing), sharing the CPUs between running items """
+        running = self.admission.running if self.admission else 1
+        return max(1, (os.cpu_count() or 1) // max(1, running))
+
+    def best_workers(self):
+        rates = {workers: total_bytes / seconds for workers, (seconds, total_bytes) in self.observed.items() if seconds > 0}
+        if not rates:
+            return None
+        return max(rates, key=lambda workers: (rates[workers], -workers))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        best = self.best_workers()
+        if best is None:
+            self.log("stop\tnot enough observations to learn from")
+            return
+        state = load_json(self.state_file, {}) or {}
+        batches = (state.get(self.key) or {}).get("batches", 0) + 1
+        state[self.key] = {"workers": best, "batches": batches, "updated": str(datetime.datetime.now())}
+        try:
+            write_json_atomic(self.state_file, state)
+        except OSError as e:
+            print(f"Unable to save autotune settings to {self.state_file}: {e}")
+        self.log(f"stop\tlearned workers={best} for {self.key}")
+
+    def log(self, line):
+        try:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(f"{datetime.datetime.now().isoformat(timespec='seconds')}\t{line}\n")
+        except OSError as e:
+            print(f"Unable to write {self.log_file}: {e}")
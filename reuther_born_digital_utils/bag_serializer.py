@@ -0,0 +1,229 @@
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SERIALIZATION_FORMATS = ["tar", "tar.gz", "tar.zst"]
+BAGIT_TXT = "BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n"
+# start a new packed archive once the current one is this big
+DEFAULT_PACKED_ARCHIVE_SIZE = 4 * 1024 ** 3
+COPY_BUFFER_SIZE = 1024 * 1024
+# a bag staged for a packed archive is kept in memory up to this size, then spills to disk
+STAGING_MEMORY = 64 * 1024 * 1024
+
+
+def encode_manifest_path(path):
+    # only CR and LF, as bagit.py does; bagit.py reads "%25" literally, so encoding "%" would break its validation
+    return path.replace("\r", "%0D").replace("\n", "%0A")
+
+
+class HashingReader:
+    def __init__(self, fileobj, hashers):
+        self.fileobj = fileobj
+        self.hashers = hashers
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        for hasher in self.hashers:
+            hasher.update(chunk)
+        return chunk
+
+
+class HashingWriter:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.md5()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.bytes_written += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def add_text(tar, arcname, content):
+    data = content.encode("utf-8")
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mtime = int(datetime.datetime.now().timestamp())
+    tarinfo.mode = 0o644
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+
+def write_bag(tar, item_dir, bag_name):
+    """ Adds item_dir's contents to tar as the payload of a bag named bag_name; returns the payload manifest """
+    manifest = {}
+    payload_bytes = 0
+    for root, dirnames, filenames in os.walk(item_dir):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            filepath = os.path.join(root, name)
+            relpath = "data/" + os.path.relpath(filepath, item_dir).replace(os.sep, "/")
+            tarinfo = tar.gettarinfo(filepath, arcname=f"{bag_name}/{relpath}")
+            if tarinfo.isreg():
+                md5 = hashlib.md5()
+                with open(filepath, "rb") as f:
+                    tar.addfile(tarinfo, HashingReader(f, [md5]))
+                manifest[relpath] = md5.hexdigest()
+                payload_bytes += tarinfo.size
+            else:
+                tar.addfile(tarinfo)
+
+    manifest_txt = "".join(f"{digest}  {encode_manifest_path(relpath)}\n" for relpath, digest in sorted(manifest.items()))
+    bag_info_txt = (
+        f"Bag-Software-Agent: reuther_born_digital_utils bag_serializer\n"
+        f"Bagging-Date: {datetime.date.today().isoformat()}\n"
+        f"Payload-Oxum: {payload_bytes}.{len(manifest)}\n"
+    )
+    tag_files = [("bagit.txt", BAGIT_TXT), ("bag-info.txt", bag_info_txt), ("manifest-md5.txt", manifest_txt)]
+    tagmanifest_txt = "".join(f"{hashlib.md5(content.encode('utf-8')).hexdigest()}  {name}\n" for name, content in tag_files)
+    for name, content in tag_files + [("tagmanifest-md5.txt", tagmanifest_txt)]:
+        add_text(tar, f"{bag_name}/{name}", content)
+    return manifest
+
+
+def fsync_dir(dirpath):
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SerializedBagWriter:
+    """ Writes one or more bags into a single tar stream, hashing payload files as
+    they are copied into the archive and appending the tag files at the end.
+
+    The archive is written under a .part name and only renamed into place once it is complete and synced.
+    """
+    def __init__(self, archive_path, serialization="tar"):
+        if serialization not in SERIALIZATION_FORMATS:
+            sys.exit(f"Unknown bag serialization {serialization}, use one of {', '.join(SERIALIZATION_FORMATS)}")
+        if serialization == "tar.zst" and zstandard is None:
+            sys.exit("Writing tar.zst bags requires the zstandard package (pip install zstandard)")
+        self.archive_path = archive_path
+        self.part_path = f"{archive_path}.part"
+        self.archive_file = open(self.part_path, "wb")
+        self.writer = HashingWriter(self.archive_file)
+        self.compressor = None
+        if serialization == "tar.zst":
+            self.compressor = zstandard.ZstdCompressor().stream_writer(self.writer, closefd=False)
+            self.tar = tarfile.open(fileobj=self.compressor, mode="w|", format=tarfile.PAX_FORMAT)
+        elif serialization == "tar.gz":
+            self.tar = tarfile.open(fileobj=self.writer, mode="w|gz", format=tarfile.PAX_FORMAT)
+        else:
+            self.tar = tarfile.open(fileobj=self.writer, mode="w|", format=tarfile.PAX_FORMAT)
+        self.tar.copybufsize = COPY_BUFFER_SIZE
+
+    def add_bag(self, item_dir, bag_name=None):
+        """ Adds item_dir's contents as the payload of a bag; returns the payload manifest """
+        return write_bag(self.tar, item_dir, bag_name or os.path.basename(os.path.normpath(item_dir)))
+
+    def add_staged_bag(self, item_dir, bag_name=None):
+        """ Like add_bag, but the bag is written in full to a staging file first and then copied in,
+        so a bag that fails part way leaves nothing behind in an archive shared with other bags """
+        bag_name = bag_name or os.path.basename(os.path.normpath(item_dir))
+        with tempfile.SpooledTemporaryFile(max_size=STAGING_MEMORY, dir=os.path.dirname(os.path.abspath(self.archive_path))) as staging:
+            # left unclosed, so the staging tar holds just the bag's members without end-of-archive blocks
+            staging_tar = tarfile.open(fileobj=staging, mode="w", format=tarfile.PAX_FORMAT)
+            manifest = write_bag(staging_tar, item_dir, bag_name)
+            staging.seek(0)
+            shutil.copyfileobj(staging, self.tar.fileobj, COPY_BUFFER_SIZE)
+            self.tar.offset += staging_tar.offset
+        return manifest
+
+    def discard(self):
+        try:
+            self.tar.close()
+        finally:
+            self.archive_file.close()
+            os.remove(self.part_path)
+
+    def bytes_written(self):
+        return self.writer.bytes_written
+
+    def close(self):
+        self.tar.close()
+        if self.compressor is not None:
+            self.compressor.close()
+        self.archive_file.flush()
+        os.fsync(self.archive_file.fileno())
+        self.archive_file.close()
+        os.replace(self.part_path, self.archive_path)
+        sidecar = f"{self.archive_path}.md5"
+        with open(sidecar, "w", encoding="utf-8") as f:
+            f.write(f"{self.writer.hasher.hexdigest()}  {os.path.basename(self.archive_path)}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_dir(os.path.dirname(os.path.abspath(self.archive_path)))
+        return sidecar
+
+
+class BagPacker:
+    """ Packs many small bags one after another into shared archives.
+
+    Packed items are only removed once the archive holding them has been closed and synced, so a batch
+    that dies part way through still has the originals of everything in the unfinished archive.
+    """
+    def __init__(self, output_dir, serialization="tar", threshold=0, max_archive_size=DEFAULT_PACKED_ARCHIVE_SIZE):
+        self.output_dir = output_dir
+        self.serialization = serialization
+        self.threshold = threshold
+        self.max_archive_size = max_archive_size
+        self.lock = threading.Lock()
+        self.bag_writer = None
+        self.archive_count = 0
+        # item directories packed into the open archive, removed when it is closed
+        self.packed_items = []
+
+    def accepts(self, payload_size):
+        return payload_size < self.threshold
+
+    def next_archive_path(self):
+        while True:
+            self.archive_count += 1
+            archive_path = os.path.join(self.output_dir, f"packed_bags_{self.archive_count:03d}.{self.serialization}")
+            if not os.path.exists(archive_path):
+                return archive_path
+
+    def pack(self, item_dir):
+        """ Returns (archive path, manifest, archive bytes written for this bag) """
+        with self.lock:
+            if self.bag_writer is None:
+                archive_path = self.next_archive_path()
+                self.bag_writer = SerializedBagWriter(archive_path, self.serialization)
+            bytes_before = self.bag_writer.bytes_written()
+            manifest = self.bag_writer.add_staged_bag(item_dir)
+            self.packed_items.append(item_dir)
+            archive_path = self.bag_writer.archive_path
+            written = self.bag_writer.bytes_written() - bytes_before
+            if self.bag_writer.bytes_written() >= self.max_archive_size:
+                self.finish_archive()
+        return archive_path, manifest, written
+
+    def finish_archive(self):
+        self.bag_writer.close()
+        self.bag_writer = None
+        for item_dir in self.packed_items:
+            if os.path.exists(item_dir):
+                shutil.rmtree(item_dir)
+        self.packed_items = []
+
+    def close(self):
+        with self.lock:
+            if self.bag_writer is not None:
+                self.finish_archive()
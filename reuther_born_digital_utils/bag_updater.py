@@ -0,0 +1,126 @@
+import os
+
+from reuther_born_digital_utils.bag_serializer import encode_manifest_path
+from reuther_born_digital_utils.bag_validator import decode_manifest_path, find_bags, hash_file, payload_files
+from reuther_born_digital_utils.space_planner import format_size
+
+
+def read_manifest(manifest_file):
+    entries = {}
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            digest, relpath = line.split(None, 1)
+            entries[decode_manifest_path(relpath.lstrip("*"))] = digest.lower()
+    return entries
+
+
+def write_manifest(manifest_file, entries):
+    tmp_file = f"{manifest_file}.tmp{os.getpid()}"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for relpath, digest in sorted(entries.items()):
+            f.write(f"{digest}  {encode_manifest_path(relpath)}\n")
+    os.replace(tmp_file, manifest_file)
+
+
+class BagUpdater:
+    """ Brings an existing bag's manifests up to date after files under data/ were edited, added or removed.
+
+    Only files changed since the payload manifests were written (by mtime or ctime), or missing
+    from them, are rehashed; everything else keeps its recorded digest.
+    """
+    def __init__(self, bag_dir):
+        self.bag_dir = bag_dir
+        self.manifests = {}
+        self.tag_manifests = {}
+        for filename in sorted(os.listdir(bag_dir)):
+            for prefix, manifests in [("manifest-", self.manifests), ("tagmanifest-", self.tag_manifests)]:
+                if filename.startswith(prefix) and filename.endswith(".txt"):
+                    manifests[filename[len(prefix):-len(".txt")]] = os.path.join(bag_dir, filename)
+
+    def changed_files(self, payload, recorded):
+        # anything touched after the oldest manifest was written may have changed
+        manifests_written = min(os.stat(manifest_file).st_mtime_ns for manifest_file in self.manifests.values())
+        changed = []
+        for relpath in sorted(payload):
+            if relpath not in recorded:
+                changed.append(relpath)
+                continue
+            stat = os.lstat(os.path.join(self.bag_dir, relpath))
+            if max(stat.st_mtime_ns, stat.st_ctime_ns) > manifests_written:
+                changed.append(relpath)
+        return changed
+
+    def update(self):
+        if not self.manifests:
+            print(f"{self.bag_dir}: no payload manifests to update")
+            return False
+        entries = {algorithm: read_manifest(manifest_file) for algorithm, manifest_file in self.manifests.items()}
+        recorded = set.intersection(*(set(manifest) for manifest in entries.values()))
+        payload = payload_files(self.bag_dir)
+        changed = self.changed_files(payload, recorded)
+        removed = sorted(relpath for relpath in set().union(*entries.values()) if relpath not in payload)
+
+        algorithms = list(self.manifests)
+        rehashed_bytes = 0
+        modified = 0
+        for relpath in changed:
+            digests = hash_file(os.path.join(self.bag_dir, relpath), algorithms)
+            rehashed_bytes += payload[relpath]
+            if any(entries[algorithm].get(relpath) != digest for algorithm, digest in digests.items()):
+                modified += 1
+            for algorithm, digest in digests.items():
+                entries[algorithm][relpath] = digest
+        for relpath in removed:
+            for manifest in entries.values():
+                manifest.pop(relpath, None)
+
+        # rewrite even when nothing differs, so unchanged files touched since aren't rehashed next time
+        if changed or removed:
+            for algorithm, manifest_file in self.manifests.items():
+                write_manifest(manifest_file, entries[algorithm])
+        self.update_payload_oxum(payload)
+        self.update_tag_manifests()
+        print(
+            f"{self.bag_dir}: {modified} of {len(payload)} payload files new or changed, {len(removed)} removed; "
+            f"rehashed {len(changed)} files ({format_size(rehashed_bytes)})"
+        )
+        return True
+
+    def update_payload_oxum(self, payload):
+        bag_info_file = os.path.join(self.bag_dir, "bag-info.txt")
+        oxum = f"Payload-Oxum: {sum(payload.values())}.{len(payload)}\n"
+        lines = []
+        if os.path.exists(bag_info_file):
+            with open(bag_info_file, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        if any(line.startswith("Payload-Oxum:") for line in lines):
+            lines = [oxum if line.startswith("Payload-Oxum:") else line for line in lines]
+        else:
+            lines.append(oxum)
+        tmp_file = f"{bag_info_file}.tmp{os.getpid()}"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp_file, bag_info_file)
+
+    def update_tag_manifests(self):
+        for algorithm, tag_manifest_file in self.tag_manifests.items():
+            entries = read_manifest(tag_manifest_file)
+            tag_files = set(relpath for relpath in entries if os.path.exists(os.path.join(self.bag_dir, relpath)))
+            tag_files.update(
+                filename for filename in os.listdir(self.bag_dir)
+                if filename in ["bagit.txt", "bag-info.txt"] or filename.startswith("manifest-")
+            )
+            updated = {relpath: hash_file(os.path.join(self.bag_dir, relpath), [algorithm])[algorithm] for relpath in tag_files}
+            write_manifest(tag_manifest_file, updated)
+
+
+def update_bags(source_dir):
+    """ Updates the bag at source_dir, or every bag under it """
+    bags = [source_dir] if os.path.exists(os.path.join(source_dir, "bagit.txt")) else find_bags(source_dir)
+    if not bags:
+        print(f"No bags found in {source_dir}")
+        return False
+    return all([BagUpdater(bag_dir).update() for bag_dir in bags])
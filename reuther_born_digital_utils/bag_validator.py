@@ -0,0 +1,218 @@
+import csv
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def find_bags(source_dir):
+    bags = []
+    for root, dirnames, filenames in os.walk(source_dir):
+        if "bagit.txt" in filenames:
+            bags.append(root)
+            dirnames[:] = []
+        else:
+            dirnames[:] = [dirname for dirname in dirnames if dirname not in ["batch_processor_logs", "nimbie_transfer_logs"]]
+    return sorted(bags)
+
+
+def decode_manifest_path(path):
+    # exactly what bagit.py decodes: upper-case %0D and %0A, with every other "%" left as it is
+    return path.replace("%0D", "\r").replace("%0A", "\n")
+
+
+def read_bag_info(bag_dir):
+    bag_info = {}
+    bag_info_file = os.path.join(bag_dir, "bag-info.txt")
+    if not os.path.exists(bag_info_file):
+        return bag_info
+    with open(bag_info_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if ":" in line and not line[0].isspace():
+                key, value = line.split(":", 1)
+                bag_info[key.strip()] = value.strip()
+    return bag_info
+
+
+def read_manifests(bag_dir, failures=None):
+    """ Returns {relative path: {algorithm: expected digest}} for payload and tag manifests
+
+    Malformed lines are added to failures when a list is given, and raise ValueError otherwise.
+    """
+    entries = {}
+    for filename in sorted(os.listdir(bag_dir)):
+        for prefix in ["manifest-", "tagmanifest-"]:
+            if filename.startswith(prefix) and filename.endswith(".txt"):
+                algorithm = filename[len(prefix):-len(".txt")]
+                with open(os.path.join(bag_dir, filename), "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.rstrip("\r\n")
+                        if not line.strip():
+                            continue
+                        try:
+                            digest, relpath = line.split(None, 1)
+                        except ValueError:
+                            message = f"{filename}: malformed line {line!r}"
+                            if failures is None:
+                                raise ValueError(message)
+                            failures.append(message)
+                            continue
+                        relpath = decode_manifest_path(relpath.lstrip("*"))
+                        entries.setdefault(relpath, {})[algorithm] = digest.lower()
+    return entries
+
+
+def payload_files(bag_dir):
+    data_dir = os.path.join(bag_dir, "data")
+    payload = {}
+    for root, _, filenames in os.walk(data_dir):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            relpath = os.path.relpath(filepath, bag_dir).replace(os.sep, "/")
+            payload[relpath] = os.lstat(filepath).st_size
+    return payload
+
+
+def hash_file(filepath, algorithms):
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+
+def verify_file(bag_dir, relpath, expected):
+    started = time.time()
+    try:
+        actual = hash_file(os.path.join(bag_dir, relpath), list(expected))
+    except (OSError, ValueError) as e:
+        return bag_dir, relpath, [f"{relpath}: unable to hash ({e})"], time.time() - started
+    failures = [
+        f"{relpath}: {algorithm} expected {digest}, found {actual[algorithm]}"
+        for algorithm, digest in sorted(expected.items()) if actual[algorithm] != digest
+    ]
+    return bag_dir, relpath, failures, time.time() - started
+
+
+class BagResult:
+    def __init__(self, bag_dir):
+        self.bag_dir = bag_dir
+        self.failures = []
+        # problems that don't make the bag invalid
+        self.warnings = []
+        self.files = 0
+        self.bytes = 0
+        self.oxum_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.completed_after = 0.0
+
+
+class BagValidator:
+    def __init__(self, source_dir, processes=None):
+        self.source_dir = source_dir
+        self.processes = processes or os.cpu_count()
+        self.logs_dir = os.path.join(source_dir, "batch_processor_logs")
+        self.results = {}
+
+    def check_structure(self, bag_dir):
+        result = self.results[bag_dir]
+        started = time.time()
+        manifest_entries = read_manifests(bag_dir, failures=result.failures)
+        payload = payload_files(bag_dir)
+        result.files = len(payload)
+        result.bytes = sum(payload.values())
+
+        oxum = read_bag_info(bag_dir).get("Payload-Oxum")
+        if oxum:
+            try:
+                expected_bytes, expected_files = (int(value) for value in oxum.split("."))
+            except ValueError:
+                result.failures.append(f"Payload-Oxum is malformed: {oxum}")
+            else:
+                if (expected_bytes, expected_files) != (result.bytes, result.files):
+                    result.failures.append(f"Payload-Oxum mismatch: expected {oxum}, found {result.bytes}.{result.files}")
+        else:
+            # Payload-Oxum is optional in the BagIt spec; the manifests are still checked
+            result.warnings.append("bag-info.txt has no Payload-Oxum")
+
+        for relpath in sorted(set(payload) - set(manifest_entries)):
+            result.failures.append(f"{relpath}: not listed in any manifest")
+        for relpath in sorted(manifest_entries):
+            if not os.path.isfile(os.path.join(bag_dir, relpath)):
+                result.failures.append(f"{relpath}: listed in manifest but missing")
+        result.oxum_seconds = time.time() - started
+        return manifest_entries
+
+    def validate(self):
+        bags = find_bags(self.source_dir)
+        print(f"Validating {len(bags)} bags under {self.source_dir}")
+        tasks = []
+        for bag_dir in bags:
+            self.results[bag_dir] = BagResult(bag_dir)
+            manifest_entries = self.check_structure(bag_dir)
+            for warning in self.results[bag_dir].warnings:
+                print(f"{bag_dir}: {warning}")
+            if self.results[bag_dir].failures:
+                # a bag failing the quick checks is already invalid, don't spend time hashing it
+                print(f"{bag_dir}: failed quick checks, skipping manifest verification")
+                continue
+            for relpath, expected in manifest_entries.items():
+                filepath = os.path.join(bag_dir, relpath)
+                tasks.append((os.path.getsize(filepath), bag_dir, relpath, expected))
+
+        # largest files first so one big file doesn't finish alone at the end
+        tasks.sort(key=lambda task: task[0], reverse=True)
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            futures = [executor.submit(verify_file, bag_dir, relpath, expected) for _, bag_dir, relpath, expected in tasks]
+            for future in as_completed(futures):
+                bag_dir, relpath, failures, seconds = future.result()
+                result = self.results[bag_dir]
+                result.failures.extend(failures)
+                result.hash_seconds += seconds
+                result.completed_after = time.time() - started
+
+        self.write_logs()
+        invalid = [result for result in self.results.values() if result.failures]
+        print(f"{len(bags) - len(invalid)} of {len(bags)} bags are valid")
+        return not invalid
+
+    def write_logs(self):
+        if not os.path.exists(self.logs_dir):
+            os.makedirs(self.logs_dir)
+
+        headers = ["bag", "valid", "files", "bytes", "quick_check_seconds", "hash_seconds", "completed_after_seconds", "failures", "warnings"]
+        with open(os.path.join(self.logs_dir, "bag_validation.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            for bag_dir, result in sorted(self.results.items()):
+                writer.writerow([
+                    bag_dir,
+                    not result.failures,
+                    result.files,
+                    result.bytes,
+                    f"{result.oxum_seconds:.3f}",
+                    f"{result.hash_seconds:.3f}",
+                    f"{result.completed_after:.3f}",
+                    len(result.failures),
+                    len(result.warnings)
+                ])
+
+        with open(os.path.join(self.logs_dir, "bag_validation_failures.txt"), "w", encoding="utf-8") as f:
+            for bag_dir, result in sorted(self.results.items()):
+                for failure in result.failures:
+                    f.write(f"{bag_dir}\t{failure}\n")
+                for warning in result.warnings:
+                    f.write(f"{bag_dir}\twarning: {warning}\n")
+
+
+def validate_bags(source_dir, processes=None):
+    bag_validator = BagValidator(source_dir, processes=processes)
+    return bag_validator.validate()
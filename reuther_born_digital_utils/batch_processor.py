@@ -1,36 +1,217 @@
+import csv
 import os
 import shutil
 import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from reuther_born_digital_utils.item_processor import ItemProcessor
+from reuther_born_digital_utils.autotune import ConcurrencyTuner
+from reuther_born_digital_utils.bag_serializer import BagPacker
+from reuther_born_digital_utils.batch_report import BatchReport
+from reuther_born_digital_utils.item_processor import PREMIS_HEADERS, SCAN_DIRNAME, ItemProcessor
+from reuther_born_digital_utils.nimbie_logs import NimbieLogParser, write_disc_manifest
+from reuther_born_digital_utils.pii_findings import PiiFindingsIndex
+from reuther_born_digital_utils.processing_options import ProcessingOptions
+from reuther_born_digital_utils.progress import BatchProgress, ProgressServer
+from reuther_born_digital_utils.snapshots import SNAPSHOTS_DIRNAME
+from reuther_born_digital_utils.space_planner import SpaceAdmission, SpacePlanner, directory_size, format_size
 
 
 class BatchProcessor:
-    def __init__(self, source_dir, transfer_type, keep_image=False, nimbie_transfer=False):
+    def __init__(self, source_dir, transfer_type, options=None, nimbie_manifest=None):
         self.source_dir = source_dir
         self.transfer_type = transfer_type
-        self.keep_image = keep_image
-        self.nimbie_transfer = nimbie_transfer
+        self.options = options or ProcessingOptions()
+        self.bag_packer = None
+        if self.options.pack_small:
+            self.bag_packer = BagPacker(source_dir, serialization=self.options.serialize or "tar", threshold=self.options.pack_small)
+        self.nimbie_manifest = nimbie_manifest or {}
+        # items that lost a tool to a memory or CPU limit, worth retrying with fewer workers
+        self.retry_alone = []
+        # PREMIS events recorded after an item's premis.csv was already bagged, e.g. a bagit timeout
+        self.late_premis_events = []
+        # PREMIS events of failed items, whose premis.csv went with the rest of their changes when they were rolled back
+        self.rolled_back_premis_events = []
+        self.autotuner = None
+        self.report = None
         self.logs_dir = os.path.join(source_dir, "batch_processor_logs")
+        self.pii_index = None
+        self.progress = None
         self.statuses = {
             "skipped": [],
             "success": [],
             "flagged": []
         }
+        self.status_lock = threading.Lock()
+        self.planner = SpacePlanner(source_dir, transfer_type, keep_image=self.options.keep_image)
+
+    def list_items(self):
+        return [
+            os.path.join(self.source_dir, item) for item in sorted(os.listdir(self.source_dir))
+            if os.path.isdir(os.path.join(self.source_dir, item)) and item not in ["nimbie_transfer_logs", "batch_processor_logs", SNAPSHOTS_DIRNAME, SCAN_DIRNAME]
+        ]
+
+    def triage_nimbie_discs(self, item_dirs):
+        to_process = []
+        for item_dir in item_dirs:
+            disc = self.nimbie_manifest.get(os.path.basename(item_dir))
+            if disc and disc.status in ["failed", "empty"] and self.options.nimbie_failed == "skip":
+                message = disc.status_message()
+                print(f"Skipping {item_dir}: {message}")
+                self.record_status(item_dir, "skipped", message)
+            else:
+                to_process.append(item_dir)
+        return to_process
+
+    def disc_priority(self, planned_item):
+        disc = self.nimbie_manifest.get(os.path.basename(planned_item.item_dir))
+        if disc is None or disc.status in ["ok", "unknown"]:
+            return 0
+        elif disc.status == "errors":
+            return 1
+        return 2
+
+    def schedule(self):
+        schedule = self.planner.schedule(self.triage_nimbie_discs(self.list_items()))
+        # discs the Nimbie had trouble reading go last, after everything likely to succeed
+        schedule.sort(key=self.disc_priority)
+        return schedule
 
     def process_batch(self):
-        items = [item for item in os.listdir(self.source_dir) if os.path.isdir(os.path.join(self.source_dir, item)) and item != "nimbie_transfer_logs"]
-        for item in items:
-            item_dir = os.path.join(self.source_dir, item)
-            self.process_item(item_dir)
-        self.write_logs()
+        pending = self.schedule()
+        os.makedirs(self.logs_dir, exist_ok=True)
+        if self.options.autotune:
+            # --workers becomes the most items the tuner may run at once
+            self.autotuner = ConcurrencyTuner(self.options.workers, self.transfer_type, pending, os.path.join(self.logs_dir, "autotune.log"))
+        admission = SpaceAdmission(self.planner, self.autotuner.workers if self.autotuner else self.options.workers)
+        if self.options.batch_report:
+            self.report = BatchReport(self.logs_dir)
+        if self.options.index_pii:
+            self.pii_index = PiiFindingsIndex(os.path.join(self.logs_dir, "pii_findings.sqlite"))
+        if self.options.device_limits:
+            self.options.device_limits.start()
+        self.progress = BatchProgress(os.path.join(self.logs_dir, "progress.json"), pending, workers=admission.workers)
+        self.progress.write(force=True)
+        if self.autotuner:
+            self.autotuner.start(admission, self.progress)
+        progress_server = None
+        try:
+            if self.options.progress_endpoint:
+                progress_server = ProgressServer(self.progress, self.options.progress_endpoint)
+                progress_server.start()
+            with ThreadPoolExecutor(max_workers=self.options.workers) as executor:
+                futures = []
+                while pending:
+                    planned_item, fits = admission.next_item(pending)
+                    if not fits:
+                        message = f"Insufficient free space: needs {format_size(planned_item.estimate)}, {format_size(admission.budget)} available"
+                        print(f"Skipping {planned_item.item_dir}: {message}")
+                        self.record_status(planned_item.item_dir, "skipped", message)
+                        continue
+                    futures.append(executor.submit(self.process_planned_item, planned_item, admission))
+                for future in futures:
+                    future.result()
+        finally:
+            # whatever stopped the batch, keep the statuses of the items that finished and stop the helper threads
+            if self.autotuner:
+                self.autotuner.stop()
+            if self.bag_packer:
+                self.bag_packer.close()
+            if self.pii_index:
+                self.pii_index.close()
+            self.progress.write(force=True)
+            print(f"Batch finished: {self.progress.summary()}")
+            if progress_server:
+                progress_server.stop()
+            self.write_logs()
+
+    def process_planned_item(self, planned_item, admission):
+        size_before = directory_size(planned_item.item_dir)
+        growth = 0
+        try:
+            processor = self.process_item(planned_item.item_dir)
+            # a packed item's folder is still there until its shared archive is closed, but is as good as gone
+            size_after = (0 if processor.packed else directory_size(planned_item.item_dir)) + processor.archive_bytes
+            if processor.status == "success":
+                growth = self.planner.record_actual(planned_item, size_before, size_after)
+            else:
+                growth = size_after - size_before
+        except BaseException as e:
+            # one item's failure, including the sys.exit calls for fatal item problems, must not end the batch
+            if not isinstance(e, SystemExit):
+                traceback.print_exc()
+            message = str(e) or type(e).__name__
+            print(f"Processing {planned_item.item_dir} failed: {message}")
+            self.record_status(planned_item.item_dir, "flagged", f"Processing failed: {message}")
+            if os.path.exists(planned_item.item_dir):
+                growth = directory_size(planned_item.item_dir) - size_before
+            if isinstance(e, KeyboardInterrupt):
+                raise
+        finally:
+            admission.release(planned_item, growth)
 
     def process_item(self, item_dir):
         item_processor = ItemProcessor.processor_for(self.transfer_type)
-        processor = item_processor(item_dir, keep_image=self.keep_image, nimbie_transfer=self.nimbie_transfer)
+        processor = item_processor(item_dir, **self.item_options(item_dir))
+        if self.progress:
+            processor.stage_listeners.append(self.progress.stage_changed)
+            self.progress.item_started(processor)
         processor.process()
-        item_status = processor.status
-        self.statuses[item_status].append(item_dir)
+        message = processor.message
+        if not message and processor.bag_path and processor.bag_path != item_dir:
+            message = f"Bagged in {processor.bag_path}"
+        disc = self.nimbie_manifest.get(os.path.basename(item_dir))
+        if disc and disc.status_message():
+            message = "; ".join(note for note in [message, disc.status_message()] if note)
+        self.record_status(item_dir, processor.status, message)
+        if processor.limit_exceeded:
+            with self.status_lock:
+                self.retry_alone.append(f"{item_dir}\t{processor.limit_exceeded}")
+        if processor.late_premis_events:
+            with self.status_lock:
+                self.late_premis_events.extend(dict(event, item=item_dir) for event in processor.late_premis_events)
+        if processor.rolled_back_premis_events:
+            with self.status_lock:
+                self.rolled_back_premis_events.extend(dict(event, item=item_dir) for event in processor.rolled_back_premis_events)
+        return processor
+
+    def item_options(self, item_dir):
+        return {
+            "options": self.options,
+            "nimbie_disc": self.nimbie_manifest.get(os.path.basename(item_dir)),
+            "bag_packer": self.bag_packer,
+            "pii_index": self.pii_index,
+            "autotuner": self.autotuner,
+            "batch_report": self.report
+        }
+
+    def record_status(self, item_dir, status, message=None):
+        with self.status_lock:
+            if message:
+                self.statuses[status].append(f"{item_dir}\t{message}")
+            else:
+                self.statuses[status].append(item_dir)
+        if self.report:
+            self.report.item_finished(os.path.basename(item_dir), status)
+        if self.progress:
+            self.progress.item_finished(item_dir, status)
+            print(f"Progress: {self.progress.summary()}")
+
+    def print_plan(self):
+        schedule = self.schedule()
+        rows, peak, budget = self.planner.simulate(schedule, self.options.workers)
+        print(f"Plan for {self.source_dir} ({self.transfer_type}, {self.options.workers} worker(s))")
+        print(f"{'Order':<6}{'Item':<40}{'Input':>12}{'Est. extra':>12}  Start")
+        for order, (planned_item, start) in enumerate(rows, start=1):
+            start_note = "SKIP (does not fit)" if start is None else f"after {format_size(start)} processed"
+            print(f"{order:<6}{os.path.basename(planned_item.item_dir):<40}{format_size(planned_item.input_size):>12}{format_size(planned_item.estimate):>12}  {start_note}")
+        print(f"Total input: {format_size(sum(item.input_size for item, _ in rows))}")
+        print(f"Expected peak extra space: {format_size(peak)}")
+        print(f"Usable free space: {format_size(budget)} (keeping {format_size(self.planner.margin)} free)")
+        for status, items in self.statuses.items():
+            for item in items:
+                print(f"Not processed ({status}): {item}")
 
     def write_logs(self):
         if not os.path.exists(self.logs_dir):
@@ -41,14 +222,54 @@ class BatchProcessor:
             with open(status_file, "w") as f:
                 f.write("\n".join(items))
 
+        if self.retry_alone:
+            print(f"{len(self.retry_alone)} item(s) were stopped by resource limits; see retry_alone.txt")
+            with open(os.path.join(self.logs_dir, "retry_alone.txt"), "w") as f:
+                f.write("\n".join(self.retry_alone))
 
-def process_batch(source_dir, transfer_type, keep_image=False):
-    batch_processor = BatchProcessor(source_dir, transfer_type, keep_image=keep_image)
-    batch_processor.process_batch()
+        if self.late_premis_events:
+            print(f"{len(self.late_premis_events)} PREMIS event(s) were recorded after bagging; see premis_after_bagging.csv")
+            self.write_premis_log("premis_after_bagging.csv", self.late_premis_events)
+
+        if self.rolled_back_premis_events:
+            print(f"{len(self.rolled_back_premis_events)} PREMIS event(s) of rolled back items were kept; see premis_rolled_back.csv")
+            self.write_premis_log("premis_rolled_back.csv", self.rolled_back_premis_events)
+
+        if self.options.device_limits and self.options.device_limits.started:
+            device_report = self.options.device_limits.report()
+            print("Device I/O:")
+            for line in device_report:
+                print(f"  {line}")
+            with open(os.path.join(self.logs_dir, "device_io.txt"), "w") as f:
+                f.write("\n".join(device_report))
+
+    def write_premis_log(self, filename, events):
+        with open(os.path.join(self.logs_dir, filename), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["item"] + PREMIS_HEADERS)
+            writer.writeheader()
+            writer.writerows(events)
 
 
-def process_nimbie_batch(source_dir, transfer_type, keep_image=False):
+def process_batch(source_dir, transfer_type, options, plan_only=False):
+    batch_processor = BatchProcessor(source_dir, transfer_type, options)
+    if plan_only:
+        batch_processor.print_plan()
+    else:
+        batch_processor.process_batch()
+
+
+def process_nimbie_batch(source_dir, transfer_type, options, plan_only=False):
+    options.nimbie_transfer = True
     batch_dirs = [item for item in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, item))]
+    if plan_only:
+        # the Nimbie batch directories are only unpacked for a real run
+        for batch_dir in batch_dirs:
+            batch_dirpath = os.path.join(source_dir, batch_dir)
+            nimbie_manifest = read_nimbie_logs(batch_dirpath, batch_dirpath)
+            batch_processor = BatchProcessor(batch_dirpath, transfer_type, options, nimbie_manifest=nimbie_manifest)
+            batch_processor.print_plan()
+        return
+    nimbie_manifest = {}
     for batch_dir in batch_dirs:
         batch_dirpath = os.path.join(source_dir, batch_dir)
         if not os.path.exists(os.path.join(batch_dirpath, "batch.log")):
@@ -58,10 +279,20 @@ def process_nimbie_batch(source_dir, transfer_type, keep_image=False):
         os.makedirs(transfer_logs_dir)
         for transfer_file in transfer_files:
             shutil.move(os.path.join(batch_dirpath, transfer_file), transfer_logs_dir)
+        batch_manifest = read_nimbie_logs(batch_dirpath, transfer_logs_dir)
+        write_disc_manifest(batch_manifest, os.path.join(transfer_logs_dir, "disc_manifest.csv"))
+        nimbie_manifest.update(batch_manifest)
         transfer_items = [item for item in os.listdir(batch_dirpath) if os.path.isdir(os.path.join(batch_dirpath, item))]
         for transfer_item in transfer_items:
             item_path = os.path.join(batch_dirpath, transfer_item)
             shutil.move(item_path, source_dir)
         os.rmdir(batch_dirpath)
-    batch_processor = BatchProcessor(source_dir, transfer_type, keep_image=keep_image, nimbie_transfer=True)
+    batch_processor = BatchProcessor(source_dir, transfer_type, options, nimbie_manifest=nimbie_manifest)
     batch_processor.process_batch()
+
+
+def read_nimbie_logs(batch_dirpath, transfer_logs_dir):
+    disc_names = [item for item in os.listdir(batch_dirpath) if os.path.isdir(os.path.join(batch_dirpath, item))]
+    log_parser = NimbieLogParser(disc_names)
+    log_parser.check_disc_folders(batch_dirpath)
+    return log_parser.parse_transfer_logs(transfer_logs_dir)
@@ -0,0 +1,177 @@
+import csv
+import html
+import os
+import threading
+from collections import Counter
+
+from reuther_born_digital_utils.local_state import load_json, write_json_atomic
+from reuther_born_digital_utils.pii_findings import is_feature_file, iter_features
+from reuther_born_digital_utils.space_planner import format_size
+
+
+def summarize_siegfried(siegfried_csv):
+    """ Streams an item's siegfried.csv into format, MIME type and year counts, with duplicates by MD5 """
+    formats = {}
+    mime_types = Counter()
+    years = Counter()
+    checksums = Counter()
+    files = total_bytes = unidentified = errors = 0
+    with open(siegfried_csv, "r", encoding="utf-8", errors="replace", newline="") as f:
+        for row in csv.DictReader(f):
+            # sf writes lower-case headers; brunnhilde's own CSVs capitalize them
+            row = {(key or "").lower(): value for key, value in row.items()}
+            files += 1
+            size = int(row["filesize"]) if (row.get("filesize") or "").isdigit() else 0
+            total_bytes += size
+            puid = row.get("id") or "UNKNOWN"
+            if puid.upper() == "UNKNOWN":
+                unidentified += 1
+            if row.get("errors"):
+                errors += 1
+            key = "\t".join([puid, row.get("format") or "", row.get("version") or ""])
+            counts = formats.setdefault(key, [0, 0])
+            counts[0] += 1
+            counts[1] += size
+            mime_types[row.get("mime") or "unknown"] += 1
+            years[(row.get("modified") or "")[:4] or "unknown"] += 1
+            if row.get("md5"):
+                checksums[row["md5"]] += 1
+    duplicates = [count for count in checksums.values() if count > 1]
+    return {
+        "files": files,
+        "bytes": total_bytes,
+        "unidentified": unidentified,
+        "errors": errors,
+        "formats": formats,
+        "mime_types": dict(mime_types),
+        "years": dict(years),
+        "duplicate_files": sum(duplicates),
+        "duplicate_sets": len(duplicates)
+    }
+
+
+def count_features(be_dir):
+    """ Counts the features in each bulk_extractor feature file, raw or gzipped """
+    counts = Counter()
+    for filename in sorted(os.listdir(be_dir)):
+        name = filename[:-len(".gz")] if filename.endswith(".gz") else filename
+        if not is_feature_file(name):
+            continue
+        counts[name[:-len(".txt")]] += sum(1 for _ in iter_features(os.path.join(be_dir, filename)))
+    return {feature_type: count for feature_type, count in counts.items() if count}
+
+
+def write_csv(filepath, header, rows):
+    tmp_filepath = f"{filepath}.tmp{os.getpid()}"
+    with open(tmp_filepath, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp_filepath, filepath)
+
+
+def html_table(header, rows):
+    lines = ["<table>", "<tr>" + "".join(f"<th>{html.escape(str(cell))}</th>" for cell in header) + "</tr>"]
+    for row in rows:
+        lines.append("<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+class BatchReport:
+    """ A collection-level format and PII profile merged from each item's brunnhilde reports as items finish.
+
+    Each item's siegfried.csv and bulk_extractor feature files are read once into a small summary, kept in
+    batch_report.json so an interrupted batch picks up where it left off; the HTML and CSV reports are
+    rewritten from the summaries each time an item is added or finishes.
+    """
+    def __init__(self, logs_dir):
+        self.logs_dir = logs_dir
+        self.state_file = os.path.join(logs_dir, "batch_report.json")
+        self.lock = threading.Lock()
+        self.items = load_json(self.state_file, {}) or {}
+
+    def add_item(self, item, brunnhilde_dir):
+        siegfried_csv = os.path.join(brunnhilde_dir, "siegfried.csv")
+        if not os.path.exists(siegfried_csv):
+            print(f"No siegfried results at {siegfried_csv}; leaving {item} out of the batch report")
+            return
+        summary = summarize_siegfried(siegfried_csv)
+        be_dir = os.path.join(brunnhilde_dir, "bulk_extractor")
+        summary["features"] = count_features(be_dir) if os.path.isdir(be_dir) else {}
+        with self.lock:
+            summary["status"] = (self.items.get(item) or {}).get("status", "running")
+            self.items[item] = summary
+            self.write()
+
+    def item_finished(self, item, status):
+        with self.lock:
+            if item not in self.items:
+                return
+            self.items[item]["status"] = status
+            self.write()
+
+    def merged(self):
+        formats = {}
+        mime_types = Counter()
+        years = Counter()
+        features = {}
+        for item, summary in self.items.items():
+            for key, (files, size) in summary["formats"].items():
+                counts = formats.setdefault(key, [0, 0, 0])
+                counts[0] += files
+                counts[1] += size
+                counts[2] += 1
+            mime_types.update(summary["mime_types"])
+            years.update(summary["years"])
+            for feature_type, count in summary["features"].items():
+                counts = features.setdefault(feature_type, [0, 0])
+                counts[0] += count
+                counts[1] += 1
+        format_rows = sorted(
+            (key.split("\t") + counts for key, counts in formats.items()), key=lambda row: (-row[3], row[0])
+        )
+        feature_rows = sorted(([feature_type] + counts for feature_type, counts in features.items()), key=lambda row: (-row[1], row[0]))
+        item_rows = [
+            [
+                item, summary["status"], summary["files"], summary["bytes"], summary["unidentified"], summary["errors"],
+                summary["duplicate_files"], sum(summary["features"].values())
+            ]
+            for item, summary in sorted(self.items.items())
+        ]
+        return format_rows, feature_rows, item_rows, mime_types, years
+
+    def write(self):
+        format_rows, feature_rows, item_rows, mime_types, years = self.merged()
+        format_header = ["puid", "format", "version", "files", "bytes", "items"]
+        feature_header = ["feature_type", "features", "items"]
+        item_header = ["item", "status", "files", "bytes", "unidentified", "siegfried_errors", "duplicate_files", "pii_features"]
+        try:
+            write_json_atomic(self.state_file, self.items)
+            write_csv(os.path.join(self.logs_dir, "batch_report_formats.csv"), format_header, format_rows)
+            write_csv(os.path.join(self.logs_dir, "batch_report_pii.csv"), feature_header, feature_rows)
+            write_csv(os.path.join(self.logs_dir, "batch_report_items.csv"), item_header, item_rows)
+            self.write_html(format_header, format_rows, feature_header, feature_rows, item_header, item_rows, mime_types, years)
+        except OSError as e:
+            print(f"Unable to write the batch report: {e}")
+
+    def write_html(self, format_header, format_rows, feature_header, feature_rows, item_header, item_rows, mime_types, years):
+        total_files = sum(row[2] for row in item_rows)
+        total_bytes = sum(row[3] for row in item_rows)
+        sections = [
+            f"<h1>Batch report: {html.escape(os.path.basename(os.path.dirname(os.path.abspath(self.logs_dir))))}</h1>",
+            f"<p>{len(item_rows)} items, {total_files} files, {html.escape(format_size(total_bytes))}; "
+            f"{sum(row[4] for row in item_rows)} unidentified, {sum(row[6] for row in item_rows)} duplicates within items</p>",
+            "<h2>Formats</h2>", html_table(format_header, format_rows),
+            "<h2>MIME types</h2>", html_table(["mime_type", "files"], sorted(mime_types.items(), key=lambda row: (-row[1], row[0]))),
+            "<h2>Years last modified</h2>", html_table(["year", "files"], sorted(years.items())),
+            "<h2>Potentially sensitive information</h2>", html_table(feature_header, feature_rows),
+            "<h2>Items</h2>", html_table(item_header, item_rows)
+        ]
+        filepath = os.path.join(self.logs_dir, "batch_report.html")
+        tmp_filepath = f"{filepath}.tmp{os.getpid()}"
+        with open(tmp_filepath, "w", encoding="utf-8") as f:
+            f.write("<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>Batch report</title></head>\n<body>\n")
+            f.write("\n".join(sections))
+            f.write("\n</body>\n</html>\n")
+        os.replace(tmp_filepath, filepath)
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from reuther_born_digital_utils.space_planner import format_size
+
+
+# concurrent readers and writers allowed per device when the limits file doesn't name it
+DEFAULT_DEVICE_LIMITS = {
+    "rotational": {"readers": 1, "writers": 1},
+    "solid_state": {"readers": 4, "writers": 4}
+}
+SECTOR_SIZE = 512
+
+
+def existing_path(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def read_mountinfo(mountinfo="/proc/self/mountinfo"):
+    """ Returns {(major, minor): (mount point, source)}; the first mount of a device wins """
+    mounts = {}
+    try:
+        with open(mountinfo, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                separator = fields.index("-")
+                major, minor = (int(number) for number in fields[2].split(":"))
+                mount_point = fields[4].replace("\\040", " ")
+                mounts.setdefault((major, minor), (mount_point, fields[separator + 2]))
+    except (OSError, ValueError):
+        pass
+    return mounts
+
+
+def read_diskstats(diskstats="/proc/diskstats"):
+    """ Returns {kernel name: (bytes read, bytes written, milliseconds busy)} """
+    stats = {}
+    try:
+        with open(diskstats, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 14:
+                    continue
+                stats[fields[2]] = (int(fields[5]) * SECTOR_SIZE, int(fields[9]) * SECTOR_SIZE, int(fields[12]))
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+class Device:
+    def __init__(self, st_dev, mounts):
+        self.st_dev = st_dev
+        self.major, self.minor = os.major(st_dev), os.minor(st_dev)
+        self.mount_point, self.source = mounts.get((self.major, self.minor), ("", ""))
+        self.kernel_name = None
+        self.rotational = None
+        sys_path = f"/sys/dev/block/{self.major}:{self.minor}"
+        if os.path.exists(sys_path):
+            sys_path = os.path.realpath(sys_path)
+            self.kernel_name = os.path.basename(sys_path)
+            # partitions keep their queue settings on the parent disk
+            queue_dir = os.path.join(sys_path, "queue")
+            if not os.path.exists(queue_dir):
+                queue_dir = os.path.join(os.path.dirname(sys_path), "queue")
+            try:
+                with open(os.path.join(queue_dir, "rotational"), "r", encoding="utf-8") as f:
+                    self.rotational = f.read().strip() == "1"
+            except OSError:
+                pass
+
+    def names(self):
+        return [name for name in [self.mount_point, self.source, self.kernel_name, f"{self.major}:{self.minor}"] if name]
+
+    def label(self):
+        name = self.kernel_name or self.source or f"{self.major}:{self.minor}"
+        return f"{name} ({self.mount_point})" if self.mount_point else name
+
+
+class DeviceLimits:
+    """ Limits concurrent readers and writers per physical device across every item and stage in a batch """
+    def __init__(self, limits=None):
+        self.limits = {kind: dict(counts) for kind, counts in DEFAULT_DEVICE_LIMITS.items()}
+        for name, counts in (limits or {}).items():
+            self.limits.setdefault(name, {}).update(counts)
+        self.lock = threading.Lock()
+        self.mounts = read_mountinfo()
+        self.devices = {}
+        self.semaphores = {}
+        self.busy = {}
+        self.started = None
+        self.start_stats = {}
+
+    @classmethod
+    def from_file(cls, limits_file=None):
+        if not limits_file:
+            return cls()
+        try:
+            with open(limits_file, "r", encoding="utf-8") as f:
+                limits = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Unable to read device limits from {limits_file}: {e}")
+        return cls(limits)
+
+    def device_for(self, path):
+        st_dev = os.stat(existing_path(path)).st_dev
+        with self.lock:
+            if st_dev not in self.devices:
+                device = Device(st_dev, self.mounts)
+                self.devices[st_dev] = device
+                for kind in ["readers", "writers"]:
+                    self.semaphores[(st_dev, kind)] = threading.Semaphore(self.limit_for(device, kind))
+            return self.devices[st_dev]
+
+    def limit_for(self, device, kind):
+        for name in device.names():
+            if kind in self.limits.get(name, {}):
+                return max(1, int(self.limits[name][kind]))
+        # unknown devices (e.g. network shares) are treated like spinning disks
+        default = "solid_state" if device.rotational is False else "rotational"
+        return max(1, int(self.limits[default][kind]))
+
+    @contextmanager
+    def io_slots(self, reads=(), writes=()):
+        """ Hold a reader slot on the device of each path in reads and a writer slot for each in writes """
+        slots = set()
+        for kind, paths in [("readers", reads), ("writers", writes)]:
+            for path in paths:
+                slots.add((self.device_for(path).st_dev, kind))
+        # always acquire in the same order so two stages can't each hold what the other waits for
+        with ExitStack() as stack:
+            for slot in sorted(slots):
+                self.semaphores[slot].acquire()
+                stack.callback(self.semaphores[slot].release)
+            started = time.time()
+            try:
+                yield
+            finally:
+                with self.lock:
+                    for st_dev, kind in slots:
+                        self.busy[(st_dev, kind)] = self.busy.get((st_dev, kind), 0) + time.time() - started
+
+    def start(self):
+        self.started = time.time()
+        self.start_stats = read_diskstats()
+
+    def report(self):
+        """ Per-device lines of bytes moved (from /proc/diskstats) and time spent holding slots """
+        elapsed = max(time.time() - (self.started or time.time()), 0.001)
+        end_stats = read_diskstats()
+        lines = []
+        for st_dev, device in sorted(self.devices.items(), key=lambda entry: entry[1].label()):
+            line = (
+                f"{device.label()}: readers {self.limit_for(device, 'readers')}, writers {self.limit_for(device, 'writers')}; "
+                f"held {self.busy.get((st_dev, 'readers'), 0):.0f}s reading, {self.busy.get((st_dev, 'writers'), 0):.0f}s writing"
+            )
+            if device.kernel_name in end_stats and device.kernel_name in self.start_stats:
+                read_bytes, written_bytes, busy_ms = (
+                    end - start for end, start in zip(end_stats[device.kernel_name], self.start_stats[device.kernel_name])
+                )
+                line += (
+                    f"; read {format_size(read_bytes)} ({format_size(read_bytes / elapsed)}/s), "
+                    f"wrote {format_size(written_bytes)} ({format_size(written_bytes / elapsed)}/s), "
+                    f"{min(100, busy_ms / 10 / elapsed):.0f}% busy"
+                )
+            lines.append(line)
+        return lines
@@ -0,0 +1,161 @@
+import gzip
+import io
+import os
+import shutil
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from xml.sax.saxutils import escape
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# file name suffix for each --dfxml_compression choice
+DFXML_COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def dfxml_filename(compression="none"):
+    if compression == "zstd" and zstandard is None:
+        sys.exit("Writing zstd-compressed DFXML requires the zstandard package (pip install zstandard)")
+    return f"dfxml.xml{DFXML_COMPRESSIONS[compression]}"
+
+
+def is_compressed(dfxml_file):
+    return dfxml_file.endswith(".gz") or dfxml_file.endswith(".zst")
+
+
+def open_dfxml(dfxml_file, mode="rb"):
+    """ Opens a DFXML file as a binary stream, compressing or decompressing by its extension """
+    if dfxml_file.endswith(".gz"):
+        return gzip.open(dfxml_file, mode, compresslevel=6)
+    if dfxml_file.endswith(".zst"):
+        if zstandard is None:
+            raise OSError(f"Reading {dfxml_file} requires the zstandard package (pip install zstandard)")
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(dfxml_file, "wb"), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(dfxml_file, "rb"), closefd=True)
+    return open(dfxml_file, mode)
+
+
+def copy_pipe(read_fd, out):
+    with open(read_fd, "rb") as pipe:
+        shutil.copyfileobj(pipe, out, COPY_BUFFER_SIZE)
+
+
+@contextmanager
+def dfxml_output(dfxml_file):
+    """ A stdout for a tool that prints DFXML, compressed on the way to a .gz or .zst file without an uncompressed copy """
+    if not is_compressed(dfxml_file):
+        with open(dfxml_file, "wb") as f:
+            yield f
+        return
+    read_fd, write_fd = os.pipe()
+    with open_dfxml(dfxml_file, "wb") as out:
+        thread = threading.Thread(target=copy_pipe, args=(read_fd, out), daemon=True)
+        thread.start()
+        try:
+            yield write_fd
+        finally:
+            # the tool has exited, so closing our end lets the copy see the end of the stream
+            os.close(write_fd)
+            thread.join()
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_fileobject_elements(dfxml_file):
+    """ Stream <fileobject> elements out of a DFXML file without holding the whole tree """
+    with open_dfxml(dfxml_file, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("end",)):
+            if local_name(elem.tag) == "fileobject":
+                yield elem
+                elem.clear()
+
+
+def iter_fileobject_fields(dfxml_file):
+    """ Yields ({field: text}, {hash type: digest}) for each <fileobject> in a DFXML file """
+    for elem in iter_fileobject_elements(dfxml_file):
+        fields = {}
+        hashes = {}
+        for child in elem:
+            name = local_name(child.tag)
+            if name == "hashdigest":
+                hashes[child.get("type", "").lower()] = (child.text or "").strip().lower()
+            else:
+                fields[name] = (child.text or "").strip()
+        yield fields, hashes
+
+
+def iter_file_hashes(dfxml_file):
+    """ Yields (filename, filesize, md5) for allocated regular files listed in a DFXML file """
+    for fields, hashes in iter_fileobject_fields(dfxml_file):
+        md5 = hashes.get("md5")
+        if fields.get("name_type") not in [None, "r"]:
+            continue
+        if fields.get("unalloc") == "1" or fields.get("alloc") == "0":
+            continue
+        if not md5 or not fields.get("filename"):
+            continue
+        try:
+            filesize = int(fields.get("filesize", 0))
+        except ValueError:
+            filesize = 0
+        yield fields["filename"], filesize, md5
+
+
+DFXML_NAMESPACE = "http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML"
+# XML 1.0 can't carry most control characters, which old file systems allow in names
+INVALID_XML_CHARS = {code: "\ufffd" for code in list(range(0x00, 0x09)) + [0x0B, 0x0C] + list(range(0x0E, 0x20))}
+
+
+def xml_text(value):
+    return escape(str(value).translate(INVALID_XML_CHARS))
+
+
+class DfxmlWriter:
+    """ Writes DFXML one element at a time, so a file system walk can describe files as it extracts them """
+    def __init__(self, dfxml_file, program, version, image_path=None):
+        self.f = io.TextIOWrapper(open_dfxml(dfxml_file, "wb"), encoding="utf-8")
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.f.write(f'<dfxml xmlns="{DFXML_NAMESPACE}" version="1.0">\n')
+        self.f.write(f"  <creator>\n    <program>{xml_text(program)}</program>\n    <version>{xml_text(version)}</version>\n  </creator>\n")
+        if image_path:
+            self.f.write(
+                f"  <source>\n    <image_filename>{xml_text(image_path)}</image_filename>\n"
+                f"    <imagesize>{os.path.getsize(image_path)}</imagesize>\n  </source>\n"
+            )
+
+    def start_volume(self, offset, fields):
+        self.f.write(f'  <volume offset="{offset}">\n')
+        for name, value in fields.items():
+            self.f.write(f"    <{name}>{xml_text(value)}</{name}>\n")
+
+    def end_volume(self):
+        self.f.write("  </volume>\n")
+
+    def fileobject(self, fields, byte_runs=(), hashes=None):
+        """ fields are written in order; byte_runs are (file offset, image offset, length) """
+        lines = ["    <fileobject>"]
+        for name, value in fields.items():
+            if value is not None:
+                lines.append(f"      <{name}>{xml_text(value)}</{name}>")
+        if byte_runs:
+            lines.append("      <byte_runs>")
+            for file_offset, img_offset, length in byte_runs:
+                lines.append(f'        <byte_run file_offset="{file_offset}" img_offset="{img_offset}" len="{length}"/>')
+            lines.append("      </byte_runs>")
+        for algorithm, digest in (hashes or {}).items():
+            lines.append(f'      <hashdigest type="{algorithm}">{digest}</hashdigest>')
+        lines.append("    </fileobject>\n")
+        self.f.write("\n".join(lines))
+
+    def close(self):
+        self.f.write("</dfxml>\n")
+        self.f.close()
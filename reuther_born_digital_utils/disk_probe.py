@@ -0,0 +1,287 @@
+import os
+import struct
+
+
+SECTOR_SIZE = 512
+PROBE_VERSION = "disk_probe 1"
+# MBR partition types that hold a chain of logical partitions
+EXTENDED_PARTITION_TYPES = [0x05, 0x0F, 0x85]
+GPT_PROTECTIVE_TYPE = 0xEE
+# Apple partition map entries that never hold a file system
+APM_SKIP_TYPES = ["apple_partition_map", "apple_driver", "apple_driver43", "apple_driver_ata", "apple_free", "apple_patches", "apple_void"]
+ISO_DESCRIPTOR_OFFSET = 16 * 2048
+MAX_ISO_DESCRIPTORS = 64
+
+
+def read_at(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
+
+
+class Partition:
+    """ A partition found in an image; start and length are in 512-byte sectors """
+    def __init__(self, slot, start, length=None, description="", filesystems=None, details=None):
+        self.slot = slot
+        self.start = start
+        self.length = length
+        self.description = description
+        self.filesystems = filesystems or []
+        self.details = details or []
+
+    def as_dict(self):
+        return {
+            "slot": self.slot,
+            "start": self.start,
+            "length": self.length,
+            "description": self.description,
+            "filesystems": self.filesystems,
+            "details": self.details
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["slot"], int(data["start"]), data.get("length"), data.get("description", ""),
+            data.get("filesystems"), data.get("details")
+        )
+
+
+class ProbeResult:
+    def __init__(self, image_path, size):
+        self.image_path = image_path
+        self.size = size
+        self.scheme = None
+        self.partitions = []
+        # file systems of an unpartitioned image
+        self.filesystems = []
+        self.details = []
+
+    def found_filesystems(self):
+        return bool(self.filesystems) or any(partition.filesystems for partition in self.partitions)
+
+    def report(self):
+        """ A disktype-like summary, written for provenance when requested """
+        lines = [f"--- {self.image_path}", f"Regular file, size {self.size} bytes"]
+        if self.scheme:
+            lines.append(f"{self.scheme.upper()} partition map, {len(self.partitions)} partitions with file systems")
+            for partition in self.partitions:
+                length = "" if partition.length is None else f"{partition.length} sectors "
+                lines.append(f"Partition {partition.slot}: {length}from {partition.start} ({partition.description})")
+                lines.extend(f"  {detail} file system" for detail in partition.details)
+        lines.extend(f"{detail} file system" for detail in self.details)
+        if not self.found_filesystems():
+            lines.append("No known file system found")
+        return "\n".join(lines) + "\n"
+
+
+def fat_type(boot_sector):
+    """ Returns FAT12/FAT16/FAT32 for a plausible FAT boot sector, otherwise None """
+    if len(boot_sector) < 512:
+        return None
+    bytes_per_sector, sectors_per_cluster, reserved, fat_count, root_entries, total_16, media, fat_size_16 = struct.unpack(
+        "<HBHBHHBH", boot_sector[11:24]
+    )
+    if bytes_per_sector not in [512, 1024, 2048, 4096] or sectors_per_cluster not in [1, 2, 4, 8, 16, 32, 64, 128]:
+        return None
+    if reserved < 1 or fat_count not in [1, 2] or not (media == 0xF0 or media >= 0xF8):
+        return None
+    if boot_sector[82:87] == b"FAT32":
+        return "FAT32"
+    if boot_sector[54:59] in [b"FAT12", b"FAT16"]:
+        return boot_sector[54:59].decode("ascii")
+    total_sectors = total_16 or struct.unpack("<I", boot_sector[32:36])[0]
+    fat_size = fat_size_16 or struct.unpack("<I", boot_sector[36:40])[0]
+    root_dir_sectors = (root_entries * 32 + bytes_per_sector - 1) // bytes_per_sector
+    data_sectors = total_sectors - (reserved + fat_count * fat_size + root_dir_sectors)
+    if data_sectors <= 0:
+        return None
+    clusters = data_sectors // sectors_per_cluster
+    if clusters < 4085:
+        return "FAT12"
+    elif clusters < 65525:
+        return "FAT16"
+    return "FAT32"
+
+
+def detect_filesystems(f, offset=0):
+    """ Returns [(name, detail)] for the file system superblocks found at offset; names match the extraction lists """
+    found = []
+    boot_sector = read_at(f, offset, SECTOR_SIZE)
+    if boot_sector[3:11] == b"NTFS    ":
+        found.append(("ntfs", "NTFS"))
+    elif boot_sector[3:11] == b"EXFAT   ":
+        found.append(("exfat", "exFAT"))
+    elif boot_sector[510:512] == b"\x55\xaa" or boot_sector[:1] in [b"\xeb", b"\xe9"]:
+        fat = fat_type(boot_sector)
+        if fat:
+            found.append(("fat", fat))
+
+    superblock = read_at(f, offset + 1024, 1024)
+    if len(superblock) >= 128:
+        if superblock[:2] in [b"H+", b"HX"]:
+            found.append(("hfs plus", "HFS Plus"))
+        elif superblock[:2] == b"BD":
+            # an HFS wrapper around an embedded HFS Plus volume
+            if superblock[124:126] in [b"H+", b"HX"]:
+                found.append(("hfs plus", "HFS Plus (in HFS wrapper)"))
+            else:
+                found.append(("hfs", "HFS"))
+        elif superblock[56:58] == b"\x53\xef":
+            found.append(("ext", "Ext2/3/4"))
+
+    for index in range(MAX_ISO_DESCRIPTORS):
+        descriptor = read_at(f, offset + ISO_DESCRIPTOR_OFFSET + index * 2048, 8)
+        identifier = descriptor[1:6]
+        if identifier == b"CD001":
+            if ("iso9660", "ISO9660") not in found:
+                found.append(("iso9660", "ISO9660"))
+            if descriptor[:1] == b"\xff":
+                # set terminator; a UDF volume recognition sequence may follow
+                continue
+        elif identifier in [b"NSR02", b"NSR03"]:
+            found.append(("udf", f"UDF ({identifier.decode('ascii')})"))
+        elif identifier in [b"BEA01", b"TEA01", b"BOOT2", b"CDW02"]:
+            continue
+        else:
+            break
+    return found
+
+
+def parse_mbr(f, image_sectors):
+    sector = read_at(f, 0, SECTOR_SIZE)
+    if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xaa":
+        return None
+    entries = []
+    for index in range(4):
+        entry = sector[446 + index * 16:446 + (index + 1) * 16]
+        status, partition_type = entry[0], entry[4]
+        start, length = struct.unpack("<II", entry[8:16])
+        if status not in [0x00, 0x80]:
+            return None
+        if partition_type == 0 or length == 0:
+            continue
+        if start == 0 or start >= image_sectors:
+            return None
+        entries.append((index, partition_type, start, length))
+    return entries or None
+
+
+def logical_partitions(f, extended_start, image_sectors, first_slot):
+    partitions = []
+    ebr_start = extended_start
+    slot = first_slot
+    seen = set()
+    while ebr_start and ebr_start < image_sectors and ebr_start not in seen:
+        seen.add(ebr_start)
+        sector = read_at(f, ebr_start * SECTOR_SIZE, SECTOR_SIZE)
+        if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xaa":
+            break
+        partition_type = sector[446 + 4]
+        start, length = struct.unpack("<II", sector[446 + 8:446 + 16])
+        if partition_type and length:
+            partitions.append((slot, partition_type, ebr_start + start, length))
+            slot += 1
+        next_start = struct.unpack("<I", sector[462 + 8:462 + 12])[0]
+        ebr_start = extended_start + next_start if next_start else 0
+    return partitions
+
+
+def parse_gpt(f):
+    header = read_at(f, SECTOR_SIZE, SECTOR_SIZE)
+    if header[:8] != b"EFI PART":
+        return None
+    entries_lba, entry_count, entry_size = struct.unpack("<QII", header[72:88])
+    if entry_size < 128 or entry_count > 1024:
+        return None
+    table = read_at(f, entries_lba * SECTOR_SIZE, entry_count * entry_size)
+    partitions = []
+    for index in range(entry_count):
+        entry = table[index * entry_size:(index + 1) * entry_size]
+        if len(entry) < 128 or entry[:16] == b"\x00" * 16:
+            continue
+        first, last = struct.unpack("<QQ", entry[32:48])
+        name = entry[56:128].decode("utf-16-le", errors="replace").rstrip("\x00")
+        partitions.append((index, name or "GPT partition", first, last - first + 1))
+    return partitions
+
+
+def parse_apm(f):
+    ddm = read_at(f, 0, SECTOR_SIZE)
+    if ddm[:2] != b"ER":
+        return None
+    block_size = struct.unpack(">H", ddm[2:4])[0] or SECTOR_SIZE
+    # partition map entries are usually 512 bytes apart, but some CDs use the device block size
+    for entry_size in sorted(set([SECTOR_SIZE, block_size])):
+        first = read_at(f, entry_size, SECTOR_SIZE)
+        if first[:2] == b"PM":
+            break
+    else:
+        return None
+    map_entries = struct.unpack(">I", first[4:8])[0]
+    partitions = []
+    for index in range(min(map_entries, 256)):
+        entry = read_at(f, entry_size * (index + 1), SECTOR_SIZE)
+        if entry[:2] != b"PM":
+            break
+        start, count = struct.unpack(">II", entry[8:16])
+        name = entry[16:48].split(b"\x00")[0].decode("ascii", errors="replace")
+        partition_type = entry[48:80].split(b"\x00")[0].decode("ascii", errors="replace")
+        scale = entry_size // SECTOR_SIZE
+        partitions.append((index, f"{partition_type} {name}".strip(), start * scale, count * scale))
+    return partitions
+
+
+def probe_image(image_path):
+    """ Reads an image's partition map and file system superblocks without running any external tools """
+    size = os.path.getsize(image_path)
+    result = ProbeResult(image_path, size)
+    image_sectors = size // SECTOR_SIZE
+    with open(image_path, "rb") as f:
+        whole_image = detect_filesystems(f)
+        entries = None
+        if not any(name in ["fat", "ntfs", "exfat"] for name, _ in whole_image):
+            apm = parse_apm(f)
+            mbr = parse_mbr(f, image_sectors) if apm is None else None
+            if apm is not None:
+                result.scheme = "apm"
+                entries = [
+                    (f"{index:03d}", description, start, length) for index, description, start, length in apm
+                    if description.split()[0].lower() not in APM_SKIP_TYPES
+                ]
+            elif mbr and any(partition_type == GPT_PROTECTIVE_TYPE for _, partition_type, _, _ in mbr):
+                gpt = parse_gpt(f)
+                if gpt is not None:
+                    result.scheme = "gpt"
+                    entries = [(f"{index:03d}", name, start, length) for index, name, start, length in gpt]
+            elif mbr:
+                result.scheme = "mbr"
+                entries = []
+                # logical partitions are numbered after the four primary slots
+                next_logical = 4
+                for index, partition_type, start, length in mbr:
+                    if partition_type in EXTENDED_PARTITION_TYPES:
+                        for slot, logical_type, logical_start, logical_length in logical_partitions(f, start, image_sectors, next_logical):
+                            entries.append((f"{slot:03d}", f"type 0x{logical_type:02X}", logical_start, logical_length))
+                            next_logical = slot + 1
+                    else:
+                        entries.append((f"{index:03d}", f"type 0x{partition_type:02X}", start, length))
+
+        for slot, description, start, length in entries or []:
+            found = detect_filesystems(f, start * SECTOR_SIZE)
+            if found:
+                result.partitions.append(Partition(
+                    slot, start, length, description, [name for name, _ in found], [detail for _, detail in found]
+                ))
+
+    if result.scheme == "apm" and any(name == "iso9660" for name, _ in whole_image):
+        # a hybrid CD: the Apple partitions and the ISO9660/UDF volumes share the same data
+        for partition in result.partitions:
+            whole_image.extend(zip(partition.filesystems, partition.details))
+        result.scheme = None
+        result.partitions = []
+    if not result.partitions:
+        for name, detail in whole_image:
+            if name not in result.filesystems:
+                result.filesystems.append(name)
+                result.details.append(detail)
+    return result
@@ -0,0 +1,298 @@
+import datetime
+import hashlib
+import os
+import struct
+import time
+
+from reuther_born_digital_utils.disk_probe import SECTOR_SIZE, fat_type
+
+
+FAT_READER_VERSION = "fat_reader 1"
+ATTR_VOLUME_LABEL = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LONG_NAME = 0x0F
+DELETED = 0xE5
+# a fiwalk-style partition number for the DFXML
+DEFAULT_PARTITION = 1
+END_OF_CHAIN = {"FAT12": 0xFF8, "FAT16": 0xFFF8, "FAT32": 0x0FFFFFF8}
+BAD_CLUSTER = {"FAT12": 0xFF7, "FAT16": 0xFFF7, "FAT32": 0x0FFFFFF7}
+
+
+class FatError(Exception):
+    pass
+
+
+def fat_datetime(date, time_of_day=0, centiseconds=0):
+    """ FAT timestamps are local time with two-second resolution; returns None for unset or invalid ones """
+    if not date:
+        return None
+    try:
+        return datetime.datetime(
+            1980 + (date >> 9), (date >> 5) & 0x0F, date & 0x1F,
+            time_of_day >> 11, (time_of_day >> 5) & 0x3F, min(59, (time_of_day & 0x1F) * 2 + centiseconds // 100)
+        )
+    except ValueError:
+        return None
+
+
+def short_name(entry):
+    base, extension = entry[0:8], entry[8:11]
+    if base[0] == 0x05:
+        base = b"\xe5" + base[1:]
+    base = base.decode("cp437").rstrip(" ")
+    extension = extension.decode("cp437").rstrip(" ")
+    # Windows NT records all-lowercase 8.3 names as flags rather than long names
+    if entry[12] & 0x08:
+        base = base.lower()
+    if entry[12] & 0x10:
+        extension = extension.lower()
+    return f"{base}.{extension}" if extension else base
+
+
+def safe_name(name):
+    """ A name read from the image, made usable as a single path component """
+    safe = "".join("_" if char in "/\\" or ord(char) < 0x20 or ord(char) == 0x7F else char for char in name)
+    return "_" * len(safe) if safe in [".", ".."] else safe
+
+
+def short_name_checksum(entry):
+    checksum = 0
+    for byte in entry[0:11]:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+class FatEntry:
+    def __init__(self, entry, name, path):
+        self.name = name
+        self.path = path
+        self.attributes = entry[11]
+        self.deleted = entry[0] == DELETED
+        self.size = struct.unpack("<I", entry[28:32])[0]
+        high, low = struct.unpack("<H", entry[20:22])[0], struct.unpack("<H", entry[26:28])[0]
+        self.first_cluster = (high << 16) | low
+        self.mtime = fat_datetime(struct.unpack("<H", entry[24:26])[0], struct.unpack("<H", entry[22:24])[0])
+        self.crtime = fat_datetime(struct.unpack("<H", entry[16:18])[0], struct.unpack("<H", entry[14:16])[0], entry[13])
+        self.atime = fat_datetime(struct.unpack("<H", entry[18:20])[0])
+
+    def is_directory(self):
+        return bool(self.attributes & ATTR_DIRECTORY)
+
+    def timestamp(self):
+        """ The modification time, falling back to creation time, as fix_dates applies them """
+        moment = self.mtime or self.crtime
+        return time.mktime(moment.timetuple()) if moment else None
+
+
+class FatVolume:
+    """ Walks a FAT12/16/32 file system once, copying out each file while hashing it and describing it in DFXML """
+    def __init__(self, f, offset=0, include_deleted=False):
+        self.f = f
+        self.offset = offset
+        self.include_deleted = include_deleted
+        f.seek(offset)
+        boot_sector = f.read(SECTOR_SIZE)
+        self.type = fat_type(boot_sector)
+        if not self.type:
+            raise FatError(f"No FAT boot sector at offset {offset}")
+        (self.bytes_per_sector, self.sectors_per_cluster, reserved, fat_count, root_entries, total_16, _,
+         fat_size_16) = struct.unpack("<HBHBHHBH", boot_sector[11:24])
+        self.total_sectors = total_16 or struct.unpack("<I", boot_sector[32:36])[0]
+        fat_size = fat_size_16 or struct.unpack("<I", boot_sector[36:40])[0]
+        self.cluster_size = self.bytes_per_sector * self.sectors_per_cluster
+        self.root_cluster = struct.unpack("<I", boot_sector[44:48])[0] if self.type == "FAT32" else None
+        self.root_offset = offset + (reserved + fat_count * fat_size) * self.bytes_per_sector
+        self.root_size = root_entries * 32
+        root_dir_sectors = (self.root_size + self.bytes_per_sector - 1) // self.bytes_per_sector
+        self.data_offset = self.root_offset + root_dir_sectors * self.bytes_per_sector
+        self.cluster_count = (self.total_sectors - (reserved + fat_count * fat_size + root_dir_sectors)) // self.sectors_per_cluster
+        f.seek(offset + reserved * self.bytes_per_sector)
+        self.fat = f.read(fat_size * self.bytes_per_sector)
+        self.files = 0
+        self.bytes = 0
+        # (path on the image, path extracted) for names that had to be changed
+        self.renamed = []
+        # entries left out because they couldn't be read
+        self.warnings = []
+
+    def next_cluster(self, cluster):
+        try:
+            if self.type == "FAT12":
+                value = struct.unpack("<H", self.fat[cluster + cluster // 2:cluster + cluster // 2 + 2])[0]
+                return value >> 4 if cluster & 1 else value & 0x0FFF
+            if self.type == "FAT16":
+                return struct.unpack("<H", self.fat[cluster * 2:cluster * 2 + 2])[0]
+            return struct.unpack("<I", self.fat[cluster * 4:cluster * 4 + 4])[0] & 0x0FFFFFFF
+        except (struct.error, IndexError):
+            # the boot sector claims more clusters than the FAT (or a truncated image) holds
+            raise FatError(f"Cluster {cluster} is past the end of the {len(self.fat)} byte {self.type} table")
+
+    def valid_cluster(self, cluster):
+        return 2 <= cluster < self.cluster_count + 2
+
+    def chain(self, first_cluster):
+        clusters = []
+        seen = set()
+        cluster = first_cluster
+        while self.valid_cluster(cluster) and cluster not in seen:
+            seen.add(cluster)
+            clusters.append(cluster)
+            cluster = self.next_cluster(cluster)
+            if cluster >= END_OF_CHAIN[self.type] or cluster == BAD_CLUSTER[self.type]:
+                break
+        return clusters
+
+    def deleted_clusters(self, entry):
+        """ Like tsk, assume a deleted file's clusters were contiguous and are still unallocated """
+        needed = (entry.size + self.cluster_size - 1) // self.cluster_size
+        clusters = list(range(entry.first_cluster, entry.first_cluster + needed))
+        if not all(self.valid_cluster(cluster) and self.next_cluster(cluster) == 0 for cluster in clusters):
+            return []
+        return clusters
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    def read_clusters(self, clusters):
+        for cluster in clusters:
+            self.f.seek(self.cluster_offset(cluster))
+            yield self.cluster_offset(cluster), self.f.read(self.cluster_size)
+
+    def directory_entries(self, data, parent):
+        long_name = {}
+        for index in range(0, len(data) - 31, 32):
+            entry = data[index:index + 32]
+            if entry[0] == 0x00:
+                break
+            if entry[11] == ATTR_LONG_NAME:
+                # deleted long names have lost their ordinals; deleted files keep their short names
+                if entry[0] == DELETED:
+                    continue
+                if entry[0] & 0x40:
+                    long_name = {"checksum": entry[13], "parts": {}}
+                if long_name:
+                    chars = entry[1:11] + entry[14:26] + entry[28:32]
+                    long_name["parts"][entry[0] & 0x1F] = chars
+                continue
+            name = short_name(entry)
+            if long_name and long_name["checksum"] == short_name_checksum(entry):
+                raw = b"".join(long_name["parts"][ordinal] for ordinal in sorted(long_name["parts"]))
+                name = raw.decode("utf-16-le", errors="replace").split("\x00")[0]
+            long_name = {}
+            if entry[11] & ATTR_VOLUME_LABEL or name in ["", ".", ".."]:
+                continue
+            if entry[0] == DELETED:
+                if not self.include_deleted:
+                    continue
+                name = "_" + name[1:]
+            safe = safe_name(name)
+            path = f"{parent}/{safe}" if parent else safe
+            if safe != name:
+                original = f"{parent}/{name}" if parent else name
+                print(f"Renamed {original!r} to {path!r}")
+                self.renamed.append((original, path))
+            yield FatEntry(entry, safe, path)
+
+    def root_entries(self):
+        if self.root_cluster is not None:
+            data = b"".join(block for _, block in self.read_clusters(self.chain(self.root_cluster)))
+        else:
+            self.f.seek(self.root_offset)
+            data = self.f.read(self.root_size)
+        return self.directory_entries(data, "")
+
+    def walk(self, out_folder, dfxml, partition=DEFAULT_PARTITION):
+        """ Extracts every file under out_folder and adds a <volume> of fileobjects to dfxml """
+        dfxml.start_volume(self.offset, {
+            "partition_offset": self.offset,
+            "sector_size": self.bytes_per_sector,
+            "block_size": self.cluster_size,
+            "ftype_str": self.type.lower(),
+            "block_count": self.cluster_count
+        })
+        os.makedirs(out_folder, exist_ok=True)
+        root_folder = os.path.realpath(out_folder)
+        directories = []
+        # a directory pointing back at one of its ancestors would otherwise nest forever; 0 is the root on FAT12/16
+        visited = {self.root_cluster or 0}
+        pending = [(self.root_entries(), out_folder)]
+        while pending:
+            entries, folder = pending.pop()
+            for entry in entries:
+                target = os.path.join(folder, entry.name)
+                if not os.path.realpath(target).startswith(root_folder + os.sep):
+                    self.warn(f"{entry.path}: skipped, it would be extracted outside {out_folder}")
+                    continue
+                if entry.is_directory():
+                    if entry.deleted:
+                        continue
+                    if entry.first_cluster in visited:
+                        self.warn(f"{entry.path}: skipped, it reuses cluster {entry.first_cluster} (a directory cycle)")
+                        continue
+                    visited.add(entry.first_cluster)
+                    try:
+                        clusters = self.chain(entry.first_cluster)
+                        data = b"".join(block for _, block in self.read_clusters(clusters))
+                        children = list(self.directory_entries(data, entry.path))
+                    except FatError as e:
+                        self.warn(f"{entry.path}: skipped, {e}")
+                        continue
+                    self.add_fileobject(dfxml, entry, partition, clusters, "d")
+                    os.makedirs(target, exist_ok=True)
+                    directories.append((target, entry))
+                    pending.append((children, target))
+                else:
+                    try:
+                        self.extract_file(entry, target, dfxml, partition)
+                    except FatError as e:
+                        self.warn(f"{entry.path}: skipped, {e}")
+        # set directory dates last, once nothing more is written into them
+        for target, entry in reversed(directories):
+            if entry.timestamp():
+                os.utime(target, (entry.timestamp(), entry.timestamp()))
+        dfxml.end_volume()
+
+    def warn(self, warning):
+        print(warning)
+        self.warnings.append(warning)
+
+    def extract_file(self, entry, target, dfxml, partition):
+        # the chain is read before the file is created, so an unreadable one leaves nothing behind
+        clusters = self.deleted_clusters(entry) if entry.deleted else self.chain(entry.first_cluster)
+        md5, sha1 = hashlib.md5(), hashlib.sha1()
+        remaining = entry.size
+        byte_runs = []
+        with open(target, "wb") as out:
+            for img_offset, block in self.read_clusters(clusters):
+                if remaining <= 0:
+                    break
+                block = block[:remaining]
+                out.write(block)
+                md5.update(block)
+                sha1.update(block)
+                if byte_runs and byte_runs[-1][1] + byte_runs[-1][2] == img_offset:
+                    byte_runs[-1][2] += len(block)
+                else:
+                    byte_runs.append([entry.size - remaining, img_offset, len(block)])
+                remaining -= len(block)
+        if entry.timestamp():
+            os.utime(target, (entry.timestamp(), entry.timestamp()))
+        self.files += 1
+        self.bytes += entry.size - remaining
+        self.add_fileobject(dfxml, entry, partition, clusters, "r", byte_runs, {"md5": md5.hexdigest(), "sha1": sha1.hexdigest()})
+
+    def add_fileobject(self, dfxml, entry, partition, clusters, name_type, byte_runs=None, hashes=None):
+        if byte_runs is None:
+            byte_runs = [(index * self.cluster_size, self.cluster_offset(cluster), self.cluster_size) for index, cluster in enumerate(clusters)]
+        dfxml.fileobject({
+            "filename": entry.path,
+            "partition": partition,
+            "name_type": name_type,
+            "filesize": entry.size if name_type == "r" else len(clusters) * self.cluster_size,
+            "alloc": 0 if entry.deleted else 1,
+            "unalloc": 1 if entry.deleted else None,
+            "meta_type": 2 if name_type == "d" else 1,
+            "mtime": entry.mtime.isoformat() if entry.mtime else None,
+            "crtime": entry.crtime.isoformat() if entry.crtime else None,
+            "atime": entry.atime.isoformat() if entry.atime else None
+        }, byte_runs, hashes)
@@ -0,0 +1,80 @@
+import datetime
+import sqlite3
+import threading
+
+from reuther_born_digital_utils.local_state import state_path
+
+
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    item TEXT NOT NULL,
+    path TEXT NOT NULL,
+    md5 TEXT NOT NULL,
+    size INTEGER,
+    pii_scanned INTEGER NOT NULL DEFAULT 0,
+    added TEXT,
+    PRIMARY KEY (item, path)
+);
+CREATE INDEX IF NOT EXISTS files_md5 ON files (md5);
+CREATE TABLE IF NOT EXISTS images (
+    item TEXT NOT NULL,
+    image TEXT NOT NULL,
+    md5 TEXT NOT NULL,
+    size INTEGER,
+    added TEXT,
+    PRIMARY KEY (item, image)
+);
+CREATE INDEX IF NOT EXISTS images_md5 ON images (md5);
+"""
+
+
+class HoldingsIndex:
+    """ Hashes of every file and disk image accessioned so far, shared across batches """
+    def __init__(self, db_path=None):
+        self.db_path = db_path or state_path("holdings_index.sqlite")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def lookup_files(self, md5s, exclude_item=None):
+        """ Returns {md5: [(item, path, pii_scanned)]} for hashes already in the index """
+        md5s = sorted(set(md5s))
+        matches = {}
+        with self.lock:
+            for start in range(0, len(md5s), LOOKUP_BATCH_SIZE):
+                chunk = md5s[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT md5, item, path, pii_scanned FROM files WHERE md5 IN ({placeholders})", chunk
+                )
+                for md5, item, path, pii_scanned in rows:
+                    if item != exclude_item:
+                        matches.setdefault(md5, []).append((item, path, bool(pii_scanned)))
+        return matches
+
+    def lookup_image(self, md5, exclude_item=None):
+        with self.lock:
+            rows = self.connection.execute("SELECT item, image FROM images WHERE md5 = ?", (md5,)).fetchall()
+        return [(item, image) for item, image in rows if item != exclude_item]
+
+    def add_item(self, item, files, images=()):
+        """ files: iterable of (path, md5, size, pii_scanned); images: iterable of (filename, md5, size) """
+        added = str(datetime.datetime.now())
+        with self.lock:
+            with self.connection:
+                self.connection.execute("DELETE FROM files WHERE item = ?", (item,))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO files (item, path, md5, size, pii_scanned, added) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((item, path, md5, size, int(pii_scanned), added) for path, md5, size, pii_scanned in files)
+                )
+                self.connection.execute("DELETE FROM images WHERE item = ?", (item,))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO images (item, image, md5, size, added) VALUES (?, ?, ?, ?, ?)",
+                    ((item, image_filename, image_md5, image_size, added) for image_filename, image_md5, image_size in images)
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
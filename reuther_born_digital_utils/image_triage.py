@@ -0,0 +1,76 @@
+import mmap
+import os
+import struct
+
+
+SECTOR_SIZE = 512
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 32
+# images up to this size are read in full before being called blank
+FULL_CHECK_SIZE = 16 * 1024 * 1024
+ISO_DESCRIPTORS = (32768, 32768 + 16 * 2048)
+# track-at-once CD-Rs routinely read a couple of 2048-byte sectors short of their declared volume size
+SHORT_TOLERANCE = 16 * 2048
+
+
+def declared_size(view):
+    """ The size an ISO9660 or FAT file system says its volume is, if the image holds one """
+    if len(view) >= ISO_DESCRIPTORS[0] + 2048 and view[ISO_DESCRIPTORS[0] + 1:ISO_DESCRIPTORS[0] + 6] == b"CD001":
+        descriptor = ISO_DESCRIPTORS[0]
+        volume_blocks = struct.unpack("<I", view[descriptor + 80:descriptor + 84])[0]
+        block_size = struct.unpack("<H", view[descriptor + 128:descriptor + 130])[0]
+        return volume_blocks * block_size
+    if len(view) >= SECTOR_SIZE and view[510:512] == b"\x55\xaa" and view[0:1] in [b"\xeb", b"\xe9"]:
+        bytes_per_sector, total_16 = struct.unpack("<H", view[11:13])[0], struct.unpack("<H", view[19:21])[0]
+        total_sectors = total_16 or struct.unpack("<I", view[32:36])[0]
+        if bytes_per_sector in [512, 1024, 2048, 4096]:
+            return total_sectors * bytes_per_sector
+    return None
+
+
+def sample_ranges(size):
+    """ The boot sectors, volume descriptors and evenly spaced stripes across the image """
+    ranges = [(0, min(size, SAMPLE_SIZE)), (ISO_DESCRIPTORS[0], min(size, ISO_DESCRIPTORS[1]))]
+    last_sample = max(0, size - SAMPLE_SIZE)
+    for index in range(SAMPLE_COUNT):
+        start = last_sample * index // (SAMPLE_COUNT - 1)
+        ranges.append((start, min(size, start + SAMPLE_SIZE)))
+    return sorted(set((start, end) for start, end in ranges if start < end))
+
+
+def uniform_byte(view, ranges):
+    """ The single byte value filling every range, or None if they hold anything else """
+    value = None
+    for start, end in ranges:
+        block = view[start:end]
+        if value is None:
+            value = block[0]
+        if block.count(value) != len(block):
+            return None
+    return value
+
+
+def triage_image(image_path):
+    """ Returns (verdict, message) for an empty, blank, all-0xFF, truncated or slightly short image, or None if it looks worth probing """
+    size = os.path.getsize(image_path)
+    if size == 0:
+        return "empty", "Disk image is empty (0 bytes)"
+    if size % SECTOR_SIZE:
+        return "truncated", f"Disk image is truncated ({size} bytes is not a whole number of {SECTOR_SIZE}-byte sectors)"
+    with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        ranges = sample_ranges(size)
+        value = uniform_byte(view, ranges)
+        checked = f"{len(ranges)} sampled blocks"
+        if value in [0x00, 0xFF] and size <= FULL_CHECK_SIZE:
+            value = uniform_byte(view, [(offset, min(size, offset + SAMPLE_SIZE)) for offset in range(0, size, SAMPLE_SIZE)])
+            checked = "the whole image"
+        if value == 0x00:
+            return "blank", f"Disk image appears blank (all zero bytes in {checked})"
+        if value == 0xFF:
+            return "blank", f"Disk image appears unwritten (all 0xFF bytes in {checked})"
+        expected = declared_size(view)
+    if expected and expected - size > SHORT_TOLERANCE:
+        return "truncated", f"Disk image is truncated ({size} bytes, but its file system declares {expected} bytes)"
+    if expected and expected > size:
+        return "short", f"Disk image is {expected - size} bytes short of the {expected} bytes its file system declares"
+    return None
@@ -3,36 +3,90 @@
 
 import csv
 import datetime
+import functools
+import hashlib
 import os
 import platform
 import shutil
 import subprocess
 import sys
 import time
+import traceback
+import xml.etree.ElementTree as ET
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 import Objects
 
+from reuther_born_digital_utils.bag_serializer import SerializedBagWriter
+from reuther_born_digital_utils.bag_validator import read_manifests
+from reuther_born_digital_utils.dfxml_io import DfxmlWriter, dfxml_filename, dfxml_output, is_compressed, iter_file_hashes, iter_fileobject_fields
+from reuther_born_digital_utils.disk_probe import PROBE_VERSION, SECTOR_SIZE, Partition, probe_image
+from reuther_born_digital_utils.fat_reader import FAT_READER_VERSION, FatError, FatVolume
+from reuther_born_digital_utils.image_triage import triage_image
+from reuther_born_digital_utils.nimbie_logs import write_disc_manifest
+from reuther_born_digital_utils.pii_findings import PiiFindingsIndex, compress_feature_files
+from reuther_born_digital_utils.probe_cache import executable_id
+from reuther_born_digital_utils.processing_options import ProcessingOptions
+from reuther_born_digital_utils.snapshots import ItemSnapshot
+from reuther_born_digital_utils.space_planner import directory_size, format_size
+from reuther_born_digital_utils.stages import Stage, StageRunner
+from reuther_born_digital_utils.tool_runner import ToolLimitExceeded, ToolTimeout, run_tool
+
+DEFAULT_IMAGE_EXTENSIONS = [".iso", ".img", ".001", ".dd", ".ima", ".raw"]
+# each mounted image gets its own directory here, so items processed in parallel never share a mount point
+MOUNT_ROOT = "/mnt/diskid"
+# hard link trees for bulk_extractor are built here, next to the items but outside them
+SCAN_DIRNAME = ".bulk_extractor_scans"
+PREMIS_HEADERS = ["eventType", "eventOutcomeDetail", "timestamp", "eventDetailInfo", "eventDetailInfo_additional", "linkingAgentIDvalue"]
+
 
 class ItemProcessor:
-    def __init__(self, item_dir, keep_image=False, nimbie_transfer=False):
+    def __init__(self, item_dir, options=None, nimbie_disc=None, bag_packer=None, pii_index=None, autotuner=None, batch_report=None):
         self.item_dir = item_dir
-        self.keep_image = keep_image
+        self.options = options or ProcessingOptions()
         self.status = None
         self.message = None
-        self.nimbie_transfer = nimbie_transfer
+        self.nimbie_disc = nimbie_disc
+        self.transfer_size = None
+        self.stage_listeners = []
+        self.stage_count = None
+        self.stage_workers = 3
+        self.bag_packer = bag_packer
+        self.bag_path = None
+        self.archive_bytes = 0
+        self.packed = False
+        self.payload_manifest = {}
+        self.payload_sizes = {}
+        # objects-relative paths of files left out of the bulk_extractor scan, and why
+        self.pii_exclusions = {}
+        self.pii_index = pii_index
+        self.pii_tier_counts = {}
+        self.failed = False
+        self.autotuner = autotuner
+        self.batch_report = batch_report
+        # set when a tool was killed for exceeding a memory or CPU limit, so the item can be retried alone
+        self.limit_exceeded = None
         self.check_dirs()
+        # taken before setup_dirs so a rollback returns the item exactly as it arrived
+        self.snapshot = ItemSnapshot(item_dir, self.options.snapshot) if self.options.snapshot else None
+        if self.snapshot:
+            self.snapshot.take()
         self.setup_dirs()
-        self.dfxml_file = os.path.join(self.subdoc_dir, "dfxml.xml")
+        self.dfxml_file = os.path.join(self.subdoc_dir, dfxml_filename(self.options.dfxml_compression))
         self.premis_csv = os.path.join(self.subdoc_dir, "premis.csv")
         self.brunnhilde_dir = os.path.join(self.subdoc_dir, "brunnhilde")
 
         self.premis_events = []
+        # how many events premis.csv held when it was written; later events (a bagging timeout) can't go in the bag
+        self.premis_written = None
+        self.late_premis_events = []
+        # events that went with premis.csv when a failed item was rolled back to its snapshot
+        self.rolled_back_premis_events = []
 
     def check_dirs(self):
         item_contents = sorted(os.listdir(self.item_dir))
         if "bagit.txt" in item_contents:
-            sys.exit(f"{self.item_dir} looks like it's already been bagged.")
+            sys.exit(f"{self.item_dir} looks like it's already been bagged. Use --update_bag to update its manifests after editing it.")
 
     def setup_dirs(self):
         self.objects_dir = os.path.join(self.item_dir, "objects")
@@ -43,10 +97,14 @@ class ItemProcessor:
             if not os.path.exists(dirpath):
                 os.makedirs(dirpath)
 
-        if self.nimbie_transfer:
-            os.makedirs(self.nimbie_transfer_dir)
+        if self.options.nimbie_transfer:
+            if not os.path.exists(self.nimbie_transfer_dir):
+                os.makedirs(self.nimbie_transfer_dir)
+            if self.nimbie_disc:
+                disc_manifest = os.path.join(self.nimbie_transfer_dir, "nimbie_disc_manifest.csv")
+                write_disc_manifest({self.nimbie_disc.name: self.nimbie_disc}, disc_manifest)
 
-    def record_premis(self, timestamp, event_type, event_outcome, event_detail, event_detail_note, agent_info):
+    def record_premis(self, timestamp, event_type, event_outcome, event_detail, event_detail_note, agent_info, events=None):
         premis_event = {}
         premis_event["eventType"] = event_type
         premis_event["eventOutcomeDetail"] = event_outcome
@@ -55,14 +113,58 @@ class ItemProcessor:
         premis_event["eventDetailInfo_additional"] = event_detail_note
         premis_event["linkingAgentIDvalue"] = agent_info
 
-        self.premis_events.append(premis_event)
+        (self.premis_events if events is None else events).append(premis_event)
 
     def write_premis_csv(self):
-        headers = ["eventType", "eventOutcomeDetail", "timestamp", "eventDetailInfo", "eventDetailInfo_additional", "linkingAgentIDvalue"]
-        with open(self.premis_csv, "a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(self.premis_events)
+        write_premis_events(self.premis_csv, self.premis_events)
+        self.premis_written = len(self.premis_events)
+
+    def all_premis_events(self):
+        return list(self.premis_events)
+
+    def get_transfer_size(self):
+        if self.transfer_size is None:
+            self.transfer_size = directory_size(self.objects_dir)
+        return self.transfer_size
+
+    def run_tool(self, stage, cmd, tool=None, event_type=None, size_bytes=None, **kwargs):
+        timeout = self.options.timeouts.for_tool(tool or stage, self.get_transfer_size() if size_bytes is None else size_bytes)
+        if self.options.resource_limits and self.options.resource_limits.for_tool(tool or stage):
+            with self.options.resource_limits.limited_run(tool or stage, stage) as limited_run:
+                return run_tool(cmd, stage, timeout=timeout, event_type=event_type, limited_run=limited_run, **kwargs)
+        return run_tool(cmd, stage, timeout=timeout, event_type=event_type, **kwargs)
+
+    def tool_version(self, version_cmd, stream="stdout"):
+        try:
+            version_result = self.run_tool(f"{version_cmd[0]} version check", version_cmd, tool="version", capture_output=True)
+        except (ToolTimeout, ToolLimitExceeded, OSError):
+            return "unknown version"
+        return getattr(version_result, stream).decode("utf-8")
+
+    def handle_timeout(self, timeout):
+        self.status = "flagged"
+        self.message = str(timeout)
+        self.record_premis(
+            str(datetime.datetime.now()),
+            timeout.event_type or "unknown",
+            f"timeout after {int(timeout.timeout)} seconds",
+            subprocess.list2cmdline(timeout.cmd),
+            f"Stopped {timeout.stage} after it exceeded its timeout",
+            "reuther_born_digital_utils watchdog"
+        )
+
+    def handle_limit_exceeded(self, limit_exceeded):
+        self.status = "flagged"
+        self.limit_exceeded = str(limit_exceeded)
+        self.message = f"{limit_exceeded}; retry this item on its own"
+        self.record_premis(
+            str(datetime.datetime.now()),
+            limit_exceeded.event_type or "unknown",
+            f"killed: {limit_exceeded.reason}",
+            subprocess.list2cmdline(limit_exceeded.cmd),
+            f"{limit_exceeded.stage} was stopped by a resource limit rather than failing on its own",
+            "reuther_born_digital_utils resource limits"
+        )
 
     def remove_system_files(self):
         self.filenames_to_remove = ["Thumbs.db", ".DS_Store", "Desktop DB", "Desktop DF"]
@@ -72,13 +174,13 @@ class ItemProcessor:
         deleted_targets = []
         for filepath in targets_to_remove["files"]:
             try:
-                os.remove(filepath)
+                self.remove_path(filepath)
                 deleted_targets.append(filepath)
             except OSError:
                 print(f"Failed to delete file: {filepath}")
         for dirpath in targets_to_remove["directories"]:
             try:
-                shutil.rmtree(dirpath)
+                self.remove_path(dirpath)
                 deleted_targets.append(dirpath)
             except OSError:
                 print(f"Failed to delete directory: {dirpath}")
@@ -115,32 +217,347 @@ class ItemProcessor:
     def run_brunnhilde(self):
         print("Running brunnhilde")
         brunnhilde_ver_cmd = ["brunnhilde.py", "-V"]
-        brunnhilde_ver = subprocess.run(brunnhilde_ver_cmd, capture_output=True).stdout.decode("utf-8").strip()
-        brunnhilde_cmd = ["brunnhilde.py", "-zbn", self.objects_dir, self.brunnhilde_dir]
+        brunnhilde_ver = self.tool_version(brunnhilde_ver_cmd).strip()
+        # when some files are left out of the PII scan, bulk_extractor is run separately on the rest;
+        # with the autotuner it always is, since brunnhilde can't pass on a thread count
+        scan_separately = bool(self.pii_exclusions or self.options.pii_policy or self.autotuner)
+        brunnhilde_flags = "-zn" if scan_separately else "-zbn"
+        brunnhilde_cmd = ["brunnhilde.py", brunnhilde_flags, self.objects_dir, self.brunnhilde_dir]
         timestamp = str(datetime.datetime.now())
-        brunnhilde_result = subprocess.run(brunnhilde_cmd)
+        brunnhilde_result = self.run_tool("brunnhilde", brunnhilde_cmd, event_type="metadata extraction")
         self.record_premis(
             timestamp,
             "metadata extraction",
             brunnhilde_result.returncode,
             subprocess.list2cmdline(brunnhilde_result.args),
-            "Determined file formats and scanned for potentially sensitive information",
+            "Determined file formats" if scan_separately else "Determined file formats and scanned for potentially sensitive information",
             brunnhilde_ver
         )
 
+        if self.options.pii_policy:
+            self.apply_pii_policy()
+        if scan_separately:
+            self.run_bulk_extractor()
         self.post_process_bulk_extractor_reports()
+        if self.batch_report:
+            self.batch_report.add_item(self.item_name(), self.brunnhilde_dir)
+
+    def apply_pii_policy(self):
+        siegfried_csv = os.path.join(self.brunnhilde_dir, "siegfried.csv")
+        if not os.path.exists(siegfried_csv):
+            print(f"No siegfried results at {siegfried_csv}; scanning every file for PII")
+            return
+        tiers = self.options.pii_policy.classify(siegfried_csv, self.objects_dir)
+        for relpath, tier in tiers.items():
+            if relpath in self.pii_exclusions:
+                tier = "duplicate"
+            elif tier == "skip":
+                self.pii_exclusions[relpath] = "low-risk format"
+            elif tier == "not sampled":
+                self.pii_exclusions[relpath] = "not sampled"
+            self.pii_tier_counts[tier] = self.pii_tier_counts.get(tier, 0) + 1
+
+    def run_bulk_extractor(self):
+        print("Running bulk_extractor")
+        be_dir = os.path.join(self.brunnhilde_dir, "bulk_extractor")
+        item_dir = os.path.normpath(os.path.abspath(self.item_dir))
+        scan_root = os.path.join(os.path.dirname(item_dir), SCAN_DIRNAME)
+        scan_dir = os.path.join(scan_root, os.path.basename(item_dir))
+        if os.path.exists(be_dir):
+            shutil.rmtree(be_dir)
+        # left behind if an earlier run crashed mid-scan
+        shutil.rmtree(scan_dir, ignore_errors=True)
+        scanned = 0
+        try:
+            # a hard link tree of the files to scan, so bulk_extractor never reads the excluded ones
+            for root, _, filenames in os.walk(self.objects_dir):
+                for filename in filenames:
+                    filepath = os.path.join(root, filename)
+                    relpath = os.path.relpath(filepath, self.objects_dir)
+                    if relpath in self.pii_exclusions or os.path.islink(filepath):
+                        continue
+                    link_path = os.path.join(scan_dir, relpath)
+                    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+                    try:
+                        os.link(filepath, link_path)
+                    except OSError:
+                        shutil.copy2(filepath, link_path)
+                    scanned += 1
+            os.makedirs(scan_dir, exist_ok=True)
+            be_ver = (self.tool_version(["bulk_extractor", "-V"]).splitlines() or ["unknown version"])[0]
+            be_cmd = [
+                "bulk_extractor", "-x", "aes", "-x", "base64", "-x", "elf", "-x", "exif", "-x", "gps", "-x", "hiberfile",
+                "-x", "httplogs", "-x", "json", "-x", "kml", "-x", "net", "-x", "pdf", "-x", "sqlite", "-x", "winlnk",
+                "-x", "winpe", "-x", "winprefetch", "-S", "ssn_mode=2", "-q", "-1", "-o", be_dir, "-R", "."
+            ]
+            if self.autotuner:
+                be_cmd[1:1] = ["-j", str(self.autotuner.tool_threads())]
+            timestamp = str(datetime.datetime.now())
+            be_result = self.run_tool("bulk_extractor", be_cmd, event_type="metadata extraction", cwd=scan_dir)
+        finally:
+            shutil.rmtree(scan_dir, ignore_errors=True)
+            try:
+                os.rmdir(scan_root)
+            except OSError:
+                pass
+
+        reasons = {}
+        for reason in self.pii_exclusions.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        skipped_note = "; ".join(f"{count} {reason}" for reason, count in sorted(reasons.items())) or "none"
+        note = f"Scanned {scanned} files for potentially sensitive information; not scanned: {skipped_note}"
+        if self.options.pii_policy:
+            tier_note = ", ".join(f"{tier} {count}" for tier, count in sorted(self.pii_tier_counts.items()))
+            note += f". PII scanning policy {self.options.pii_policy.describe()}: {tier_note}"
+        self.record_premis(
+            timestamp,
+            "metadata extraction",
+            be_result.returncode,
+            subprocess.list2cmdline(be_result.args),
+            note,
+            f"bulk_extractor: {be_ver}"
+        )
 
     def post_process_bulk_extractor_reports(self):
         be_dir = os.path.join(self.brunnhilde_dir, "bulk_extractor")
+        if not os.path.exists(be_dir):
+            return
         for filename in os.listdir(be_dir):
             filepath = os.path.join(be_dir, filename)
             if os.path.getsize(filepath) == 0:
                 os.remove(filepath)
 
+        if self.options.index_pii:
+            print("Indexing bulk_extractor features")
+            findings_db = os.path.join(self.brunnhilde_dir, "bulk_extractor_findings.sqlite")
+            if os.path.exists(findings_db):
+                os.remove(findings_db)
+            findings = PiiFindingsIndex(findings_db)
+            try:
+                counts = findings.ingest_dir(self.item_name(), be_dir)
+            finally:
+                findings.close()
+            if self.pii_index:
+                self.pii_index.merge(findings_db)
+            print(", ".join(f"{count} {feature_type}" for feature_type, count in sorted(counts.items())) or "No features found")
+        if self.options.compress_pii:
+            before, after = compress_feature_files(be_dir)
+            print(f"Compressed bulk_extractor feature files from {format_size(before)} to {format_size(after)}")
+
     def bag_item(self):
-        print("Bagging item")
-        bagit_cmd = ["bagit.py", "--quiet", "--md5", self.item_dir]
-        subprocess.run(bagit_cmd)
+        if self.options.holdings_index:
+            # taken before bagging, since a serialized bag's files are only inside the archive
+            self.payload_sizes = payload_sizes(self.item_dir)
+        if self.bag_packer and self.bag_packer.accepts(directory_size(self.item_dir)):
+            print("Packing item into a shared serialized bag")
+            self.bag_path, self.payload_manifest, self.archive_bytes = self.bag_packer.pack(self.item_dir)
+            # the packer removes the item once the shared archive is closed
+            self.packed = True
+        elif self.options.serialize:
+            self.write_serialized_bag()
+        else:
+            print("Bagging item")
+            bagit_cmd = ["bagit.py", "--quiet", "--md5", self.item_dir]
+            if self.autotuner:
+                bagit_cmd[1:1] = ["--processes", str(self.autotuner.tool_threads())]
+            bagit_result = self.run_tool("bagit", bagit_cmd, event_type="information package creation")
+            self.bag_path = self.item_dir
+            if bagit_result.returncode == 0:
+                self.payload_manifest = {
+                    relpath: digests["md5"] for relpath, digests in read_manifests(self.item_dir).items() if "md5" in digests
+                }
+        if self.options.holdings_index:
+            self.update_holdings_index()
+
+    def write_serialized_bag(self):
+        print(f"Writing item as a {self.options.serialize} bag")
+        archive_path = f"{os.path.normpath(self.item_dir)}.{self.options.serialize}"
+        bag_writer = SerializedBagWriter(archive_path, self.options.serialize)
+        try:
+            self.payload_manifest = bag_writer.add_bag(self.item_dir)
+        except BaseException:
+            bag_writer.discard()
+            raise
+        bag_writer.close()
+        self.archive_bytes = bag_writer.bytes_written()
+        self.bag_path = archive_path
+        shutil.rmtree(self.item_dir)
+
+    def item_name(self):
+        return os.path.basename(os.path.normpath(self.item_dir))
+
+    def holdings_key(self):
+        """ batch/item, since item names are only unique within a batch """
+        batch_dir = os.path.dirname(os.path.abspath(os.path.normpath(self.item_dir)))
+        return f"{os.path.basename(batch_dir)}/{self.item_name()}"
+
+    def add_duplicate_check(self, stages, after, before):
+        stages.append(Stage("duplicate_check", self.check_duplicates, requires=after))
+        for stage in stages:
+            if stage.name in before or (stage.name == "brunnhilde" and self.options.skip_scanned_pii):
+                stage.requires.append("duplicate_check")
+
+    def dfxml_sources(self):
+        """ [(DFXML file, objects-relative folder its filenames start from, or None when they don't map onto objects/)] """
+        return [(self.dfxml_file, "")]
+
+    def check_image_duplicates(self):
+        """ [(image filename, md5, previous item, previous image)] """
+        return []
+
+    def check_duplicates(self):
+        print("Checking for duplicates in previous holdings")
+        timestamp = str(datetime.datetime.now())
+        file_hashes = []
+        for dfxml_file, prefix in self.dfxml_sources():
+            try:
+                file_hashes.extend((filename, prefix, md5) for filename, _, md5 in iter_file_hashes(dfxml_file))
+            except (OSError, ET.ParseError) as e:
+                print(f"Unable to read file hashes from {dfxml_file}: {e}")
+        matches = self.options.holdings_index.lookup_files((md5 for _, _, md5 in file_hashes), exclude_item=self.holdings_key())
+        duplicates = [(filename, prefix, md5) for filename, prefix, md5 in file_hashes if md5 in matches]
+        image_duplicates = self.check_image_duplicates()
+
+        report = os.path.join(self.subdoc_dir, "duplicates_report.csv")
+        with open(report, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "md5", "previous_item", "previous_path"])
+            for image_filename, md5, item, image in image_duplicates:
+                writer.writerow([image_filename, md5, item, image])
+            for filename, prefix, md5 in duplicates:
+                for item, path, _ in matches[md5]:
+                    writer.writerow([os.path.join(prefix, filename) if prefix else filename, md5, item, path])
+
+        percentage = 100 * len(duplicates) / len(file_hashes) if file_hashes else 0
+        summary = f"{len(duplicates)} of {len(file_hashes)} files ({percentage:.1f}%) duplicate previous holdings"
+        if image_duplicates:
+            identical = sorted(set(f"{image_filename} ({item})" for image_filename, _, item, _ in image_duplicates))
+            summary += f"; disk images identical to previous holdings: {', '.join(identical)}"
+        print(summary)
+        self.record_premis(
+            timestamp,
+            "message digest calculation",
+            0,
+            f"holdings index ({self.options.holdings_index.db_path})",
+            f"Compared file hashes against previous holdings: {summary}",
+            f"Python {platform.python_version()} sqlite3"
+        )
+
+        if self.options.skip_scanned_pii:
+            for filename, prefix, md5 in duplicates:
+                if prefix is None:
+                    continue
+                relpath = os.path.normpath(os.path.join(prefix, filename))
+                if any(pii_scanned for _, _, pii_scanned in matches[md5]) and os.path.isfile(os.path.join(self.objects_dir, relpath)):
+                    self.pii_exclusions[relpath] = "already scanned in previous holdings"
+
+    def update_holdings_index(self):
+        files = []
+        for relpath, md5 in self.payload_manifest.items():
+            if not relpath.startswith("data/objects/"):
+                continue
+            objects_relpath = os.path.normpath(relpath[len("data/objects/"):])
+            size = self.payload_sizes.get(relpath)
+            # files skipped as duplicates were scanned with their earlier copy
+            pii_scanned = self.pii_exclusions.get(objects_relpath, "already scanned in previous holdings") == "already scanned in previous holdings"
+            files.append((relpath[len("data/"):], md5, size, pii_scanned))
+        self.options.holdings_index.add_item(self.holdings_key(), files, images=self.holdings_images())
+
+    def holdings_images(self):
+        """ [(image filename, md5, size)] """
+        return []
+
+    def build_stages(self):
+        """ The item's stages, in the order they are listed for the runner; each transfer type defines its own """
+        return []
+
+    def stage_io(self):
+        """ {stage name: (paths read, paths written)} for stages that move data on disk """
+        return {}
+
+    def limit_stage_io(self, stages):
+        stage_io = self.stage_io()
+        for stage in stages:
+            if stage.name in stage_io:
+                stage.func = self.with_io_slots(stage.func, *stage_io[stage.name])
+        return stages
+
+    def with_io_slots(self, func, reads, writes):
+        def limited():
+            with self.options.device_limits.io_slots(reads, writes):
+                func()
+        return limited
+
+    def process(self):
+        self.stages = {}
+        stages = self.build_stages()
+        if self.options.device_limits:
+            stages = self.limit_stage_io(stages)
+        self.stage_count = len(stages)
+        runner = StageRunner(
+            stages,
+            max_workers=self.stage_workers,
+            should_continue=lambda: self.status not in ["skipped", "flagged"],
+            on_status=self.stage_status_changed,
+            on_error=self.stage_failed
+        )
+        self.stages = runner.run()
+        if self.premis_written is not None:
+            self.late_premis_events = self.premis_events[self.premis_written:]
+        if self.late_premis_events:
+            late_note = f"{len(self.late_premis_events)} PREMIS event(s) recorded after premis.csv was bagged"
+            self.message = "; ".join(note for note in [self.message, late_note] if note)
+        if self.status is None:
+            self.status = "success"
+        if self.snapshot:
+            self.finish_snapshot()
+
+    def finish_snapshot(self):
+        if self.failed:
+            self.rolled_back_premis_events = self.all_premis_events()
+            self.snapshot.rollback()
+            rollback_note = "rolled back to the snapshot taken before processing"
+            if self.rolled_back_premis_events:
+                rollback_note += f"; its {len(self.rolled_back_premis_events)} PREMIS event(s) are in premis_rolled_back.csv"
+            self.message = "; ".join(note for note in [self.message, rollback_note] if note)
+        elif self.status == "success":
+            self.snapshot.prune()
+        elif self.snapshot.exists():
+            print(f"Keeping the snapshot of {self.item_dir} in {self.snapshot.snapshot_dir}; use --rollback to restore it")
+
+    def move_path(self, src, dst_dir):
+        moved = shutil.move(src, dst_dir)
+        if self.snapshot:
+            self.snapshot.record_move(src, moved)
+
+    def remove_path(self, path):
+        if self.snapshot:
+            self.snapshot.remove(path)
+        elif os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def stage_status_changed(self, stage):
+        duration = stage.duration()
+        if stage.status == "done" and duration is not None:
+            print(f"{os.path.basename(self.item_dir)}: {stage.name} done in {duration:.1f}s")
+        elif stage.status != "running":
+            print(f"{os.path.basename(self.item_dir)}: {stage.name} {stage.status}")
+        for listener in self.stage_listeners:
+            listener(self, stage)
+
+    def stage_failed(self, stage, error):
+        self.failed = True
+        if isinstance(error, ToolTimeout):
+            self.handle_timeout(error)
+            return
+        if isinstance(error, ToolLimitExceeded):
+            self.handle_limit_exceeded(error)
+            return
+        traceback.print_exception(type(error), error, error.__traceback__)
+        self.status = "flagged"
+        self.message = f"{stage.name} failed: {error}"
 
     @staticmethod
     def processor_for(transfer_type):
@@ -152,106 +569,306 @@ class ItemProcessor:
             sys.exit(f"Processor not implemented for {transfer_type}")
 
 
+class DiskImage:
+    """ One disk image in an item, with the reports and extraction plan that belong to it """
+    def __init__(self, filename, item_dir, objects_dir, subdoc_dir, label=None, premis_events=None, dfxml_name="dfxml.xml"):
+        self.filename = filename
+        self.path = os.path.join(item_dir, filename)
+        self.size = os.path.getsize(self.path)
+        # an item with a single image keeps the original layout; several images each get their own folders
+        self.label = label
+        self.out_dir = os.path.join(objects_dir, label) if label else objects_dir
+        self.subdoc_dir = os.path.join(subdoc_dir, label) if label else subdoc_dir
+        self.disktype_txt = os.path.join(self.subdoc_dir, "disktype.txt")
+        self.mmls_output = os.path.join(self.subdoc_dir, "mmls_output.txt")
+        self.probe_txt = os.path.join(self.subdoc_dir, "disk_probe.txt")
+        self.dfxml_file = os.path.join(self.subdoc_dir, dfxml_name)
+        self.premis_csv = os.path.join(self.subdoc_dir, "premis.csv")
+        self.premis_events = [] if premis_events is None else premis_events
+        self.probe_result = None
+        self.partitions = []
+        self.filesystems = []
+        self.extraction_plan = []
+        self.md5 = None
+
+    def stage_name(self, name):
+        return f"{name}:{self.label}" if self.label else name
+
+    def uses_extraction_method(self, *methods):
+        return any(extraction["method"] in methods for extraction in self.extraction_plan)
+
+
 class DiskImageProcessor(ItemProcessor):
-    def __init__(self, item_dir, keep_image=False):
-        self.find_disk_image(item_dir)
-        super().__init__(item_dir, keep_image=keep_image)
+    def __init__(self, item_dir, options=None, **kwargs):
+        options = options or ProcessingOptions()
+        self.image_extensions = [extension.lower() for extension in (options.image_extensions or DEFAULT_IMAGE_EXTENSIONS)]
+        self.image_filenames = self.find_disk_images(item_dir)
+        super().__init__(item_dir, options, **kwargs)
 
+        self.fat_list = ["fat", "fat12", "fat16", "fat32"]
         self.mount_and_copy_list = ["udf"]
         self.unhfs_list = ["osx", "hfs", "apple", "apple_hfs", "mfs", "hfs plus"]
-        self.tsk_list = ["ntfs", "fat", "exfat", "ext", "iso9660", "hfs+", "ufs", "raw", "swap", "yaffs2"]
-
-    def find_disk_image(self, item_dir):
-        item_dir_files = os.listdir(item_dir)
-        disk_images = [
-                        filename for filename in item_dir_files
-                        if filename.endswith(".iso")
-                    ]
-        if len(disk_images) == 1:
-            self.image_filename = disk_images[0]
-            self.image_path = os.path.join(item_dir, self.image_filename)
+        self.tsk_list = ["ntfs", "fat", "fat12", "fat16", "fat32", "exfat", "ext", "iso9660", "hfs+", "ufs", "raw", "swap", "yaffs2"]
+
+        self.images = []
+        if len(self.image_filenames) == 1:
+            self.images.append(DiskImage(
+                self.image_filenames[0], item_dir, self.objects_dir, self.subdoc_dir, premis_events=self.premis_events,
+                dfxml_name=os.path.basename(self.dfxml_file)
+            ))
         else:
-            sys.exit(f"Error: Found {len(disk_images)} disk images in {item_dir}")
+            stems = [os.path.splitext(filename)[0] for filename in self.image_filenames]
+            for filename, stem in zip(self.image_filenames, stems):
+                label = stem if stems.count(stem) == 1 else filename.replace(".", "_")
+                image = DiskImage(filename, item_dir, self.objects_dir, self.subdoc_dir, label=label, dfxml_name=os.path.basename(self.dfxml_file))
+                os.makedirs(image.subdoc_dir, exist_ok=True)
+                self.images.append(image)
+        self.stage_workers = max(self.stage_workers, 2 * len(self.images))
+        if not self.images:
+            self.status = "skipped"
+            self.message = f"No disk images found (looked for {', '.join(self.image_extensions)})"
 
-    def process(self):
-        self.run_preliminary_tools()
-        self.characterize_and_extract_files()
-        if not self.status == "skipped":
-            potential_video = self.check_for_video()
-            if potential_video:
-                self.status = "flagged"
-                self.message = "Image contains VIDEO_TS or AUDIO_TS directories"
-            else:
-                self.run_brunnhilde()
-                self.status = "success"
+    def find_disk_images(self, item_dir):
+        return sorted(
+            filename for filename in os.listdir(item_dir)
+            if os.path.isfile(os.path.join(item_dir, filename)) and os.path.splitext(filename)[1].lower() in self.image_extensions
+        )
 
-        if self.status not in ["skipped", "flagged"]:
-            self.remove_system_files()
-            if self.keep_image:
-                self.repackage_files_and_image()
-            else:
-                os.remove(self.image_path)
-            self.write_premis_csv()
-            self.bag_item()
-        else:
-            self.write_premis_csv()
+    def get_transfer_size(self):
+        if self.transfer_size is None:
+            self.transfer_size = sum(image.size for image in self.images)
+        return self.transfer_size
+
+    def build_stages(self):
+        if not self.images:
+            return []
+        stages = []
+        for image in self.images:
+            name = image.stage_name
+            stages.extend([
+                Stage(name("triage"), functools.partial(self.triage_image, image)),
+                Stage(
+                    name("disktype"), functools.partial(self.run_preliminary_tools, image), requires=[name("triage")],
+                    inputs=[image.path], outputs=[image.disktype_txt] if self.options.disk_probe == "disktype" else []
+                ),
+                Stage(name("partitions"), functools.partial(self.characterize_files, image), requires=[name("disktype")]),
+                Stage(
+                    name("fiwalk"), functools.partial(self.generate_dfxml_fiwalk, image), requires=[name("partitions")],
+                    inputs=[image.path], outputs=[image.dfxml_file],
+                    when=functools.partial(image.uses_extraction_method, "tsk", "unhfs")
+                ),
+                Stage(name("extraction"), functools.partial(self.extract_files, image), requires=[name("partitions")]),
+                Stage(
+                    name("fix_dates"), functools.partial(self.fix_extracted_dates, image), requires=[name("fiwalk"), name("extraction")],
+                    when=functools.partial(image.uses_extraction_method, "tsk")
+                )
+            ])
+        fiwalk_stages = [image.stage_name("fiwalk") for image in self.images]
+        extraction_stages = [image.stage_name("extraction") for image in self.images]
+        stages.extend([
+            Stage("check_for_video", self.flag_video, requires=extraction_stages),
+            Stage("remove_system_files", self.remove_system_files, requires=[image.stage_name("fix_dates") for image in self.images] + ["check_for_video"]),
+            Stage(
+                "brunnhilde", self.run_brunnhilde, requires=["remove_system_files"],
+                inputs=[self.objects_dir], outputs=[os.path.join(self.brunnhilde_dir, "report.html")]
+            ),
+            Stage("package_image", self.package_image, requires=fiwalk_stages + ["brunnhilde"]),
+            Stage("premis", self.write_premis_csv, requires=["package_image"], always=True),
+            Stage("bag", self.bag_item, requires=["premis", "package_image"])
+        ])
+        if self.options.holdings_index:
+            self.add_duplicate_check(stages, after=fiwalk_stages + extraction_stages, before=["package_image", "premis"])
+        return stages
 
-    def run_preliminary_tools(self):
-        self.disktype_txt = os.path.join(self.subdoc_dir, "disktype.txt")
-        disktype_cmd = ["disktype", self.image_path]
+    def write_premis_csv(self):
+        super().write_premis_csv()
+        for image in self.images:
+            if image.premis_events is not self.premis_events:
+                write_premis_events(image.premis_csv, image.premis_events)
+
+    def all_premis_events(self):
+        events = super().all_premis_events()
+        for image in self.images:
+            if image.premis_events is not self.premis_events:
+                events.extend(image.premis_events)
+        return events
+
+    def record_cache_reuse(self, image, event_type, probe, tool_version):
+        self.record_premis(
+            str(datetime.datetime.now()),
+            event_type,
+            0,
+            f"probe cache ({self.options.probe_cache.cache_dir})",
+            f"Reused {probe} results previously generated for image fingerprint {self.options.probe_cache.fingerprint(image.path)}",
+            tool_version,
+            events=image.premis_events
+        )
+
+    def triage_image(self, image):
+        """ Skips blank, unwritten and truncated images before any external tool runs """
+        timestamp = str(datetime.datetime.now())
+        triage = triage_image(image.path)
+        if triage is None:
+            return
+        verdict, message = triage
+        print(f"{image.filename}: {message}")
+        self.record_premis(
+            timestamp,
+            "validation",
+            0 if verdict == "short" else 1,
+            f"image triage (sampled block reads): {verdict}",
+            message,
+            f"Python {platform.python_version()} mmap",
+            events=image.premis_events
+        )
+        if verdict == "short":
+            return
+        self.status = "skipped"
+        self.message = f"{image.filename}: {message}" if image.label else message
+
+    def run_preliminary_tools(self, image):
+        if self.options.disk_probe == "native" and self.probe_disk_image(image):
+            return
+        if self.options.probe_cache:
+            disktype_id = executable_id("disktype")
+            if self.options.probe_cache.fetch(image.path, "disktype", disktype_id, {"disktype.txt": image.disktype_txt}):
+                print(f"Reusing cached disktype output for {image.filename}")
+                self.record_cache_reuse(image, "forensic feature analysis", "disktype", "disktype")
+                return
+
+        disktype_cmd = ["disktype", image.path]
         timestamp = str(datetime.datetime.now())
-        with open(self.disktype_txt, "w") as f:
-            disktype_result = subprocess.run(disktype_cmd, stdout=f)
+        with open(image.disktype_txt, "w") as f:
+            disktype_result = self.run_tool("disktype", disktype_cmd, event_type="forensic feature analysis", size_bytes=image.size, stdout=f)
         self.record_premis(
             timestamp,
             'forensic feature analysis',
             disktype_result.returncode,
             subprocess.list2cmdline(disktype_result.args),
             "Determined fisk image file system information",
-            'disktype'
+            'disktype',
+            events=image.premis_events
+        )
+        if self.options.probe_cache and disktype_result.returncode == 0:
+            self.options.probe_cache.store(image.path, "disktype", disktype_id, files={"disktype.txt": image.disktype_txt})
+
+    def probe_disk_image(self, image):
+        """ Reads the image's partition map and file system superblocks; returns False if disktype should run instead """
+        print(f"Probing partitions and file systems in {image.filename}")
+        timestamp = str(datetime.datetime.now())
+        try:
+            result = probe_image(image.path)
+        except OSError as e:
+            print(f"Unable to probe {image.filename}: {e}")
+            return False
+        if self.options.probe_reports:
+            with open(image.probe_txt, "w", encoding="utf-8") as f:
+                f.write(result.report())
+        if not result.found_filesystems():
+            print(f"No known file system found in {image.filename}, falling back to disktype")
+            return False
+        image.probe_result = result
+        self.record_premis(
+            timestamp,
+            "forensic feature analysis",
+            0,
+            f"{PROBE_VERSION} (in process)",
+            "Determined disk image partition and file system information",
+            f"reuther_born_digital_utils {PROBE_VERSION}",
+            events=image.premis_events
         )
+        return True
 
     def check_for_video(self):
         potential_video = False
-        objects_dir_contents = os.listdir(self.objects_dir)
-        if "AUDIO_TS" in objects_dir_contents or "VIDEO_TS" in objects_dir_contents:
-            potential_video = True
+        for image in self.images:
+            if not os.path.exists(image.out_dir):
+                continue
+            out_dir_contents = os.listdir(image.out_dir)
+            if "AUDIO_TS" in out_dir_contents or "VIDEO_TS" in out_dir_contents:
+                potential_video = True
         return potential_video
 
-    def characterize_and_extract_files(self):
-        self.parse_disk_filesystems()
+    def flag_video(self):
+        if self.check_for_video():
+            self.status = "flagged"
+            self.message = "Image contains VIDEO_TS or AUDIO_TS directories"
 
-        if len(self.partition_info_list) <= 1:
-            self.handle_file_extraction(self.objects_dir, False)
+    def characterize_files(self, image):
+        self.parse_disk_filesystems(image)
+
+        messages = []
+        if len(image.partitions) > 1:
+            for partition in image.partitions:
+                out_folder = os.path.join(image.out_dir, f"partition_{partition.slot}")
+                messages.append(self.plan_file_extraction(image, out_folder, partition))
         else:
-            for partition_info in self.partition_info_list:
-                out_folder = os.path.join(self.objects_dir, f"partition_{partition_info['slot']}")
-                self.handle_file_extraction(out_folder, partition_info)
+            partition = image.partitions[0] if image.partitions else None
+            messages.append(self.plan_file_extraction(image, image.out_dir, partition))
 
-    def parse_disk_filesystems(self):
-        print("Parsing disk filesystems")
-        self.partition_info_list = []
-        self.filesystems = []
-        with open(self.disktype_txt, "r") as f:
+        if image.uses_extraction_method("fat") and not all(extraction["method"] == "fat" for extraction in image.extraction_plan):
+            # fiwalk describes the whole image, so FAT partitions alongside others are extracted with tsk too
+            for extraction in image.extraction_plan:
+                if extraction["method"] == "fat":
+                    extraction["method"] = "tsk"
+
+        if not image.extraction_plan:
+            message = next((message for message in messages if message), "Unable to identify filesystem")
+            self.status = "skipped"
+            self.message = f"{image.filename}: {message}" if image.label else message
+
+    def extract_files(self, image):
+        if image.uses_extraction_method("fat"):
+            self.extract_fat_files(image)
+            return
+        for extraction in image.extraction_plan:
+            self.handle_file_extraction(image, extraction["out_folder"], extraction["partition"], extraction["method"])
+
+    def fix_extracted_dates(self, image):
+        for extraction in image.extraction_plan:
+            if extraction["method"] == "tsk":
+                self.fix_dates(image, extraction["out_folder"])
+
+    def parse_disk_filesystems(self, image):
+        print(f"Parsing disk filesystems for {image.filename}")
+        image.partitions = []
+        image.filesystems = []
+        if image.probe_result:
+            image.partitions = image.probe_result.partitions
+            image.filesystems = image.probe_result.filesystems
+            return
+        if self.options.probe_cache:
+            mmls_version = self.tool_version(["mmls", "-V"]).strip()
+            probe_version = f"{executable_id('disktype')}\n{mmls_version}"
+            cached = self.options.probe_cache.fetch_json(image.path, "partitions", probe_version)
+            if cached is not None:
+                print("Reusing cached partition information")
+                self.options.probe_cache.fetch(image.path, "partitions", probe_version, {"mmls_output.txt": image.mmls_output})
+                # entries cached before partitions were typed kept them as "partition_info_list"
+                partitions = cached.get("partitions", cached.get("partition_info_list", []))
+                image.partitions = [Partition.from_dict(partition) for partition in partitions]
+                image.filesystems = cached["filesystems"]
+                self.record_cache_reuse(image, "forensic feature analysis", "mmls and disktype partition", f"mmls: {mmls_version}")
+                return
+
+        with open(image.disktype_txt, "r") as f:
             dt_output = f.read()
 
+        handle_partitions = False
         if "Partitions" in dt_output:
             partitions = dt_output.split("Partition ")[1:]
             if len(partitions) == 2 and "Apple_partition_map" in partitions[0]:
                 handle_partitions = False
             elif len(partitions) > 1:
                 handle_partitions = True
-        else:
-            handle_partitions = False
 
         if handle_partitions:
             mmls_version_cmd = ["mmls", "-V"]
-            mmls_version = subprocess.run(mmls_version_cmd, capture_output=True).stdout.decode("utf-8").strip()
-            mmls_output = os.path.join(self.subdoc_dir, "mmls_output.txt")
-            mmls_cmd = ["mmls", self.image_path]
+            mmls_version = self.tool_version(mmls_version_cmd).strip()
+            mmls_cmd = ["mmls", image.path]
             timestamp = str(datetime.datetime.now())
-            with open(mmls_output, "w") as f:
-                mmls_result = subprocess.run(mmls_cmd, stdout=f)
+            with open(image.mmls_output, "w") as f:
+                mmls_result = self.run_tool("mmls", mmls_cmd, event_type="forensic feature analysis", size_bytes=image.size, stdout=f)
 
             self.record_premis(
                 timestamp,
@@ -259,35 +876,43 @@ class DiskImageProcessor(ItemProcessor):
                 mmls_result.returncode,
                 subprocess.list2cmdline(mmls_result.args),
                 "Determined the layout of partitions",
-                f"mmls: {mmls_version}"
+                f"mmls: {mmls_version}",
+                events=image.premis_events
             )
 
-            if os.stat(mmls_output).st_size > 0:
-                with open(mmls_output, "r") as f:
+            if os.stat(image.mmls_output).st_size > 0:
+                with open(image.mmls_output, "r") as f:
                     mmls_info = [m.split("\n") for m in f.read().splitlines()[5:]]
                 for mm in mmls_info:
-                    partition_info = {}
+                    fields = mm[0].split()
                     for partition in partitions:
-                        sector_length = mm[0].split()[4].lstrip('0')
-                        sector_start = mm[0].split()[2]
+                        sector_length = fields[4].lstrip('0')
+                        sector_start = fields[2]
                         if 'file system' in partition and f", {sector_length} sectors from {sector_start.lstrip('0')})" in partition:
                             filesystem_names = [d.split(' file system')[0].strip().lower() for d in partition.split('\n') if ' file system' in d]
-                            partition_info["start"] = sector_start
-                            partition_info["filesystems"] = filesystem_names
-                            partition_info["slot"] = mm[0].split()[1]
-                            self.partition_info_list.append(partition_info)
+                            image.partitions.append(Partition(
+                                fields[1], int(sector_start), int(fields[4]), " ".join(fields[5:]), filesystem_names
+                            ))
         else:
             dt_info = dt_output.splitlines()
             for dt in dt_info:
                 if 'file system' in dt:
                     filesystem = dt.split(' file system')[0].strip().lower()
-                    self.filesystems.append(filesystem)
+                    image.filesystems.append(filesystem)
+
+        if self.options.probe_cache:
+            self.options.probe_cache.store(
+                image.path, "partitions", probe_version,
+                files={"mmls_output.txt": image.mmls_output},
+                data={"partitions": [partition.as_dict() for partition in image.partitions], "filesystems": image.filesystems}
+            )
 
-    def handle_file_extraction(self, out_folder, partition):
+    def plan_file_extraction(self, image, out_folder, partition):
+        """ Adds an extraction to the image's plan; returns why it couldn't, if it couldn't """
         if partition:
-            filesystems = partition["filesystems"]
+            filesystems = partition.filesystems
         else:
-            filesystems = self.filesystems
+            filesystems = image.filesystems
 
         if len(filesystems) == 1:
             filesystem = filesystems[0]
@@ -295,54 +920,133 @@ class DiskImageProcessor(ItemProcessor):
             # hybrid disk, use tsk
             filesystem = "iso9660"
         else:
-            self.status = "skipped"
-            self.message = "Unable to identify filesystem"
-            return
+            return "Unable to identify filesystem"
 
-        if filesystem in self.tsk_list:
-            self.carve_files_tsk(out_folder, partition)
+        if filesystem in self.fat_list and self.options.fat_extractor == "native":
+            method = "fat"
+        elif filesystem in self.tsk_list:
+            method = "tsk"
         elif filesystem in self.unhfs_list:
-            self.carve_files_unhfs(out_folder, partition)
+            method = "unhfs"
         elif filesystem in self.mount_and_copy_list:
-            self.mount_and_copy_files(out_folder)
+            method = "mount_and_copy"
         else:
-            self.status = "skipped"
-            self.message = "Filesystem not supported"
-            return
-        self.status = "success"
-
-    def carve_files_tsk(self, out_folder, partition):
-        self.generate_dfxml_fiwalk()
-
-        print("Carving files using tsk_recover")
+            return "Filesystem not supported"
+        image.extraction_plan.append({"out_folder": out_folder, "partition": partition, "method": method})
+        return None
+
+    def handle_file_extraction(self, image, out_folder, partition, method):
+        if method == "tsk":
+            self.carve_files_tsk(image, out_folder, partition)
+        elif method == "unhfs":
+            self.carve_files_unhfs(image, out_folder, partition)
+        elif method == "mount_and_copy":
+            self.mount_and_copy_files(image, out_folder)
+
+    def carve_files_tsk(self, image, out_folder, partition):
+        print(f"Carving files from {image.filename} using tsk_recover")
         tsk_version_cmd = ["tsk_recover", "-V"]
-        tsk_version = subprocess.run(tsk_version_cmd, capture_output=True).stdout.decode("utf-8").strip()
+        tsk_version = self.tool_version(tsk_version_cmd).strip()
         if partition:
-            tsk_cmd = ["tsk_recover", "-a", "-o", partition["start"], self.image_path, out_folder]
+            tsk_cmd = ["tsk_recover", "-a", "-o", str(partition.start), image.path, out_folder]
         else:
-            tsk_cmd = ["tsk_recover", "-a", self.image_path, out_folder]
+            tsk_cmd = ["tsk_recover", "-a", image.path, out_folder]
         timestamp = str(datetime.datetime.now())
-        tsk_result = subprocess.run(tsk_cmd)
+        tsk_result = self.run_tool("tsk_recover", tsk_cmd, event_type="replication", size_bytes=image.size)
         self.record_premis(
             timestamp,
             'replication',
             tsk_result.returncode,
             subprocess.list2cmdline(tsk_result.args),
             "Created a bit-wise identical copy of contents on disk image",
-            f"tsk_recover: {tsk_version}"
+            f"tsk_recover: {tsk_version}",
+            events=image.premis_events
         )
 
-        self.fix_dates(out_folder)
-
-    def fix_dates(self, out_folder):
-        print("Fixing dates from DFXML")
+    def extract_fat_files(self, image):
+        print(f"Extracting files from {image.filename} with the native FAT reader")
         timestamp = str(datetime.datetime.now())
+        dfxml = DfxmlWriter(image.dfxml_file, "reuther_born_digital_utils", FAT_READER_VERSION, image.path)
+        files = 0
+        extracted_bytes = 0
+        renamed = []
+        warnings = []
         try:
-            for (event, obj) in Objects.iterparse(self.dfxml_file):
-                # only work on FileObjects
-                if not isinstance(obj, Objects.FileObject):
-                    continue
+            try:
+                with open(image.path, "rb") as f:
+                    for partition_number, extraction in enumerate(image.extraction_plan, 1):
+                        partition = extraction["partition"]
+                        # allocated files only, as with tsk_recover -a
+                        volume = FatVolume(f, partition.start * SECTOR_SIZE if partition else 0, include_deleted=False)
+                        volume.walk(extraction["out_folder"], dfxml, partition_number)
+                        files += volume.files
+                        extracted_bytes += volume.bytes
+                        renamed.extend(volume.renamed)
+                        warnings.extend(volume.warnings)
+            finally:
+                dfxml.close()
+        except FatError as e:
+            print(f"The native FAT reader can't read {image.filename} ({e}); falling back to tsk_recover")
+            self.extract_fat_files_tsk(image, str(e))
+            return
+        print(f"Extracted {files} files ({format_size(extracted_bytes)}) from {image.filename}")
+        replication_detail = "Created a bit-wise identical copy of contents on disk image"
+        if warnings:
+            replication_detail += f"; problems reading the file system: {'; '.join(warnings)}"
+        for event_type, detail in [
+            ("replication", replication_detail),
+            ("message digest calculation", "Recorded MD5 and SHA-1 digests and file system metadata in DFXML while extracting"),
+            ("metadata modification", "Set file timestamps to match information extracted from disk image")
+        ]:
+            self.record_premis(
+                timestamp,
+                event_type,
+                0,
+                f"{FAT_READER_VERSION} (in process)",
+                detail,
+                f"reuther_born_digital_utils {FAT_READER_VERSION}",
+                events=image.premis_events
+            )
+        if renamed:
+            self.record_premis(
+                timestamp,
+                "filename change",
+                0,
+                f"{FAT_READER_VERSION} (in process)",
+                "Replaced path separators and control characters in names from the disk image: "
+                + "; ".join(f"{original} -> {path}" for original, path in renamed),
+                f"reuther_born_digital_utils {FAT_READER_VERSION}",
+                events=image.premis_events
+            )
 
+    def extract_fat_files_tsk(self, image, reason):
+        """ Extracts an image the native FAT reader gave up on the way fiwalk and tsk_recover would have """
+        self.record_premis(
+            str(datetime.datetime.now()),
+            "replication",
+            1,
+            f"{FAT_READER_VERSION} (in process)",
+            f"Unable to read the file system ({reason}); extracted with tsk_recover instead",
+            f"reuther_born_digital_utils {FAT_READER_VERSION}",
+            events=image.premis_events
+        )
+        if os.path.exists(image.dfxml_file):
+            os.remove(image.dfxml_file)
+        for extraction in image.extraction_plan:
+            if os.path.exists(extraction["out_folder"]):
+                shutil.rmtree(extraction["out_folder"])
+            os.makedirs(extraction["out_folder"])
+        # the fiwalk and fix_dates stages only run for planned tsk extractions, so this one does its own
+        self.generate_dfxml_fiwalk(image)
+        for extraction in image.extraction_plan:
+            self.carve_files_tsk(image, extraction["out_folder"], extraction["partition"])
+            self.fix_dates(image, extraction["out_folder"])
+
+    def fix_dates(self, image, out_folder):
+        print(f"Fixing dates from DFXML for {image.filename}")
+        timestamp = str(datetime.datetime.now())
+        try:
+            for obj in self.dfxml_file_objects(image.dfxml_file):
                 # skip links
                 if obj.name_type:
                     if obj.name_type not in ["r", "d"]:
@@ -386,7 +1090,7 @@ class DiskImageProcessor(ItemProcessor):
                         exported_filepath, (dfxml_filedate, dfxml_filedate)
                     )
         except ValueError:
-            print(f"Could not rewrite modified dates for disk {self.image_path} due to Objects.py ValueError")
+            print(f"Could not rewrite modified dates for disk {image.path} due to Objects.py ValueError")
 
         self.record_premis(
             timestamp,
@@ -394,98 +1098,130 @@ class DiskImageProcessor(ItemProcessor):
             0,
             "DFXML and Python",
             "Corrected file timestamps to match information extracted from disk image",
-            "Adapted from Disk Image Processor Version: 1.0.0 (Tessa Walsh)"
+            "Adapted from Disk Image Processor Version: 1.0.0 (Tessa Walsh)",
+            events=image.premis_events
             )
 
-    def carve_files_unhfs(self, out_folder, partition):
-        self.generate_dfxml_fiwalk()
+    def dfxml_file_objects(self, dfxml_file):
+        """ FileObjects from Objects.iterparse, which only reads plain XML; compressed DFXML is streamed by dfxml_io """
+        if not is_compressed(dfxml_file):
+            for (event, obj) in Objects.iterparse(dfxml_file):
+                if isinstance(obj, Objects.FileObject):
+                    yield obj
+            return
+        for fields, _ in iter_fileobject_fields(dfxml_file):
+            yield DfxmlFileFields(fields)
 
-        print("Carving files using unhfs")
+    def carve_files_unhfs(self, image, out_folder, partition):
+        print(f"Carving files from {image.filename} using unhfs")
         if sys.platform.startswith("linux"):
             unhfs_path = "/usr/share/hfsexplorer/bin/unhfs"
         elif sys.platform.startswith("darwin"):
             unhfs_path = "/usr/local/share/hfsexplorer/bin/unhfs"
 
         unhfs_ver_cmd = [unhfs_path]
-        unhfs_ver_result = subprocess.run(unhfs_ver_cmd, capture_output=True)
-        unhfs_ver = unhfs_ver_result.stderr.decode("utf-8").splitlines()[0]
+        unhfs_ver = (self.tool_version(unhfs_ver_cmd, stream="stderr").splitlines() or ["unhfs"])[0]
 
         if partition:
-            unhfs_cmd = [unhfs_path, "-partition", partition["slot"], "-resforks", "APPLEDOUBLE", "-o", out_folder, self.image_path]
+            unhfs_cmd = [unhfs_path, "-partition", partition.slot, "-resforks", "APPLEDOUBLE", "-o", out_folder, image.path]
         else:
-            unhfs_cmd = [unhfs_path, "-resforks", "APPLEDOUBLE", "-o", out_folder, self.image_path]
+            unhfs_cmd = [unhfs_path, "-resforks", "APPLEDOUBLE", "-o", out_folder, image.path]
 
         timestamp = str(datetime.datetime.now())
-        unhfs_result = subprocess.run(unhfs_cmd)
+        unhfs_result = self.run_tool("unhfs", unhfs_cmd, event_type="replication", size_bytes=image.size)
         self.record_premis(
             timestamp,
             'replication',
             unhfs_result.returncode,
             subprocess.list2cmdline(unhfs_result.args),
             "Created a bit-wise identical copy of disk image",
-            unhfs_ver
+            unhfs_ver,
+            events=image.premis_events
         )
 
-    def mount_and_copy_files(self, out_folder):
-        print("Mounting image and copying files")
+    def mount_and_copy_files(self, image, out_folder):
+        print(f"Mounting {image.filename} and copying files")
         if self.check_files(out_folder):
             print(f"Files already exist in {out_folder}")
             sys.exit()
-        else:
+        elif os.path.exists(out_folder):
             shutil.rmtree(out_folder)
 
-        mount_location = "/mnt/diskid/"
-        mount_cmd = ["sudo", "mount", "-o", "loop,ro,noexec", self.image_path, mount_location]
-        self.generate_dfxml_walk()
-
-        subprocess.run(mount_cmd)
-        timestamp = str(datetime.datetime.now())
-        shutil.copytree("/mnt/diskid", out_folder, symlinks=False, ignore=None)
-        self.record_premis(
-            timestamp,
-            "replication",
-            0,
-            "shutil.copytree",
-            "Created a bit-wise identical copy of contents on disk image",
-            f"Python {platform.python_version()} shutil"
-        )
-
-        unmount_cmd = ["sudo", "umount", mount_location]
-        subprocess.run(unmount_cmd)
-
-    def generate_dfxml_fiwalk(self):
-        print("Generating DFXML using fiwalk")
-        if not os.path.exists(self.dfxml_file):
+        mount_location = os.path.join(MOUNT_ROOT, f"{self.item_name()}_{image.label or 'image'}_{os.getpid()}")
+        mount_cmd = ["sudo", "mount", "-o", "loop,ro,noexec", image.path, mount_location]
+        self.run_tool("mount point", ["sudo", "mkdir", "-p", mount_location], tool="mount", event_type="replication")
+        try:
+            self.run_tool("mount", mount_cmd, event_type="replication")
+            try:
+                self.generate_dfxml_walk(image, mount_location)
+                timestamp = str(datetime.datetime.now())
+                shutil.copytree(mount_location, out_folder, symlinks=False, ignore=None)
+                self.record_premis(
+                    timestamp,
+                    "replication",
+                    0,
+                    "shutil.copytree",
+                    "Created a bit-wise identical copy of contents on disk image",
+                    f"Python {platform.python_version()} shutil",
+                    events=image.premis_events
+                )
+            finally:
+                unmount_cmd = ["sudo", "umount", mount_location]
+                self.run_tool("umount", unmount_cmd, event_type="replication")
+        finally:
+            self.run_tool("mount point", ["sudo", "rmdir", mount_location], tool="umount", event_type="replication")
+
+    def generate_dfxml_fiwalk(self, image):
+        print(f"Generating DFXML for {image.filename} using fiwalk")
+        if not os.path.exists(image.dfxml_file):
             timestamp = str(datetime.datetime.now())
             fiwalk_ver_cmd = ["fiwalk", "-V"]
-            fiwalk_ver = subprocess.run(fiwalk_ver_cmd, capture_output=True).stdout.decode("utf-8").splitlines()[0]
-            fiwalk_cmd = ["fiwalk", "-X", self.dfxml_file, self.image_path]
-            fiwalk_result = subprocess.run(fiwalk_cmd)
+            fiwalk_ver = (self.tool_version(fiwalk_ver_cmd).splitlines() or ["unknown version"])[0]
+            # cached under its own name, so plain and compressed DFXML are never mixed up
+            cache_name = os.path.basename(image.dfxml_file)
+            if self.options.probe_cache and self.options.probe_cache.fetch(image.path, "fiwalk", fiwalk_ver, {cache_name: image.dfxml_file}) and os.path.exists(image.dfxml_file):
+                print("Reusing cached fiwalk DFXML")
+                self.record_cache_reuse(image, "message digest calculation", "fiwalk", f"fiwalk: {fiwalk_ver}")
+                return
+            if is_compressed(image.dfxml_file):
+                # fiwalk prints the DFXML and it is compressed as it streams in
+                fiwalk_cmd = ["fiwalk", "-x", image.path]
+                with dfxml_output(image.dfxml_file) as f:
+                    fiwalk_result = self.run_tool("fiwalk", fiwalk_cmd, event_type="message digest calculation", size_bytes=image.size, stdout=f)
+            else:
+                fiwalk_cmd = ["fiwalk", "-X", image.dfxml_file, image.path]
+                fiwalk_result = self.run_tool("fiwalk", fiwalk_cmd, event_type="message digest calculation", size_bytes=image.size)
             self.record_premis(
                 timestamp,
                 'message digest calculation',
                 fiwalk_result.returncode,
                 subprocess.list2cmdline(fiwalk_result.args),
                 "Extracted information about the structure and characteristics of content on disk image",
-                f"fiwalk: {fiwalk_ver}"
+                f"fiwalk: {fiwalk_ver}",
+                events=image.premis_events
             )
+            if self.options.probe_cache and fiwalk_result.returncode == 0:
+                self.options.probe_cache.store(image.path, "fiwalk", fiwalk_ver, files={cache_name: image.dfxml_file})
 
-    def generate_dfxml_walk(self):
+    def generate_dfxml_walk(self, image, mount_location):
         print("Generating DFXL using walk_to_dfxml.py")
         this_dir = os.path.dirname(os.path.abspath(__file__))
         walk_to_dfxml_path = os.path.join(this_dir, "walk_to_dfxml.py")
-        if not os.path.exists(self.dfxml_file):
+        if not os.path.exists(image.dfxml_file):
             timestamp = str(datetime.datetime.now())
             walk_to_dfxml_cmd = ["python", walk_to_dfxml_path]
-            with open(self.dfxml_file, "w") as f:
-                walk_to_dfxml_result = subprocess.run(walk_to_dfxml_cmd, cwd="/mnt/diskid/", stdout=f)
+            with dfxml_output(image.dfxml_file) as f:
+                walk_to_dfxml_result = self.run_tool(
+                    "walk_to_dfxml", walk_to_dfxml_cmd, event_type="message digest calculation", size_bytes=image.size, cwd=mount_location, stdout=f
+                )
             self.record_premis(
                 timestamp,
                 'message digest calculation',
                 walk_to_dfxml_result.returncode,
                 subprocess.list2cmdline(walk_to_dfxml_result.args),
                 "Extracted information about the structure and characteristics of content on file system",
-                "walk_to_dfxml.py"
+                "walk_to_dfxml.py",
+                events=image.premis_events
             )
 
     def check_files(self, files_dir):
@@ -499,6 +1235,61 @@ class DiskImageProcessor(ItemProcessor):
 
         return False
 
+    def stage_io(self):
+        stage_io = {
+            "brunnhilde": ([self.objects_dir], [self.brunnhilde_dir]),
+            "package_image": ([image.path for image in self.images], [self.item_dir]),
+            "bag": ([self.item_dir], [self.item_dir])
+        }
+        for image in self.images:
+            stage_io[image.stage_name("triage")] = ([image.path], [])
+            stage_io[image.stage_name("disktype")] = ([image.path], [image.subdoc_dir])
+            stage_io[image.stage_name("fiwalk")] = ([image.path], [image.subdoc_dir])
+            stage_io[image.stage_name("extraction")] = ([image.path], [image.out_dir])
+            stage_io[image.stage_name("fix_dates")] = ([], [image.out_dir])
+        return stage_io
+
+    def dfxml_sources(self):
+        sources = []
+        for image in self.images:
+            # DFXML filenames are relative to the root of each file system, so they only map onto
+            # extracted paths when the image held a single file system
+            prefix = None
+            if len(image.extraction_plan) == 1:
+                prefix = os.path.relpath(image.extraction_plan[0]["out_folder"], self.objects_dir)
+                prefix = "" if prefix == "." else prefix
+            sources.append((image.dfxml_file, prefix))
+        return sources
+
+    def check_image_duplicates(self):
+        image_duplicates = []
+        for image in self.images:
+            print(f"Calculating checksum for {image.filename}")
+            timestamp = str(datetime.datetime.now())
+            image.md5 = md5_file(image.path)
+            self.record_premis(
+                timestamp,
+                "message digest calculation",
+                0,
+                "hashlib.md5",
+                f"Calculated disk image md5: {image.md5}",
+                f"Python {platform.python_version()} hashlib",
+                events=image.premis_events
+            )
+            for item, previous_image in self.options.holdings_index.lookup_image(image.md5, exclude_item=self.holdings_key()):
+                image_duplicates.append((image.filename, image.md5, item, previous_image))
+        return image_duplicates
+
+    def holdings_images(self):
+        return [(image.filename, image.md5, image.size) for image in self.images if image.md5]
+
+    def package_image(self):
+        if self.options.keep_image:
+            self.repackage_files_and_image()
+        else:
+            for image in self.images:
+                self.remove_path(image.path)
+
     def repackage_files_and_image(self):
         files_dir = os.path.join(self.objects_dir, "files")
         contents = os.listdir(self.objects_dir)
@@ -506,38 +1297,51 @@ class DiskImageProcessor(ItemProcessor):
         for content in contents:
             if content not in ["objects", "metadata", "files", "disk-image"]:
                 content_path = os.path.join(self.objects_dir, content)
-                shutil.move(content_path, files_dir)
+                self.move_path(content_path, files_dir)
         disk_image_dir = os.path.join(self.objects_dir, "disk-image")
         os.makedirs(disk_image_dir)
-        shutil.move(self.image_path, disk_image_dir)
+        for image in self.images:
+            self.move_path(image.path, disk_image_dir)
 
 
 class FolderProcessor(ItemProcessor):
-    def __init__(self, item_dir, keep_image=False, nimbie_transfer=False):
-        super().__init__(item_dir, keep_image=keep_image, nimbie_transfer=nimbie_transfer)
-
-    def process(self):
-        self.move_contents()
-        self.remove_system_files()
-        self.generate_dfxml()
-        self.run_brunnhilde()
-        self.write_premis_csv()
-        self.bag_item()
-        self.status = "success"
+    def stage_io(self):
+        return {
+            "move_contents": ([self.item_dir], [self.objects_dir]),
+            "dfxml": ([self.objects_dir], [self.subdoc_dir]),
+            "brunnhilde": ([self.objects_dir], [self.brunnhilde_dir]),
+            "bag": ([self.item_dir], [self.item_dir])
+        }
+
+    def build_stages(self):
+        stages = [
+            Stage("move_contents", self.move_contents),
+            Stage("remove_system_files", self.remove_system_files, requires=["move_contents"]),
+            Stage("dfxml", self.generate_dfxml, requires=["remove_system_files"], outputs=[self.dfxml_file]),
+            Stage(
+                "brunnhilde", self.run_brunnhilde, requires=["remove_system_files"],
+                inputs=[self.objects_dir], outputs=[os.path.join(self.brunnhilde_dir, "report.html")]
+            ),
+            Stage("premis", self.write_premis_csv, requires=["dfxml", "brunnhilde"], always=True),
+            Stage("bag", self.bag_item, requires=["premis"])
+        ]
+        if self.options.holdings_index:
+            self.add_duplicate_check(stages, after=["dfxml"], before=["premis"])
+        return stages
 
     def move_contents(self):
         contents = os.listdir(self.item_dir)
         for content in contents:
             if content not in ["objects", "metadata"]:
                 content_path = os.path.join(self.item_dir, content)
-                shutil.move(content_path, self.objects_dir)
+                self.move_path(content_path, self.objects_dir)
 
-        if self.nimbie_transfer:
+        if self.options.nimbie_transfer:
             metadata_contents = os.listdir(self.metadata_dir)
             for content in metadata_contents:
                 if content not in ["submissionDocumentation"]:
                     content_path = os.path.join(self.metadata_dir, content)
-                    shutil.move(content_path, self.nimbie_transfer_dir)
+                    self.move_path(content_path, self.nimbie_transfer_dir)
 
     def generate_dfxml(self):
         this_dir = os.path.dirname(os.path.abspath(__file__))
@@ -545,8 +1349,8 @@ class FolderProcessor(ItemProcessor):
         if not os.path.exists(self.dfxml_file):
             timestamp = str(datetime.datetime.now())
             walk_to_dfxml_cmd = ["python", walk_to_dfxml_path]
-            with open(self.dfxml_file, "w") as f:
-                walk_to_dfxml_result = subprocess.run(walk_to_dfxml_cmd, cwd=self.objects_dir, stdout=f)
+            with dfxml_output(self.dfxml_file) as f:
+                walk_to_dfxml_result = self.run_tool("walk_to_dfxml", walk_to_dfxml_cmd, event_type="message digest calculation", cwd=self.objects_dir, stdout=f)
             self.record_premis(
                 timestamp,
                 'message digest calculation',
@@ -557,6 +1361,40 @@ class FolderProcessor(ItemProcessor):
             )
 
 
+def write_premis_events(premis_csv, premis_events):
+    with open(premis_csv, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=PREMIS_HEADERS)
+        writer.writeheader()
+        writer.writerows(premis_events)
+
+
+def payload_sizes(item_dir):
+    """ {bag payload path: size} for the files of an item that hasn't been bagged yet """
+    sizes = {}
+    for root, _, filenames in os.walk(item_dir):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            sizes["data/" + os.path.relpath(filepath, item_dir).replace(os.sep, "/")] = os.lstat(filepath).st_size
+    return sizes
+
+
+def md5_file(filepath):
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class DfxmlFileFields:
+    """ The fileobject fields fix_dates uses, read from compressed DFXML without Objects """
+    def __init__(self, fields):
+        self.filename = fields.get("filename")
+        self.name_type = fields.get("name_type")
+        self.mtime = fields.get("mtime")
+        self.crtime = fields.get("crtime")
+
+
 def time_to_int(str_time):
     """ Convert datetime to unix integer value """
     dt = time.mktime(
@@ -565,7 +1403,7 @@ def time_to_int(str_time):
     return dt
 
 
-def process_item(item_dir, tranfser_type, keep_image=False):
+def process_item(item_dir, tranfser_type, options):
     processor = ItemProcessor.processor_for(tranfser_type)
-    processor = processor(item_dir, keep_image=keep_image)
+    processor = processor(item_dir, options)
     processor.process()
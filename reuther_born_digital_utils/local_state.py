@@ -0,0 +1,34 @@
+import json
+import os
+
+
+def state_dir():
+    state_dirpath = os.environ.get(
+        "REUTHER_BD_STATE_DIR",
+        os.path.join(os.path.expanduser("~"), ".reuther_born_digital_utils")
+    )
+    if not os.path.exists(state_dirpath):
+        os.makedirs(state_dirpath)
+    return state_dirpath
+
+
+def state_path(*parts):
+    return os.path.join(state_dir(), *parts)
+
+
+def load_json(filepath, default=None):
+    if not os.path.exists(filepath):
+        return default
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Unable to read {filepath}, ignoring it")
+        return default
+
+
+def write_json_atomic(filepath, data):
+    tmp_filepath = f"{filepath}.tmp{os.getpid()}"
+    with open(tmp_filepath, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,209 @@
+import csv
+import os
+import re
+
+
+DISC_STATUSES = ["failed", "empty", "errors", "ok", "unknown"]
+STATUS_WORDS = {
+    "failed": ["fail", "unreadable", "reject", "abort", "could not read", "unable to read", "no disc"],
+    "empty": ["blank", "empty", "no data", "no files"],
+    "errors": ["error", "retry", "retries", "bad sector", "crc", "incomplete"],
+    "ok": ["success", "complete", "finished", "done", "read ok"]
+}
+DISC_STATUS_MESSAGES = {
+    "failed": "Nimbie could not read the disc",
+    "empty": "Nimbie reported the disc as blank or empty",
+    "errors": "Nimbie reported read errors"
+}
+# whole words (a word may go on, as "failed" does from "fail"), so "incomplete" isn't read as "complete"
+STATUS_PATTERNS = {
+    status: re.compile(r"\b(?:" + "|".join(re.escape(word).replace(r"\ ", r"\s+") for word in words) + r")", re.IGNORECASE)
+    for status, words in STATUS_WORDS.items()
+}
+SIZE_UNITS = {"b": 1, "bytes": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}
+
+size_re = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*(bytes|b|kb|mb|gb)\b", re.IGNORECASE)
+# durations need a word in front of them so log timestamps aren't read as durations
+hms_re = re.compile(r"\b(?:in|duration|elapsed|took|time)\s*[:=]?\s*(\d+):(\d{2}):(\d{2})(?:\.\d+)?\b", re.IGNORECASE)
+seconds_re = re.compile(r"\b(?:in|duration|elapsed|took|time)\s*[:=]?\s*(\d+(?:\.\d+)?)\s*(?:s|sec|secs|seconds)\b", re.IGNORECASE)
+no_problem_re = re.compile(
+    r"\b(?:0|no|zero)\s+(?:errors?|retries|failures?|bad sectors?)\b|\b(?:errors?|retries|failures?|bad sectors?)\s*[:=]\s*0\b",
+    re.IGNORECASE
+)
+# a disc's explicit result field, e.g. "Result: OK" or "status=failed"; it outranks anything inferred from other lines
+result_re = re.compile(r"\b(?:result|status|outcome)\s*[:=]\s*([A-Za-z][\w ]*)", re.IGNORECASE)
+# a failed read the drive went on to retry is a read error, not the disc's outcome
+retrying_re = re.compile(r"\bretry|\bretrying\b|\bretried\b", re.IGNORECASE)
+label_re = re.compile(r"(?:volume\s*)?label\s*[:=]\s*[\"']?([^\"',\t]+)", re.IGNORECASE)
+
+
+class DiscRecord:
+    def __init__(self, name):
+        self.name = name
+        self.status = "unknown"
+        # the disc's explicit result, when the logs give one
+        self.result = None
+        # whether any line reported a read problem, so a disc that recovered is still noted as read with errors
+        self.problems = False
+        self.bytes = None
+        self.duration = None
+        self.label = None
+        self.notes = []
+
+    def status_message(self):
+        return DISC_STATUS_MESSAGES.get(self.status)
+
+    def update_status(self, status):
+        """ A status inferred from a log line; later lines describe the disc's later state, so they win """
+        if status in ["failed", "errors"]:
+            self.problems = True
+        if self.result is None:
+            self.status = "errors" if status == "ok" and self.problems else status
+
+    def set_result(self, status):
+        """ The disc's explicit result field, which overrides inferred statuses; the last one logged wins """
+        self.result = status
+        self.status = "errors" if status == "ok" and self.problems else status
+
+    def as_row(self):
+        return {
+            "disc": self.name,
+            "status": self.status,
+            "bytes": "" if self.bytes is None else self.bytes,
+            "duration_seconds": "" if self.duration is None else self.duration,
+            "volume_label": self.label or "",
+            "notes": " | ".join(self.notes)
+        }
+
+
+def status_for_text(text):
+    text = no_problem_re.sub("", text)
+    for status in ["failed", "empty", "errors", "ok"]:
+        if STATUS_PATTERNS[status].search(text):
+            if status == "failed" and retrying_re.search(text):
+                return "errors"
+            return status
+    return None
+
+
+def result_for_text(text):
+    """ The status named by an explicit result field in text, if it has one """
+    match = result_re.search(text)
+    if not match:
+        return None
+    if match.group(1).strip().lower() in ["ok", "good", "pass", "passed"]:
+        return "ok"
+    return status_for_text(match.group(1))
+
+
+def parse_size(text):
+    match = size_re.search(text)
+    if not match:
+        return None
+    return int(float(match.group(1).replace(",", "")) * SIZE_UNITS[match.group(2).lower()])
+
+
+def parse_duration(text):
+    match = hms_re.search(text)
+    if match:
+        hours, minutes, seconds = (int(value) for value in match.groups())
+        return hours * 3600 + minutes * 60 + seconds
+    match = seconds_re.search(text)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class NimbieLogParser:
+    """ Builds a per-disc manifest from a Nimbie batch's manifest.csv and log files.
+
+    The logs are read one line at a time and a line only applies to the disc folder it names. A disc's
+    explicit result field decides its status; otherwise the last line describing it does, so a read
+    that failed and was retried successfully counts as read with errors rather than failed.
+    """
+    def __init__(self, disc_names):
+        self.records = {name: DiscRecord(name) for name in disc_names}
+        # longest names first so UR000244_CD10 isn't mistaken for UR000244_CD1
+        self.disc_names = sorted(disc_names, key=len, reverse=True)
+
+    def disc_for_text(self, text):
+        for name in self.disc_names:
+            if name in text:
+                return self.records[name]
+        return None
+
+    def parse_manifest_csv(self, manifest_csv):
+        with open(manifest_csv, "r", newline="", encoding="utf-8", errors="replace") as f:
+            for row in csv.DictReader(f):
+                record = self.disc_for_text(" ".join(str(value) for value in row.values()))
+                if record is None:
+                    continue
+                for column, value in row.items():
+                    if not column or value is None:
+                        continue
+                    column = column.strip().lower()
+                    value = value.strip()
+                    if "label" in column and value:
+                        record.label = value
+                    elif "status" in column or "result" in column:
+                        status = status_for_text(value)
+                        if status:
+                            record.set_result(status)
+                    elif ("size" in column or "bytes" in column) and value:
+                        size = parse_size(value) if not value.replace(",", "").isdigit() else int(value.replace(",", ""))
+                        if size is not None:
+                            record.bytes = size
+                    elif ("duration" in column or "time" in column) and value:
+                        duration = parse_duration(value)
+                        if duration is not None:
+                            record.duration = duration
+
+    def parse_log(self, log_file):
+        with open(log_file, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = self.disc_for_text(line)
+                if record is None:
+                    continue
+                result = result_for_text(line)
+                status = result or status_for_text(line)
+                if result:
+                    record.set_result(result)
+                elif status:
+                    record.update_status(status)
+                if status in ["failed", "errors", "empty"]:
+                    record.notes.append(line)
+                label = label_re.search(line)
+                if label:
+                    record.label = label.group(1).strip()
+                if record.bytes is None:
+                    record.bytes = parse_size(line)
+                if record.duration is None:
+                    record.duration = parse_duration(line)
+
+    def parse_transfer_logs(self, transfer_logs_dir):
+        for filename in sorted(os.listdir(transfer_logs_dir)):
+            filepath = os.path.join(transfer_logs_dir, filename)
+            if filename.lower() == "manifest.csv":
+                self.parse_manifest_csv(filepath)
+            elif filename.lower().endswith((".log", ".txt")):
+                self.parse_log(filepath)
+        return self.records
+
+    def check_disc_folders(self, batch_dir):
+        for name, record in self.records.items():
+            disc_dir = os.path.join(batch_dir, name)
+            if not any(files for _, _, files in os.walk(disc_dir)):
+                record.set_result("empty")
+                record.notes.append("Disc folder contains no files")
+
+
+def write_disc_manifest(records, csv_path):
+    headers = ["disc", "status", "bytes", "duration_seconds", "volume_label", "notes"]
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=headers)
+        writer.writeheader()
+        for name in sorted(records):
+            writer.writerow(records[name].as_row())
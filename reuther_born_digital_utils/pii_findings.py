@@ -0,0 +1,141 @@
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import Counter
+
+
+INSERT_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    item TEXT NOT NULL,
+    feature_type TEXT NOT NULL,
+    source TEXT,
+    forensic_path TEXT,
+    feature TEXT,
+    context TEXT
+);
+CREATE INDEX IF NOT EXISTS features_item ON features (item, feature_type);
+CREATE INDEX IF NOT EXISTS features_feature ON features (feature_type, feature);
+CREATE TABLE IF NOT EXISTS feature_counts (
+    item TEXT NOT NULL,
+    feature_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (item, feature_type, source)
+);
+"""
+
+# file-OFFSET, optionally followed by decoder steps such as -GZIP-120
+forensic_path_re = re.compile(r"^(.*?)-(\d+)((?:-[A-Z0-9]+-\d+)*)$")
+
+
+def is_feature_file(filename):
+    return filename.endswith(".txt") and not filename.endswith("_histogram.txt")
+
+
+def parse_forensic_path(forensic_path):
+    """ Returns (source file, offset) for a bulk_extractor forensic path; image scans have no source file """
+    match = forensic_path_re.match(forensic_path)
+    if match and match.group(1):
+        return match.group(1), match.group(2) + match.group(3)
+    return "", forensic_path
+
+
+def iter_features(feature_file):
+    """ Yields (forensic path, feature, context) from a bulk_extractor feature file, one line at a time """
+    opener = gzip.open if feature_file.endswith(".gz") else open
+    with opener(feature_file, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < 2:
+                continue
+            yield fields[0], fields[1], fields[2] if len(fields) > 2 else ""
+
+
+def compress_feature_files(be_dir):
+    """ gzips the raw feature files in place; returns (bytes before, bytes after) """
+    before = after = 0
+    for filename in sorted(os.listdir(be_dir)):
+        filepath = os.path.join(be_dir, filename)
+        if not filename.endswith(".txt") or not os.path.isfile(filepath):
+            continue
+        before += os.path.getsize(filepath)
+        with open(filepath, "rb") as src, gzip.open(f"{filepath}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(filepath)
+        after += os.path.getsize(f"{filepath}.gz")
+    return before, after
+
+
+class PiiFindingsIndex:
+    """ bulk_extractor features for one item or a whole batch, with counts per feature type and file """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def ingest_dir(self, item, be_dir):
+        """ Loads every feature file in be_dir; returns {feature_type: count} """
+        counts = Counter()
+        with self.lock:
+            with self.connection:
+                self.connection.execute("DELETE FROM features WHERE item = ?", (item,))
+                self.connection.execute("DELETE FROM feature_counts WHERE item = ?", (item,))
+                for filename in sorted(os.listdir(be_dir)):
+                    name = filename[:-len(".gz")] if filename.endswith(".gz") else filename
+                    if not is_feature_file(name):
+                        continue
+                    feature_type = name[:-len(".txt")]
+                    counts.update(self.ingest_file(item, feature_type, os.path.join(be_dir, filename)))
+                self.connection.executemany(
+                    "INSERT INTO feature_counts (item, feature_type, source, count) VALUES (?, ?, ?, ?)",
+                    ((item, feature_type, source, count) for (feature_type, source), count in counts.items())
+                )
+        totals = Counter()
+        for (feature_type, _), count in counts.items():
+            totals[feature_type] += count
+        return dict(totals)
+
+    def ingest_file(self, item, feature_type, feature_file):
+        counts = Counter()
+        rows = []
+        for forensic_path, feature, context in iter_features(feature_file):
+            source, _ = parse_forensic_path(forensic_path)
+            counts[(feature_type, source)] += 1
+            rows.append((item, feature_type, source, forensic_path, feature, context))
+            if len(rows) >= INSERT_BATCH_SIZE:
+                self.insert_features(rows)
+                rows = []
+        self.insert_features(rows)
+        return counts
+
+    def insert_features(self, rows):
+        self.connection.executemany(
+            "INSERT INTO features (item, feature_type, source, forensic_path, feature, context) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def merge(self, db_path):
+        """ Copies the findings of an item-level index into this one """
+        with self.lock:
+            self.connection.execute("ATTACH DATABASE ? AS item_db", (db_path,))
+            try:
+                with self.connection:
+                    items = [row[0] for row in self.connection.execute("SELECT DISTINCT item FROM item_db.feature_counts")]
+                    for item in items:
+                        self.connection.execute("DELETE FROM features WHERE item = ?", (item,))
+                        self.connection.execute("DELETE FROM feature_counts WHERE item = ?", (item,))
+                    self.connection.execute("INSERT INTO features SELECT * FROM item_db.features")
+                    self.connection.execute("INSERT INTO feature_counts SELECT * FROM item_db.feature_counts")
+            finally:
+                self.connection.execute("DETACH DATABASE item_db")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
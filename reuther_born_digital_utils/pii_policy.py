@@ -0,0 +1,95 @@
+import csv
+import hashlib
+import json
+import os
+import sys
+
+
+PII_TIERS = ["full", "sample", "skip"]
+
+# a PUID rule wins over MIME types, and the longest matching MIME type prefix wins between tiers (full, then sample,
+# then skip on a tie), so an exact type in one tier overrides a broader prefix in another; anything unmatched is scanned in full
+DEFAULT_PII_POLICY = {
+    "name": "default",
+    "sample_rate": 0.1,
+    "tiers": {
+        "full": {
+            "mime_types": ["text/", "message/", "application/pdf", "application/rtf", "application/msword", "application/vnd.",
+                           "application/x-sqlite3", "application/x-msaccess", "application/mbox", "application/xml", "application/json"],
+            "puids": []
+        },
+        "sample": {
+            # archives and unidentified binaries could hold anything, but rarely do on the media we receive
+            "mime_types": ["application/zip", "application/x-tar", "application/gzip", "application/x-7z-compressed",
+                           "application/x-rar-compressed", "application/octet-stream"],
+            "puids": []
+        },
+        "skip": {
+            "mime_types": ["audio/", "video/", "image/", "font/", "application/x-msdownload", "application/x-executable",
+                           "application/x-dosexec", "application/x-iso9660-image", "application/vnd.ms-cab-compressed"],
+            # Windows executables, WAVE and MP3 audio
+            "puids": ["fmt/899", "fmt/900", "x-fmt/411", "fmt/141", "fmt/134"]
+        }
+    }
+}
+
+
+class PiiPolicy:
+    """ Assigns files to PII scanning tiers by their siegfried PUID and MIME type """
+    def __init__(self, policy=None):
+        policy = policy or DEFAULT_PII_POLICY
+        self.name = policy.get("name", "custom")
+        self.sample_rate = float(policy.get("sample_rate", DEFAULT_PII_POLICY["sample_rate"]))
+        self.tiers = {tier: {"mime_types": [], "puids": []} for tier in PII_TIERS}
+        for tier, rules in policy.get("tiers", {}).items():
+            if tier not in PII_TIERS:
+                sys.exit(f"Unknown PII scanning tier {tier}, use one of {', '.join(PII_TIERS)}")
+            self.tiers[tier]["mime_types"] = [mime_type.lower() for mime_type in rules.get("mime_types", [])]
+            self.tiers[tier]["puids"] = list(rules.get("puids", []))
+
+    @classmethod
+    def from_file(cls, policy_file=None):
+        if not policy_file:
+            return cls()
+        try:
+            with open(policy_file, "r", encoding="utf-8") as f:
+                policy = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Unable to read PII scanning policy from {policy_file}: {e}")
+        return cls(policy)
+
+    def tier_for(self, puid, mime_type):
+        mime_type = (mime_type or "").lower()
+        for tier in PII_TIERS:
+            if puid and puid in self.tiers[tier]["puids"]:
+                return tier
+        matched_tier, matched_length = "full", -1
+        if mime_type:
+            for tier in PII_TIERS:
+                for prefix in self.tiers[tier]["mime_types"]:
+                    if mime_type.startswith(prefix) and len(prefix) > matched_length:
+                        matched_tier, matched_length = tier, len(prefix)
+        return matched_tier
+
+    def sampled(self, relpath):
+        # a stable choice, so reprocessing an item scans the same sample
+        digest = hashlib.md5(relpath.encode("utf-8", errors="surrogateescape")).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32 < self.sample_rate
+
+    def classify(self, siegfried_csv, objects_dir):
+        """ Returns {objects-relative path: tier}, with sampled files left out of the scan marked "not sampled" """
+        tiers = {}
+        with open(siegfried_csv, "r", newline="", encoding="utf-8", errors="replace") as f:
+            for row in csv.DictReader(f):
+                filename = row.get("Filename") or row.get("filename")
+                if not filename:
+                    continue
+                relpath = os.path.normpath(os.path.relpath(filename, objects_dir))
+                tier = self.tier_for(row.get("ID") or row.get("id"), row.get("MIME") or row.get("mime"))
+                if tier == "sample" and not self.sampled(relpath):
+                    tier = "not sampled"
+                tiers[relpath] = tier
+        return tiers
+
+    def describe(self):
+        return f"{self.name} (sample rate {self.sample_rate:g})"
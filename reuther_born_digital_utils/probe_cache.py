@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import shutil
+
+from reuther_born_digital_utils.local_state import state_path
+
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 16
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def image_fingerprint(image_path, full_hash=False):
+    """ Identify an image by its size and a hash of sampled blocks (or of the whole image) """
+    size = os.path.getsize(image_path)
+    md5 = hashlib.md5()
+    with open(image_path, "rb") as f:
+        if full_hash:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                md5.update(chunk)
+            return f"full-{size}-{md5.hexdigest()}"
+        last_sample = max(0, size - SAMPLE_SIZE)
+        offsets = sorted(set([0, last_sample] + [last_sample * i // (SAMPLE_COUNT - 1) for i in range(1, SAMPLE_COUNT - 1)]))
+        for offset in offsets:
+            f.seek(offset)
+            md5.update(f.read(SAMPLE_SIZE))
+    return f"sampled-{size}-{md5.hexdigest()}"
+
+
+def executable_id(executable):
+    """ For tools without a version flag, identify the installed binary by its path, size and mtime """
+    executable_path = shutil.which(executable)
+    if not executable_path:
+        return f"{executable}: not found"
+    stat = os.stat(executable_path)
+    return f"{executable_path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class ProbeCache:
+    def __init__(self, cache_dir=None, full_hash=False):
+        self.cache_dir = cache_dir or state_path("probe_cache")
+        self.full_hash = full_hash
+        self.fingerprints = {}
+
+    def fingerprint(self, image_path):
+        if image_path not in self.fingerprints:
+            self.fingerprints[image_path] = image_fingerprint(image_path, full_hash=self.full_hash)
+        return self.fingerprints[image_path]
+
+    def entry_dir(self, image_path, probe, tool_version):
+        key = hashlib.sha1(f"{self.fingerprint(image_path)}\n{probe}\n{tool_version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, image_path, probe, tool_version, files):
+        """ Copy cached files to their destinations; files maps cached names to destination paths """
+        entry_dir = self.entry_dir(image_path, probe, tool_version)
+        if not os.path.exists(os.path.join(entry_dir, "complete")):
+            return False
+        for name, destination in files.items():
+            if os.path.exists(os.path.join(entry_dir, name)):
+                shutil.copyfile(os.path.join(entry_dir, name), destination)
+        return True
+
+    def fetch_json(self, image_path, probe, tool_version):
+        entry_dir = self.entry_dir(image_path, probe, tool_version)
+        json_file = os.path.join(entry_dir, f"{probe}.json")
+        if not os.path.exists(os.path.join(entry_dir, "complete")) or not os.path.exists(json_file):
+            return None
+        with open(json_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def store(self, image_path, probe, tool_version, files=None, data=None):
+        entry_dir = self.entry_dir(image_path, probe, tool_version)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, source in (files or {}).items():
+                if os.path.exists(source):
+                    shutil.copyfile(source, os.path.join(tmp_dir, name))
+            if data is not None:
+                with open(os.path.join(tmp_dir, f"{probe}.json"), "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+            with open(os.path.join(tmp_dir, "complete"), "w", encoding="utf-8") as f:
+                f.write(f"{self.fingerprint(image_path)}\n{tool_version}\n")
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            print(f"Unable to cache {probe} results for {image_path}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
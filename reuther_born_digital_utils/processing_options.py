@@ -0,0 +1,43 @@
+from reuther_born_digital_utils.tool_runner import ToolTimeouts
+
+
+class ProcessingOptions:
+    """ The settings for a run, built once from the command line and read by the batch and each item it processes.
+
+    Batch-only settings (workers, pack_small, nimbie_failed, progress_endpoint, autotune, batch_report) are
+    ignored when a single item is processed; the disk image settings are ignored by folder transfers.
+    """
+    def __init__(self, keep_image=False, nimbie_transfer=False, timeouts=None, serialize=None, snapshot=None,
+                 dfxml_compression="none", resource_limits=None, device_limits=None,
+                 holdings_index=None, skip_scanned_pii=False, index_pii=False, compress_pii=False, pii_policy=None,
+                 image_extensions=None, disk_probe="native", probe_reports=False, fat_extractor="native", probe_cache=None,
+                 workers=1, pack_small=0, nimbie_failed="last", progress_endpoint=None, autotune=False, batch_report=False):
+        self.keep_image = keep_image
+        self.nimbie_transfer = nimbie_transfer
+        self.timeouts = timeouts or ToolTimeouts()
+        self.serialize = serialize
+        self.snapshot = snapshot
+        self.dfxml_compression = dfxml_compression
+        self.resource_limits = resource_limits
+        self.device_limits = device_limits
+
+        self.holdings_index = holdings_index
+        self.skip_scanned_pii = skip_scanned_pii
+        self.index_pii = index_pii
+        self.compress_pii = compress_pii
+        self.pii_policy = pii_policy
+
+        self.image_extensions = image_extensions
+        # "native" reads partition maps and superblocks in process, falling back to disktype when it finds nothing
+        self.disk_probe = disk_probe
+        self.probe_reports = probe_reports
+        # "native" extracts, hashes, dates and describes FAT file systems in one pass instead of fiwalk, tsk_recover and fix_dates
+        self.fat_extractor = fat_extractor
+        self.probe_cache = probe_cache
+
+        self.workers = max(1, workers)
+        self.pack_small = pack_small
+        self.nimbie_failed = nimbie_failed
+        self.progress_endpoint = progress_endpoint
+        self.autotune = autotune
+        self.batch_report = batch_report
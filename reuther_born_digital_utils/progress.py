@@ -0,0 +1,182 @@
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reuther_born_digital_utils.local_state import write_json_atomic
+from reuther_born_digital_utils.space_planner import format_size
+
+
+# don't rewrite progress.json more often than this, except when an item finishes
+WRITE_INTERVAL = 2.0
+
+
+class BatchProgress:
+    """ Items and stages done, bytes processed, per-stage rates and an ETA for a running batch """
+    def __init__(self, progress_file, planned_items, workers=1):
+        self.progress_file = progress_file
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.started = time.time()
+        self.last_write = 0
+        self.items = {}
+        for planned_item in planned_items:
+            self.items[os.path.basename(planned_item.item_dir)] = {
+                "size": planned_item.input_size,
+                "status": "pending",
+                "stage": None,
+                "stages_done": 0,
+                "stage_count": None,
+                "started": None,
+                "finished": None
+            }
+        self.stage_stats = {}
+
+    def item_started(self, processor):
+        with self.lock:
+            item = self.items[processor.item_name()]
+            item["status"] = "running"
+            item["started"] = time.time()
+        self.write()
+
+    def stage_changed(self, processor, stage):
+        """ A stage listener for ItemProcessor.stage_listeners """
+        with self.lock:
+            item = self.items[processor.item_name()]
+            item["stage_count"] = processor.stage_count
+            if stage.status == "running":
+                item["stage"] = stage.name
+                return
+            item["stages_done"] += 1
+            duration = stage.duration()
+            if stage.status == "done" and duration is not None:
+                stats = self.stage_stats.setdefault(stage.name, {"count": 0, "seconds": 0.0, "bytes": 0})
+                stats["count"] += 1
+                stats["seconds"] += duration
+                stats["bytes"] += item["size"]
+        self.write()
+
+    def item_finished(self, item_dir, status):
+        with self.lock:
+            item = self.items.get(os.path.basename(item_dir))
+            if item is None:
+                return
+            item["status"] = status
+            item["stage"] = None
+            item["finished"] = time.time()
+        self.write(force=True)
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.started
+            total_bytes = sum(item["size"] for item in self.items.values())
+            done_bytes = 0.0
+            for item in self.items.values():
+                if item["finished"] is not None:
+                    done_bytes += item["size"]
+                elif item["status"] == "running" and item["stage_count"]:
+                    done_bytes += item["size"] * min(1, item["stages_done"] / item["stage_count"])
+            throughput = done_bytes / elapsed if elapsed > 0 else 0
+            eta = (total_bytes - done_bytes) / throughput if throughput > 0 else None
+            counts = {}
+            for item in self.items.values():
+                counts[item["status"]] = counts.get(item["status"], 0) + 1
+            return {
+                "updated": now,
+                "elapsed_seconds": round(elapsed, 1),
+                "workers": self.workers,
+                "items_total": len(self.items),
+                "items_done": sum(1 for item in self.items.values() if item["finished"] is not None),
+                "item_statuses": counts,
+                "stages_done": sum(item["stages_done"] for item in self.items.values()),
+                "bytes_total": total_bytes,
+                "bytes_done": int(done_bytes),
+                "bytes_per_second": round(throughput, 1),
+                "eta_seconds": None if eta is None else round(eta, 1),
+                "running": {
+                    name: {"stage": item["stage"], "stages_done": item["stages_done"], "stage_count": item["stage_count"]}
+                    for name, item in self.items.items() if item["status"] == "running"
+                },
+                "stages": {
+                    name: dict(
+                        stats,
+                        seconds=round(stats["seconds"], 1),
+                        bytes_per_second=round(stats["bytes"] / stats["seconds"], 1) if stats["seconds"] else None
+                    )
+                    for name, stats in self.stage_stats.items()
+                }
+            }
+
+    def write(self, force=False):
+        with self.write_lock:
+            now = time.time()
+            if not force and now - self.last_write < WRITE_INTERVAL:
+                return
+            self.last_write = now
+            try:
+                write_json_atomic(self.progress_file, self.snapshot())
+            except OSError as e:
+                print(f"Unable to write {self.progress_file}: {e}")
+
+    def summary(self):
+        snapshot = self.snapshot()
+        eta = "unknown" if snapshot["eta_seconds"] is None else f"{snapshot['eta_seconds'] / 60:.0f} min"
+        return (
+            f"{snapshot['items_done']}/{snapshot['items_total']} items, "
+            f"{format_size(snapshot['bytes_done'])} of {format_size(snapshot['bytes_total'])} "
+            f"({format_size(snapshot['bytes_per_second'])}/s), ETA {eta}"
+        )
+
+
+class ProgressRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.progress.snapshot(), indent=2, sort_keys=True).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects an (address, port) client address
+        return request, ("local", 0)
+
+
+class ProgressServer:
+    """ Serves the batch's progress as JSON over HTTP on host:port (or port) or unix:/path/to/socket """
+    def __init__(self, progress, endpoint):
+        self.endpoint = endpoint
+        self.socket_path = None
+        if endpoint.startswith("unix:"):
+            self.socket_path = endpoint[len("unix:"):]
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = UnixHTTPServer(self.socket_path, ProgressRequestHandler)
+        else:
+            host, _, port = endpoint.rpartition(":")
+            self.server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), ProgressRequestHandler)
+            self.server.daemon_threads = True
+        self.server.progress = progress
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        print(f"Serving batch progress on {self.endpoint}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
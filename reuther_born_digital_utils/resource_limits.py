@@ -0,0 +1,188 @@
+import itertools
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+
+
+# Memory (MB) and CPU time (seconds) allowed for each external tool; tools not listed run unlimited.
+# A tool's memory limit is also what it reserves from the shared memory budget while it runs.
+DEFAULT_RESOURCE_LIMITS = {
+    "fiwalk": {"memory_mb": 4096},
+    "tsk_recover": {"memory_mb": 2048},
+    "unhfs": {"memory_mb": 3072},
+    "brunnhilde": {"memory_mb": 4096},
+    "bulk_extractor": {"memory_mb": 6144}
+}
+# share of physical memory the limited tools may reserve between them when no budget is configured
+DEFAULT_BUDGET_SHARE = 0.8
+DEFAULT_CGROUP_ROOT = "/sys/fs/cgroup/reuther_bd"
+# seconds of CPU time between the soft limit's SIGXCPU and the hard limit's SIGKILL
+CPU_GRACE_SECONDS = 10
+
+
+def physical_memory_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError):
+        return None
+
+
+def read_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def usable_cgroup_root(cgroup_root):
+    """ A cgroup v2 directory we can create children in, with the memory controller enabled for them """
+    if not os.path.isdir(cgroup_root) or not os.access(cgroup_root, os.W_OK):
+        return None
+    if "memory" not in read_file(os.path.join(cgroup_root, "cgroup.controllers")).split():
+        return None
+    if "memory" not in read_file(os.path.join(cgroup_root, "cgroup.subtree_control")).split():
+        try:
+            with open(os.path.join(cgroup_root, "cgroup.subtree_control"), "w", encoding="utf-8") as f:
+                f.write("+memory")
+        except OSError:
+            return None
+    # moving a process in also needs write access to cgroup.procs up to our common ancestor
+    probe_dir = os.path.join(cgroup_root, f"probe-{os.getpid()}")
+    try:
+        os.makedirs(probe_dir, exist_ok=True)
+        result = subprocess.run(["/bin/sh", "-c", f"echo $$ > {shlex.quote(os.path.join(probe_dir, 'cgroup.procs'))}"], stderr=subprocess.DEVNULL)
+        return cgroup_root if result.returncode == 0 else None
+    except OSError:
+        return None
+    finally:
+        try:
+            os.rmdir(probe_dir)
+        except OSError:
+            pass
+
+
+class LimitedRun:
+    """ One run of a limited tool: wraps its command line and explains a limit-triggered death afterwards """
+    def __init__(self, limits, cgroup_dir=None):
+        self.memory_mb = limits.get("memory_mb")
+        self.cpu_seconds = limits.get("cpu_seconds")
+        self.cgroup_dir = cgroup_dir
+        # the memory limit applied with setrlimit when there is no cgroup, if any
+        self.rlimit_mb = None
+
+    def wrap(self, cmd):
+        setup = []
+        if self.cgroup_dir:
+            setup.append(f"echo $$ > {shlex.quote(os.path.join(self.cgroup_dir, 'cgroup.procs'))}")
+        elif self.memory_mb:
+            # the data segment rather than the address space, which JVMs reserve far more of than they use
+            setup.append(f"ulimit -d {int(self.memory_mb) * 1024}")
+            self.rlimit_mb = self.memory_mb
+        if self.cpu_seconds:
+            # a soft limit below the hard one, so running out of CPU time shows up as SIGXCPU rather than SIGKILL
+            setup.append(f"ulimit -S -t {int(self.cpu_seconds)}")
+            setup.append(f"ulimit -H -t {int(self.cpu_seconds) + CPU_GRACE_SECONDS}")
+        if not setup:
+            return cmd
+        # the shell applies the limits, then exec replaces it with the tool under the same pid
+        return ["/bin/sh", "-c", " && ".join(setup) + ' && exec "$@"', "sh"] + list(cmd)
+
+    def exceeded(self, returncode):
+        """ Why the tool was stopped by a limit, or None if it wasn't """
+        if self.cgroup_dir:
+            for line in read_file(os.path.join(self.cgroup_dir, "memory.events")).splitlines():
+                name, _, count = line.partition(" ")
+                if name == "oom_kill" and int(count or 0) > 0:
+                    return f"was killed after exceeding its {self.memory_mb} MB memory limit"
+        if self.cpu_seconds and returncode == -signal.SIGXCPU:
+            return f"was killed after exceeding its {self.cpu_seconds} second CPU time limit"
+        if returncode == -signal.SIGKILL:
+            if self.cpu_seconds:
+                return (
+                    f"was killed by SIGKILL, either by the out-of-memory killer or for running past "
+                    f"its {self.cpu_seconds} second CPU time limit"
+                )
+            # left to run_tool, which reports SIGKILL the same way for every tool
+            return None
+        if self.rlimit_mb and returncode:
+            # a failed allocation under setrlimit is an ordinary error exit, with nothing to confirm it was memory
+            return f"exited with status {returncode} while limited to {self.rlimit_mb} MB of memory, probably after running out of memory"
+        return None
+
+
+class ResourceLimits:
+    """ Per-tool memory and CPU limits, and a memory budget shared by every limited tool running in the batch """
+    def __init__(self, limits=None, memory_budget_mb=None, cgroup_root=None):
+        self.limits = {tool: dict(tool_limits) for tool, tool_limits in DEFAULT_RESOURCE_LIMITS.items()}
+        for tool, tool_limits in (limits or {}).items():
+            self.limits.setdefault(tool, {}).update(tool_limits)
+        total_mb = physical_memory_mb()
+        self.memory_budget_mb = memory_budget_mb or (int(total_mb * DEFAULT_BUDGET_SHARE) if total_mb else None)
+        self.cgroup_root = usable_cgroup_root(cgroup_root or DEFAULT_CGROUP_ROOT)
+        self.reserved_mb = 0
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        method = f"cgroup v2 under {self.cgroup_root}" if self.cgroup_root else "setrlimit"
+        budget = f"{self.memory_budget_mb} MB" if self.memory_budget_mb else "unlimited"
+        print(f"Limiting tool resources with {method}; memory budget {budget}")
+
+    @classmethod
+    def from_file(cls, limits_file=None):
+        if not limits_file:
+            return cls()
+        try:
+            with open(limits_file, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Unable to read resource limits from {limits_file}: {e}")
+        return cls(config.get("tools"), config.get("memory_budget_mb"), config.get("cgroup_root"))
+
+    def for_tool(self, tool):
+        limits = self.limits.get(tool)
+        if not limits or not any(limits.get(key) for key in ["memory_mb", "cpu_seconds"]):
+            return None
+        return limits
+
+    @contextmanager
+    def reserve(self, memory_mb):
+        """ Wait until memory_mb of the budget is free, and hold it """
+        needed = min(memory_mb or 0, self.memory_budget_mb or 0)
+        with self.condition:
+            self.condition.wait_for(lambda: self.reserved_mb + needed <= (self.memory_budget_mb or 0))
+            self.reserved_mb += needed
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.reserved_mb -= needed
+                self.condition.notify_all()
+
+    @contextmanager
+    def limited_run(self, tool, stage):
+        limits = self.for_tool(tool)
+        with self.reserve(limits.get("memory_mb")):
+            cgroup_dir = None
+            if self.cgroup_root:
+                name = "".join(char if char.isalnum() else "_" for char in stage)
+                cgroup_dir = os.path.join(self.cgroup_root, f"{name}-{os.getpid()}-{next(self.counter)}")
+                os.makedirs(cgroup_dir)
+                if limits.get("memory_mb"):
+                    with open(os.path.join(cgroup_dir, "memory.max"), "w", encoding="utf-8") as f:
+                        f.write(str(int(limits["memory_mb"]) * 1024 * 1024))
+                    if os.path.exists(os.path.join(cgroup_dir, "memory.swap.max")):
+                        with open(os.path.join(cgroup_dir, "memory.swap.max"), "w", encoding="utf-8") as f:
+                            f.write("0")
+            try:
+                yield LimitedRun(limits, cgroup_dir)
+            finally:
+                if cgroup_dir:
+                    try:
+                        os.rmdir(cgroup_dir)
+                    except OSError:
+                        print(f"Unable to remove cgroup {cgroup_dir}")
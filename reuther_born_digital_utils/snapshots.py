@@ -0,0 +1,191 @@
+import datetime
+import errno
+import fcntl
+import os
+import shutil
+import sys
+import threading
+
+from reuther_born_digital_utils.local_state import load_json, write_json_atomic
+
+
+SNAPSHOTS_DIRNAME = ".item_snapshots"
+SNAPSHOT_MODES = ["auto", "reflink", "hardlink", "journal"]
+# from linux/fs.h
+FICLONE = 0x40049409
+# errors meaning the file system can't clone or link here, rather than that something is wrong with the item
+UNSUPPORTED_ERRNOS = [errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOSYS]
+
+
+def snapshot_dir_for(item_dir):
+    """ Snapshots live next to the item so reflinks and hard links stay on the same file system """
+    item_dir = os.path.normpath(os.path.abspath(item_dir))
+    return os.path.join(os.path.dirname(item_dir), SNAPSHOTS_DIRNAME, os.path.basename(item_dir))
+
+
+def reflink_file(src, dst):
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+    shutil.copystat(src, dst)
+
+
+def clone_tree(src_dir, dst_dir, link_file):
+    """ Recreates src_dir at dst_dir, making each regular file with link_file and copying symlinks as symlinks """
+    directories = []
+    for root, dirnames, filenames in os.walk(src_dir):
+        target_root = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+        os.makedirs(target_root, exist_ok=True)
+        directories.append((root, target_root))
+        for name in dirnames + filenames:
+            src = os.path.join(root, name)
+            dst = os.path.join(target_root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif os.path.isfile(src):
+                link_file(src, dst)
+    for root, target_root in reversed(directories):
+        shutil.copystat(root, target_root)
+
+
+def inventory(item_dir):
+    paths = []
+    for root, dirnames, filenames in os.walk(item_dir):
+        for name in dirnames + filenames:
+            paths.append(os.path.relpath(os.path.join(root, name), item_dir))
+    return sorted(paths)
+
+
+class ItemSnapshot:
+    """ A cheap, restorable copy of an item directory taken before anything changes it.
+
+    reflink clones every file (btrfs, XFS); hardlink links every file into a parallel tree, which is
+    safe because processing moves and deletes originals but never rewrites them; journal records each
+    move and diverts each deletion so they can be undone where neither is possible.
+    """
+    def __init__(self, item_dir, mode="auto"):
+        self.item_dir = os.path.normpath(os.path.abspath(item_dir))
+        self.requested_mode = mode
+        self.snapshot_dir = snapshot_dir_for(item_dir)
+        self.tree_dir = os.path.join(self.snapshot_dir, "tree")
+        self.trash_dir = os.path.join(self.snapshot_dir, "trash")
+        self.state_file = os.path.join(self.snapshot_dir, "snapshot.json")
+        self.lock = threading.Lock()
+        self.state = load_json(self.state_file)
+
+    @property
+    def mode(self):
+        return self.state["mode"] if self.state else None
+
+    def exists(self):
+        return self.state is not None
+
+    def take(self):
+        if self.exists():
+            # an earlier run left this snapshot because it didn't finish; it still holds the original item
+            print(f"Keeping existing {self.mode} snapshot of {self.item_dir} from {self.state['created']}")
+            return
+        modes = ["reflink", "hardlink", "journal"] if self.requested_mode == "auto" else [self.requested_mode]
+        for mode in modes:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+            os.makedirs(self.snapshot_dir)
+            try:
+                if mode == "reflink":
+                    clone_tree(self.item_dir, self.tree_dir, reflink_file)
+                elif mode == "hardlink":
+                    clone_tree(self.item_dir, self.tree_dir, os.link)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or mode == modes[-1]:
+                    self.prune()
+                    sys.exit(f"Unable to take a {mode} snapshot of {self.item_dir}: {e}")
+                continue
+            self.state = {"mode": mode, "item_dir": self.item_dir, "created": str(datetime.datetime.now()), "moves": [], "removals": []}
+            if mode == "journal":
+                os.makedirs(self.trash_dir)
+                self.state["inventory"] = inventory(self.item_dir)
+            write_json_atomic(self.state_file, self.state)
+            print(f"Took a {mode} snapshot of {self.item_dir}")
+            return
+
+    def record_move(self, src, dst):
+        if self.mode != "journal":
+            return
+        with self.lock:
+            self.state["moves"].append([os.path.abspath(src), os.path.abspath(dst)])
+            write_json_atomic(self.state_file, self.state)
+
+    def remove(self, path):
+        """ Deletes path, or in journal mode moves it into the snapshot so a rollback can put it back """
+        if self.mode != "journal":
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return
+        with self.lock:
+            trash_path = os.path.join(self.trash_dir, str(len(self.state["removals"])))
+            os.rename(path, trash_path)
+            self.state["removals"].append([os.path.abspath(path), trash_path])
+            write_json_atomic(self.state_file, self.state)
+
+    def locate(self, path):
+        """ Where a journaled path is now; bagit moves the whole payload under data/ without telling us """
+        if os.path.lexists(path):
+            return path
+        relpath = os.path.relpath(path, self.item_dir)
+        in_bag = os.path.join(self.item_dir, "data", relpath)
+        return in_bag if os.path.lexists(in_bag) else None
+
+    def rollback(self):
+        if not self.exists():
+            print(f"No snapshot of {self.item_dir} to roll back to")
+            return False
+        print(f"Rolling {self.item_dir} back to its {self.mode} snapshot from {self.state['created']}")
+        if self.mode == "journal":
+            self.rollback_journal()
+        else:
+            if os.path.exists(self.item_dir):
+                shutil.rmtree(self.item_dir)
+            os.rename(self.tree_dir, self.item_dir)
+        self.prune()
+        return True
+
+    def rollback_journal(self):
+        for path, trash_path in reversed(self.state["removals"]):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.rename(trash_path, path)
+        for src, dst in reversed(self.state["moves"]):
+            current = self.locate(dst)
+            if current:
+                os.makedirs(os.path.dirname(src), exist_ok=True)
+                os.rename(current, src)
+        # anything processing created is removed; originals are never touched
+        original = set(self.state["inventory"])
+        for root, dirnames, filenames in os.walk(self.item_dir, topdown=False):
+            for name in filenames:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, self.item_dir) not in original:
+                    os.remove(path)
+            for name in dirnames:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, self.item_dir) not in original:
+                    if os.path.islink(path):
+                        os.remove(path)
+                    elif not os.listdir(path):
+                        os.rmdir(path)
+
+    def prune(self):
+        shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+        snapshots_root = os.path.dirname(self.snapshot_dir)
+        if os.path.isdir(snapshots_root) and not os.listdir(snapshots_root):
+            os.rmdir(snapshots_root)
+        self.state = None
+
+
+def rollback_items(source_dir):
+    """ Rolls back the item at source_dir, or every item in the batch at source_dir that has a snapshot """
+    snapshots_root = os.path.join(os.path.abspath(source_dir), SNAPSHOTS_DIRNAME)
+    if os.path.isdir(snapshots_root):
+        item_dirs = [os.path.join(os.path.abspath(source_dir), name) for name in sorted(os.listdir(snapshots_root))]
+    else:
+        item_dirs = [source_dir]
+    return all([ItemSnapshot(item_dir).rollback() for item_dir in item_dirs])
@@ -0,0 +1,172 @@
+import os
+import shutil
+import threading
+
+from reuther_born_digital_utils.local_state import load_json, state_path, write_json_atomic
+
+
+# Extra space needed while an item is processed, as a fraction of its input size.
+# Disk images are extracted next to the image, folder transfers are only moved.
+DEFAULT_GROWTH_RATIOS = {
+    "disk_images": 1.25,
+    "folders": 0.15
+}
+# brunnhilde reports, PREMIS, DFXML and bag tag files for even the smallest item
+MIN_ITEM_OVERHEAD = 5 * 1024 * 1024
+# Never plan to use the last bit of a volume
+DEFAULT_FREE_SPACE_MARGIN = 1024 * 1024 * 1024
+MAX_HISTORY_SAMPLES = 200
+
+
+def format_size(num_bytes):
+    size = float(num_bytes)
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(size) < 1024 or unit == "TB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def directory_size(dirpath):
+    total = 0
+    for root, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class SpaceHistory:
+    def __init__(self, history_file=None):
+        self.history_file = history_file or state_path("space_history.json")
+        self.lock = threading.Lock()
+        self.ratios = load_json(self.history_file, default={})
+
+    def growth_ratio(self, transfer_type):
+        samples = sorted(self.ratios.get(transfer_type, []))
+        if len(samples) < 5:
+            return DEFAULT_GROWTH_RATIOS.get(transfer_type, 1.0)
+        # plan for the 90th percentile rather than the average item
+        return samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+
+    def record(self, transfer_type, input_size, peak_growth):
+        if input_size <= 0:
+            return
+        with self.lock:
+            samples = self.ratios.setdefault(transfer_type, [])
+            samples.append(round(peak_growth / input_size, 4))
+            del samples[:-MAX_HISTORY_SAMPLES]
+            try:
+                write_json_atomic(self.history_file, self.ratios)
+            except OSError:
+                print(f"Unable to update space history at {self.history_file}")
+
+
+class PlannedItem:
+    def __init__(self, item_dir, input_size, estimate):
+        self.item_dir = item_dir
+        self.input_size = input_size
+        self.estimate = estimate
+
+
+class SpacePlanner:
+    def __init__(self, source_dir, transfer_type, keep_image=False, margin=DEFAULT_FREE_SPACE_MARGIN, history=None):
+        self.source_dir = source_dir
+        self.transfer_type = transfer_type
+        self.keep_image = keep_image
+        self.margin = margin
+        self.history = history or SpaceHistory()
+
+    def free_space(self):
+        return shutil.disk_usage(self.source_dir).free
+
+    def plan_item(self, item_dir):
+        input_size = directory_size(item_dir)
+        growth = int(input_size * self.history.growth_ratio(self.transfer_type))
+        return PlannedItem(item_dir, input_size, max(growth, MIN_ITEM_OVERHEAD))
+
+    def schedule(self, item_dirs):
+        # alternate the largest and smallest remaining items so a long extraction
+        # always has short items running alongside it
+        by_size = sorted((self.plan_item(item_dir) for item_dir in item_dirs), key=lambda i: i.estimate, reverse=True)
+        ordered = []
+        while by_size:
+            ordered.append(by_size.pop(0))
+            if by_size:
+                ordered.append(by_size.pop())
+        return ordered
+
+    def record_actual(self, planned_item, size_before, size_after):
+        peak_growth = size_after - size_before
+        if self.transfer_type == "disk_images" and not self.keep_image:
+            # the image was still there while its contents were extracted
+            peak_growth += planned_item.input_size
+        self.history.record(self.transfer_type, planned_item.input_size, max(0, peak_growth))
+        return size_after - size_before
+
+    def simulate(self, schedule, workers):
+        """ Estimate peak usage and deferrals assuming run time is proportional to size """
+        budget = self.free_space() - self.margin
+        clock = 0.0
+        running = []
+        pending = list(schedule)
+        peak = 0
+        rows = []
+        while pending or running:
+            fitted = None
+            if len(running) < workers:
+                reserved = sum(item.estimate for _, item in running)
+                for item in pending:
+                    if reserved + item.estimate <= budget:
+                        fitted = item
+                        break
+                if fitted is None and not running and pending:
+                    rows.append((pending.pop(0), None))
+                    continue
+            if fitted is not None:
+                pending.remove(fitted)
+                running.append((clock + max(fitted.input_size, 1), fitted))
+                rows.append((fitted, clock))
+                peak = max(peak, sum(item.estimate for _, item in running))
+                continue
+            running.sort(key=lambda r: r[0])
+            clock, _ = running.pop(0)
+        return rows, peak, budget
+
+
+class SpaceAdmission:
+    def __init__(self, planner, workers):
+        self.planner = planner
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.budget = planner.free_space() - planner.margin
+        self.reserved = 0
+        self.running = 0
+
+    def next_item(self, pending):
+        """ Block until an item in pending fits; returns (item, fits) and removes it from pending """
+        with self.condition:
+            while True:
+                if self.running < self.workers:
+                    for item in pending:
+                        if self.reserved + item.estimate <= self.budget:
+                            pending.remove(item)
+                            self.reserved += item.estimate
+                            self.running += 1
+                            return item, True
+                    if self.running == 0:
+                        return pending.pop(0), False
+                self.condition.wait()
+
+    def set_workers(self, workers):
+        with self.condition:
+            self.workers = workers
+            self.condition.notify_all()
+
+    def release(self, item, growth):
+        with self.condition:
+            self.reserved -= item.estimate
+            self.running -= 1
+            self.budget -= growth
+            self.condition.notify_all()
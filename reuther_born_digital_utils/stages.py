@@ -0,0 +1,140 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+UP_TO_DATE = "up to date"
+NOT_NEEDED = "not needed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+SATISFIED = [DONE, UP_TO_DATE, NOT_NEEDED]
+FINISHED = SATISFIED + [CANCELLED, FAILED]
+
+
+class Stage:
+    """ One step of item processing.
+
+    requires: names of stages that must finish first
+    inputs/outputs: paths (or a callable returning paths) read and written by the stage;
+        a stage whose outputs all exist and are newer than its inputs is not rerun
+    when: optional callable, the stage is skipped as not needed if it returns False
+    always: run even after the item has been skipped, flagged or a stage failed
+    """
+    def __init__(self, name, func, requires=(), inputs=(), outputs=(), when=None, always=False):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.when = when
+        self.always = always
+        self.status = PENDING
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def paths(self, paths):
+        if callable(paths):
+            paths = paths()
+        return [path for path in paths if path]
+
+    def is_up_to_date(self):
+        outputs = self.paths(self.outputs)
+        if not outputs or not all(os.path.exists(output) for output in outputs):
+            return False
+        inputs = [path for path in self.paths(self.inputs) if os.path.exists(path)]
+        if not inputs:
+            return True
+        newest_input = max(os.path.getmtime(path) for path in inputs)
+        oldest_output = min(os.path.getmtime(path) for path in outputs)
+        return oldest_output >= newest_input
+
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class StageRunner:
+    def __init__(self, stages, max_workers=3, should_continue=None, on_status=None, on_error=None):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for required in stage.requires:
+                if required not in self.stages:
+                    raise ValueError(f"Stage {stage.name} requires unknown stage {required}")
+        self.max_workers = max_workers
+        self.should_continue = should_continue or (lambda: True)
+        self.on_status = on_status
+        self.on_error = on_error
+
+    def set_status(self, stage, status):
+        stage.status = status
+        if self.on_status:
+            self.on_status(stage)
+
+    def count_pending(self):
+        return len(self.pending_names())
+
+    def pending_names(self):
+        return [name for name, stage in self.stages.items() if stage.status == PENDING]
+
+    def ready_stages(self):
+        ready = []
+        for stage in self.stages.values():
+            if stage.status != PENDING:
+                continue
+            required = [self.stages[name] for name in stage.requires]
+            if not all(r.status in FINISHED for r in required):
+                continue
+            if stage.always:
+                ready.append(stage)
+            elif any(r.status in [CANCELLED, FAILED] for r in required) or not self.should_continue():
+                self.set_status(stage, CANCELLED)
+            else:
+                ready.append(stage)
+        return ready
+
+    def run_stage(self, stage):
+        stage.started = time.time()
+        try:
+            stage.func()
+        finally:
+            stage.finished = time.time()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while True:
+                pending_before = self.count_pending()
+                for stage in self.ready_stages():
+                    if stage.when is not None and not stage.when():
+                        self.set_status(stage, NOT_NEEDED)
+                    elif stage.is_up_to_date():
+                        self.set_status(stage, UP_TO_DATE)
+                    else:
+                        self.set_status(stage, RUNNING)
+                        running[executor.submit(self.run_stage, stage)] = stage
+                if not running:
+                    pending = self.count_pending()
+                    if not pending:
+                        break
+                    if pending == pending_before:
+                        raise ValueError(f"Stages can never run, check for circular requirements: {self.pending_names()}")
+                    # stages skipped or cancelled above may have unblocked others
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self.set_status(stage, DONE)
+                    else:
+                        stage.error = error
+                        if self.on_error:
+                            self.on_error(stage, error)
+                        self.set_status(stage, FAILED)
+        return self.stages
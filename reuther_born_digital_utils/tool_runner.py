@@ -0,0 +1,122 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+
+
+# Seconds allowed for each external tool: a base allowance plus an allowance per GB
+# of the disk image or transfer being processed
+DEFAULT_TIMEOUTS = {
+    "version": {"base": 60, "per_gb": 0},
+    "disktype": {"base": 300, "per_gb": 30},
+    "mmls": {"base": 300, "per_gb": 30},
+    "fiwalk": {"base": 1800, "per_gb": 600},
+    "tsk_recover": {"base": 1800, "per_gb": 900},
+    "unhfs": {"base": 1800, "per_gb": 900},
+    "mount": {"base": 300, "per_gb": 0},
+    "umount": {"base": 300, "per_gb": 0},
+    "walk_to_dfxml": {"base": 1800, "per_gb": 600},
+    "brunnhilde": {"base": 3600, "per_gb": 1800},
+    "bulk_extractor": {"base": 3600, "per_gb": 1800},
+    "bagit": {"base": 1800, "per_gb": 600}
+}
+
+
+class ToolTimeout(Exception):
+    def __init__(self, stage, cmd, timeout, event_type=None):
+        self.stage = stage
+        self.cmd = cmd
+        self.timeout = timeout
+        self.event_type = event_type
+        super().__init__(f"{stage} timed out after {int(timeout)} seconds")
+
+
+class ToolLimitExceeded(Exception):
+    """ A tool killed for running out of memory or CPU time; the item may succeed when retried on its own """
+    def __init__(self, stage, cmd, reason, event_type=None):
+        self.stage = stage
+        self.cmd = cmd
+        self.reason = reason
+        self.event_type = event_type
+        super().__init__(f"{stage} {reason}")
+
+
+class ToolTimeouts:
+    def __init__(self, timeouts=None, scale=1.0):
+        self.timeouts = {tool: dict(limits) for tool, limits in DEFAULT_TIMEOUTS.items()}
+        for tool, limits in (timeouts or {}).items():
+            self.timeouts.setdefault(tool, {"base": 0, "per_gb": 0}).update(limits)
+        self.scale = scale
+
+    @classmethod
+    def from_file(cls, timeouts_file=None, scale=1.0):
+        if not timeouts_file:
+            return cls(scale=scale)
+        try:
+            with open(timeouts_file, "r", encoding="utf-8") as f:
+                timeouts = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Unable to read timeouts from {timeouts_file}: {e}")
+        return cls(timeouts, scale=scale)
+
+    def for_tool(self, tool, size_bytes=0):
+        if tool not in self.timeouts:
+            # every tool needs an entry, so a new tool can't quietly run without a watchdog
+            raise KeyError(f"No timeout is configured for {tool}; add it to DEFAULT_TIMEOUTS")
+        limits = self.timeouts[tool]
+        if limits.get("base") is None:
+            # a tool configured with "base": null is never timed out
+            return None
+        size_gb = size_bytes / (1024 ** 3)
+        return (limits["base"] + limits.get("per_gb", 0) * size_gb) * self.scale
+
+
+def kill_process_group(process, new_session=True):
+    if not new_session:
+        # sudo relays SIGTERM to the command it runs; a SIGKILL would leave the command running
+        try:
+            process.terminate()
+        except OSError:
+            print(f"Unable to kill process {process.pid}")
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        # e.g. a tool that switched user; fall back to whatever we are allowed to signal
+        try:
+            process.kill()
+        except OSError:
+            print(f"Unable to kill process {process.pid}")
+
+
+def run_tool(cmd, stage, timeout=None, event_type=None, capture_output=False, stdout=None, stderr=None, cwd=None, limited_run=None):
+    if capture_output:
+        stdout = subprocess.PIPE
+        stderr = subprocess.PIPE
+    # each tool gets its own process group so a timeout also takes down anything it spawned
+    # (brunnhilde runs siegfried and bulk_extractor); sudo is left on our terminal so it can ask for a password
+    new_session = cmd[0] != "sudo"
+    popen_cmd = limited_run.wrap(cmd) if limited_run else cmd
+    process = subprocess.Popen(popen_cmd, stdout=stdout, stderr=stderr, cwd=cwd, start_new_session=new_session)
+    try:
+        out, err = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"{stage} exceeded its {int(timeout)} second timeout, killing it")
+        kill_process_group(process, new_session)
+        process.communicate()
+        raise ToolTimeout(stage, cmd, timeout, event_type=event_type)
+    except BaseException:
+        kill_process_group(process, new_session)
+        process.wait()
+        raise
+    reason = limited_run.exceeded(process.returncode) if limited_run else None
+    if reason is None and process.returncode == -signal.SIGKILL:
+        # nothing here sends SIGKILL except on a timeout, so this is almost always the kernel's OOM killer
+        reason = "was killed by SIGKILL, most likely by the out-of-memory killer"
+    if reason:
+        print(f"{stage} {reason}")
+        raise ToolLimitExceeded(stage, cmd, reason, event_type=event_type)
+    return subprocess.CompletedProcess(cmd, process.returncode, out, err)
@@ -0,0 +1,109 @@
+import struct
+
+SECTOR = 512
+FAT_SECTORS = 9
+ROOT_ENTRIES = 224
+DATA_OFFSET = (1 + 2 * FAT_SECTORS + ROOT_ENTRIES * 32 // SECTOR) * SECTOR
+
+
+def dos_date(year, month, day):
+    return ((year - 1980) << 9) | (month << 5) | day
+
+
+def dos_time(hour, minute, second):
+    return (hour << 11) | (minute << 5) | (second // 2)
+
+
+def short_entry(name11, attributes, cluster, size=0, date=dos_date(1999, 12, 31), time_of_day=dos_time(23, 59, 58)):
+    entry = bytearray(32)
+    entry[0:11] = name11
+    entry[11] = attributes
+    entry[14:16] = struct.pack("<H", time_of_day)
+    entry[16:18] = struct.pack("<H", date)
+    entry[22:24] = struct.pack("<H", time_of_day)
+    entry[24:26] = struct.pack("<H", date)
+    entry[26:28] = struct.pack("<H", cluster)
+    entry[28:32] = struct.pack("<I", size)
+    return bytes(entry)
+
+
+def long_name_entries(long_name, name11):
+    checksum = 0
+    for byte in name11:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    encoded = long_name.encode("utf-16-le") + b"\x00\x00"
+    encoded += b"\xff" * (-len(encoded) % 26)
+    parts = [encoded[index:index + 26] for index in range(0, len(encoded), 26)]
+    entries = []
+    for ordinal, part in enumerate(parts, 1):
+        entry = bytearray(32)
+        entry[0] = ordinal | (0x40 if ordinal == len(parts) else 0)
+        entry[1:11] = part[0:10]
+        entry[11] = 0x0F
+        entry[13] = checksum
+        entry[14:26] = part[10:22]
+        entry[28:32] = part[22:26]
+        entries.append(bytes(entry))
+    return b"".join(reversed(entries))
+
+
+class Floppy:
+    """ A 1.44 MB FAT12 image built entry by entry, with one sector per cluster """
+    def __init__(self):
+        self.image = bytearray(1474560)
+        boot_sector = bytearray(SECTOR)
+        boot_sector[0:3] = b"\xeb\x3c\x90"
+        boot_sector[3:11] = b"MSDOS5.0"
+        boot_sector[11:24] = struct.pack("<HBHBHHBH", SECTOR, 1, 1, 2, ROOT_ENTRIES, 2880, 0xF0, FAT_SECTORS)
+        boot_sector[54:62] = b"FAT12   "
+        boot_sector[510:512] = b"\x55\xaa"
+        self.image[0:SECTOR] = boot_sector
+        self.fat = bytearray(FAT_SECTORS * SECTOR)
+        self.set_fat(0, 0xFF0)
+        self.set_fat(1, 0xFFF)
+        self.directories = {0: bytearray()}
+        self.next_free = 2
+
+    def set_fat(self, cluster, value):
+        offset = cluster + cluster // 2
+        current = struct.unpack("<H", self.fat[offset:offset + 2])[0]
+        current = (current & 0x000F) | (value << 4) if cluster & 1 else (current & 0xF000) | value
+        self.fat[offset:offset + 2] = struct.pack("<H", current)
+
+    def cluster_offset(self, cluster):
+        return DATA_OFFSET + (cluster - 2) * SECTOR
+
+    def allocate(self, data):
+        clusters = list(range(self.next_free, self.next_free + max(1, -(-len(data) // SECTOR))))
+        self.next_free = clusters[-1] + 1
+        for index, cluster in enumerate(clusters):
+            self.image[self.cluster_offset(cluster):self.cluster_offset(cluster) + SECTOR] = data[index * SECTOR:(index + 1) * SECTOR].ljust(SECTOR, b"\0")
+            self.set_fat(cluster, clusters[index + 1] if index + 1 < len(clusters) else 0xFFF)
+        return clusters[0]
+
+    def add_file(self, name11, data, directory=0, long_name=None, **kwargs):
+        cluster = self.allocate(data)
+        entries = long_name_entries(long_name, name11) if long_name else b""
+        self.directories[directory] += entries + short_entry(name11, 0x20, cluster, len(data), **kwargs)
+        return cluster
+
+    def add_directory(self, name11, directory=0, cluster=None):
+        """ Returns the new directory's cluster; pass an existing cluster to link back to it """
+        if cluster is None:
+            cluster = self.allocate(b"")
+            self.directories[cluster] = bytearray(short_entry(b".          ", 0x10, cluster) + short_entry(b"..         ", 0x10, directory))
+        self.directories[directory] += short_entry(name11, 0x10, cluster)
+        return cluster
+
+    def add_raw_entry(self, entry, directory=0):
+        self.directories[directory] += entry
+
+    def write(self, path):
+        for cluster, entries in self.directories.items():
+            offset = (1 + 2 * FAT_SECTORS) * SECTOR if cluster == 0 else self.cluster_offset(cluster)
+            self.image[offset:offset + len(entries)] = entries
+        self.image[SECTOR:SECTOR + len(self.fat)] = self.fat
+        self.image[SECTOR + len(self.fat):SECTOR + 2 * len(self.fat)] = self.fat
+        with open(path, "wb") as f:
+            f.write(self.image)
+        return path
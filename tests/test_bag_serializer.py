@@ -0,0 +1,100 @@
+import os
+import tarfile
+
+import pytest
+
+from reuther_born_digital_utils import bag_serializer
+from reuther_born_digital_utils.bag_serializer import BagPacker, SerializedBagWriter
+
+bagit = pytest.importorskip("bagit")
+
+
+def make_item(parent, name, files):
+    item_dir = os.path.join(parent, name)
+    for relpath, content in files.items():
+        filepath = os.path.join(item_dir, relpath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "wb") as f:
+            f.write(content)
+    return item_dir
+
+
+def extract(archive_path, dest):
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(dest)
+    return dest
+
+
+@pytest.mark.parametrize("serialization", ["tar", "tar.gz"])
+def test_serialized_bag_validates_with_bagit(tmp_path, serialization):
+    item_dir = make_item(str(tmp_path), "ITEM1", {
+        "objects/a.txt": b"alpha\n",
+        "objects/sub dir/b.bin": bytes(range(256)) * 100,
+        "objects/p%c t.txt": b"percent\n",
+        "metadata/submissionDocumentation/premis.csv": b"eventType\n"
+    })
+    archive_path = str(tmp_path / f"ITEM1.{serialization}")
+    writer = SerializedBagWriter(archive_path, serialization)
+    manifest = writer.add_bag(item_dir)
+    writer.close()
+
+    assert not os.path.exists(f"{archive_path}.part")
+    assert os.path.exists(f"{archive_path}.md5")
+    assert sorted(manifest) == sorted([
+        "data/objects/a.txt", "data/objects/sub dir/b.bin", "data/objects/p%c t.txt", "data/metadata/submissionDocumentation/premis.csv"
+    ])
+    bag = bagit.Bag(os.path.join(extract(archive_path, str(tmp_path / "out")), "ITEM1"))
+    bag.validate()
+
+
+def test_discard_removes_the_partial_archive(tmp_path):
+    item_dir = make_item(str(tmp_path), "ITEM1", {"a.txt": b"alpha"})
+    archive_path = str(tmp_path / "ITEM1.tar")
+    writer = SerializedBagWriter(archive_path)
+    writer.add_bag(item_dir)
+    writer.discard()
+    assert os.listdir(tmp_path) == ["ITEM1"]
+
+
+def test_packer_keeps_items_until_the_archive_is_closed(tmp_path):
+    items = [make_item(str(tmp_path), name, {f"objects/{name}.txt": name.encode() * 10}) for name in ["A", "B"]]
+    packer = BagPacker(str(tmp_path), "tar.gz", threshold=1024 * 1024)
+    for item_dir in items:
+        archive_path, manifest, _ = packer.pack(item_dir)
+        assert manifest
+    assert all(os.path.exists(item_dir) for item_dir in items)
+    assert not os.path.exists(archive_path)
+
+    packer.close()
+    assert not any(os.path.exists(item_dir) for item_dir in items)
+    out = extract(archive_path, str(tmp_path / "out"))
+    for name in ["A", "B"]:
+        bagit.Bag(os.path.join(out, name)).validate()
+
+
+def test_failed_bag_leaves_the_shared_archive_intact(tmp_path, monkeypatch):
+    good = make_item(str(tmp_path), "GOOD", {"objects/good.txt": b"good" * 1000})
+    bad = make_item(str(tmp_path), "BAD", {"objects/bad.txt": b"bad" * 1000})
+    later = make_item(str(tmp_path), "LATER", {"objects/later.txt": b"later"})
+    packer = BagPacker(str(tmp_path), "tar", threshold=1024 * 1024)
+    packer.pack(good)
+
+    read = bag_serializer.HashingReader.read
+
+    def failing_read(self, size=-1):
+        if self.fileobj.name.endswith("bad.txt"):
+            raise OSError("read error")
+        return read(self, size)
+
+    monkeypatch.setattr(bag_serializer.HashingReader, "read", failing_read)
+    with pytest.raises(OSError):
+        packer.pack(bad)
+    monkeypatch.setattr(bag_serializer.HashingReader, "read", read)
+    archive_path, _, _ = packer.pack(later)
+    packer.close()
+
+    assert os.path.exists(bad)
+    out = extract(archive_path, str(tmp_path / "out"))
+    assert sorted(os.listdir(out)) == ["GOOD", "LATER"]
+    for name in ["GOOD", "LATER"]:
+        bagit.Bag(os.path.join(out, name)).validate()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from reuther_born_digital_utils.bag_updater import BagUpdater
+from reuther_born_digital_utils.bag_validator import BagValidator, decode_manifest_path
+
+bagit = pytest.importorskip("bagit")
+
+
+def make_bag(parent, name, files):
+    bag_dir = os.path.join(parent, name)
+    for relpath, content in files.items():
+        filepath = os.path.join(bag_dir, relpath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "wb") as f:
+            f.write(content)
+    bagit.make_bag(bag_dir, checksums=["md5"])
+    return bag_dir
+
+
+def test_decodes_what_bagit_encodes():
+    assert decode_manifest_path("data/a%0Ab%0Dc") == "data/a\nb\rc"
+    assert decode_manifest_path("data/p%25c t.txt") == "data/p%25c t.txt"
+
+
+def test_percent_signs_in_bagit_bags(tmp_path):
+    bag_dir = make_bag(str(tmp_path), "ITEM1", {"objects/p%c t.txt": b"percent", "objects/plain.txt": b"plain"})
+    assert BagValidator(str(tmp_path)).validate()
+
+    with open(os.path.join(bag_dir, "data", "objects", "p%c t.txt"), "ab") as f:
+        f.write(b" edited")
+    BagUpdater(bag_dir).update()
+    bagit.Bag(bag_dir).validate()
+    assert BagValidator(str(tmp_path)).validate()
+
+
+def test_malformed_bags_are_reported_not_raised(tmp_path):
+    bad_line = make_bag(str(tmp_path), "BAD_LINE", {"a.txt": b"a"})
+    with open(os.path.join(bad_line, "manifest-md5.txt"), "a", encoding="utf-8") as f:
+        f.write("garbage\n")
+    bad_oxum = make_bag(str(tmp_path), "BAD_OXUM", {"a.txt": b"a"})
+    no_oxum = make_bag(str(tmp_path), "NO_OXUM", {"a.txt": b"a"})
+    for bag_dir, replacement in [(bad_oxum, "Payload-Oxum: 1.x\n"), (no_oxum, "")]:
+        bag_info = os.path.join(bag_dir, "bag-info.txt")
+        with open(bag_info, "r", encoding="utf-8") as f:
+            lines = [replacement if line.startswith("Payload-Oxum") else line for line in f]
+        with open(bag_info, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    validator = BagValidator(str(tmp_path))
+    assert not validator.validate()
+    results = {os.path.basename(bag_dir): result for bag_dir, result in validator.results.items()}
+    assert results["BAD_LINE"].failures == ["manifest-md5.txt: malformed line 'garbage'"]
+    assert results["BAD_OXUM"].failures == ["Payload-Oxum is malformed: 1.x"]
+    assert results["NO_OXUM"].warnings == ["bag-info.txt has no Payload-Oxum"]
+    # bag-info.txt was edited after bagging, so only its tag manifest entry fails
+    assert all("bag-info.txt" in failure for failure in results["NO_OXUM"].failures)
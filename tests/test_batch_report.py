@@ -0,0 +1,60 @@
+import json
+import os
+
+from reuther_born_digital_utils.batch_report import BatchReport, summarize_siegfried
+
+# the header sf -csv -hash md5 writes, as brunnhilde saves it in siegfried.csv
+SIEGFRIED_CSV = """filename,filesize,modified,errors,md5,namespace,id,format,version,mime,class,basis,warning
+/item/objects/a.txt,12,2003-04-05T06:07:08Z,,d41d8cd98f00b204e9800998ecf8427e,pronom,x-fmt/111,Plain Text File,,text/plain,Text,text match ASCII,
+/item/objects/b.txt,12,2003-05-05T06:07:08Z,,d41d8cd98f00b204e9800998ecf8427e,pronom,x-fmt/111,Plain Text File,,text/plain,Text,text match ASCII,
+/item/objects/c.pdf,1000,1999-01-01T00:00:00Z,,0cc175b9c0f1b6a831c399e269772661,pronom,fmt/18,Acrobat PDF 1.4 - Portable Document Format,1.4,application/pdf,Page description,"extension match pdf",
+/item/objects/d.bin,7,2010-01-01T00:00:00Z,empty source,92eb5ffee6ae2fec3ad71c777531578f,pronom,UNKNOWN,,,,,,no match
+"""
+
+
+def write_siegfried(brunnhilde_dir, content=SIEGFRIED_CSV):
+    os.makedirs(brunnhilde_dir, exist_ok=True)
+    with open(os.path.join(brunnhilde_dir, "siegfried.csv"), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_summarize_siegfried_reads_sf_headers(tmp_path):
+    write_siegfried(str(tmp_path))
+    summary = summarize_siegfried(str(tmp_path / "siegfried.csv"))
+    assert summary["files"] == 4
+    assert summary["bytes"] == 1031
+    assert summary["unidentified"] == 1
+    assert summary["errors"] == 1
+    assert summary["formats"]["x-fmt/111\tPlain Text File\t"] == [2, 24]
+    assert summary["formats"]["fmt/18\tAcrobat PDF 1.4 - Portable Document Format\t1.4"] == [1, 1000]
+    assert summary["mime_types"] == {"text/plain": 2, "application/pdf": 1, "unknown": 1}
+    assert summary["years"] == {"2003": 2, "1999": 1, "2010": 1}
+    assert (summary["duplicate_files"], summary["duplicate_sets"]) == (2, 1)
+
+
+def test_capitalized_headers_are_read_too(tmp_path):
+    header, rows = SIEGFRIED_CSV.split("\n", 1)
+    write_siegfried(str(tmp_path), header.title() + "\n" + rows)
+    summary = summarize_siegfried(str(tmp_path / "siegfried.csv"))
+    assert (summary["files"], summary["bytes"], summary["unidentified"]) == (4, 1031, 1)
+
+
+def test_batch_report_merges_items(tmp_path):
+    logs_dir = str(tmp_path / "batch_processor_logs")
+    os.makedirs(logs_dir)
+    report = BatchReport(logs_dir)
+    for item in ["A", "B"]:
+        brunnhilde_dir = str(tmp_path / item / "brunnhilde")
+        write_siegfried(brunnhilde_dir)
+        report.add_item(item, brunnhilde_dir)
+    report.item_finished("A", "success")
+
+    with open(os.path.join(logs_dir, "batch_report.json"), encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["A"]["status"] == "success" and state["B"]["status"] == "running"
+    with open(os.path.join(logs_dir, "batch_report_formats.csv"), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[1] == "x-fmt/111,Plain Text File,,4,48,2"
+    assert os.path.exists(os.path.join(logs_dir, "batch_report.html"))
+    # a new report over the same logs picks up where the last one left off
+    assert set(BatchReport(logs_dir).items) == {"A", "B"}
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from reuther_born_digital_utils import dfxml_io
+from reuther_born_digital_utils.dfxml_io import DfxmlWriter, dfxml_filename, dfxml_output, iter_file_hashes, iter_fileobject_fields, open_dfxml
+
+COMPRESSIONS = ["none", "gzip"] + (["zstd"] if dfxml_io.zstandard else [])
+
+
+def write_dfxml(dfxml_file):
+    dfxml = DfxmlWriter(dfxml_file, "test", "1")
+    dfxml.start_volume(0, {"ftype_str": "fat12"})
+    dfxml.fileobject({"filename": "a.txt", "filesize": 3, "name_type": "r", "alloc": 1}, [(0, 512, 3)], {"md5": "ABC"})
+    dfxml.fileobject({"filename": "bell\x07 & <co>.txt", "filesize": 1, "name_type": "r", "alloc": 1}, hashes={"md5": "def"})
+    dfxml.fileobject({"filename": "gone.txt", "filesize": 1, "name_type": "r", "alloc": 0}, hashes={"md5": "123"})
+    dfxml.fileobject({"filename": "SUB", "name_type": "d", "alloc": 1})
+    dfxml.end_volume()
+    dfxml.close()
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_written_dfxml_reads_back(tmp_path, compression):
+    dfxml_file = str(tmp_path / dfxml_filename(compression))
+    write_dfxml(dfxml_file)
+    assert list(iter_file_hashes(dfxml_file)) == [("a.txt", 3, "abc"), ("bell� & <co>.txt", 1, "def")]
+    fields = [fields for fields, _ in iter_fileobject_fields(dfxml_file)]
+    assert [f["filename"] for f in fields] == ["a.txt", "bell� & <co>.txt", "gone.txt", "SUB"]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_tool_output_is_compressed_on_the_way_out(tmp_path, compression):
+    dfxml_file = str(tmp_path / dfxml_filename(compression))
+    # more than a pipe buffer, so the tool blocks unless the output is read while it runs
+    text = "<dfxml>" + "x" * 3000000 + "</dfxml>\n"
+    with dfxml_output(dfxml_file) as stdout:
+        subprocess.run([sys.executable, "-c", "import sys; sys.stdout.write('<dfxml>' + 'x' * 3000000 + '</dfxml>\\n')"], stdout=stdout, check=True)
+    with open_dfxml(dfxml_file) as f:
+        assert f.read().decode() == text
+    if compression != "none":
+        assert os.path.getsize(dfxml_file) < len(text) // 10
+
+
+def test_zstd_without_the_package_exits(monkeypatch):
+    monkeypatch.setattr(dfxml_io, "zstandard", None)
+    with pytest.raises(SystemExit):
+        dfxml_filename("zstd")
+    assert dfxml_filename("gzip") == "dfxml.xml.gz"
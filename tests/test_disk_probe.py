@@ -0,0 +1,98 @@
+import struct
+
+from fat_images import Floppy
+from reuther_born_digital_utils.disk_probe import Partition, probe_image
+
+
+def floppy_bytes(tmp_path):
+    floppy = Floppy()
+    floppy.add_file(b"A       TXT", b"a")
+    with open(floppy.write(str(tmp_path / "floppy.img")), "rb") as f:
+        return f.read()
+
+
+def mbr_entry(partition_type, start, length):
+    return struct.pack("<B3sB3sII", 0, b"\0\0\0", partition_type, b"\0\0\0", start, length)
+
+
+def boot_record(entries):
+    sector = bytearray(512)
+    for index, entry in enumerate(entries):
+        sector[446 + index * 16:446 + (index + 1) * 16] = entry
+    sector[510:512] = b"\x55\xaa"
+    return sector
+
+
+def put(image, offset, data):
+    image[offset:offset + len(data)] = data
+
+
+def test_unpartitioned_floppy(tmp_path):
+    floppy_bytes(tmp_path)
+    result = probe_image(str(tmp_path / "floppy.img"))
+    assert result.scheme is None
+    assert result.filesystems == ["fat"] and result.details == ["FAT12"]
+    assert "FAT12 file system" in result.report()
+
+
+def test_mbr_with_primary_and_logical_partitions(tmp_path):
+    fat = floppy_bytes(tmp_path)
+    image = bytearray(512 * 20000)
+    put(image, 0, boot_record([mbr_entry(0x01, 63, 2880), mbr_entry(0x05, 4000, 8000)]))
+    put(image, 63 * 512, fat)
+    # the extended partition's first EBR points at a logical FAT volume and the next EBR
+    put(image, 4000 * 512, boot_record([mbr_entry(0x01, 63, 2880), mbr_entry(0x05, 4000, 4000)]))
+    put(image, (4000 + 63) * 512, fat)
+    put(image, 8000 * 512, boot_record([mbr_entry(0x83, 2, 100)]))
+    superblock = bytearray(1024)
+    superblock[56:58] = b"\x53\xef"
+    put(image, (8000 + 2) * 512 + 1024, superblock)
+    path = tmp_path / "disk.img"
+    path.write_bytes(bytes(image))
+
+    result = probe_image(str(path))
+    assert result.scheme == "mbr"
+    assert [(p.slot, p.start, p.filesystems) for p in result.partitions] == [
+        ("000", 63, ["fat"]), ("004", 4063, ["fat"]), ("005", 8002, ["ext"])
+    ]
+    assert result.found_filesystems() and not result.filesystems
+
+
+def test_iso_with_udf(tmp_path):
+    image = bytearray(2048 * 40)
+    for index, descriptor in enumerate([b"\x01CD001", b"\xffCD001", b"\x00BEA01", b"\x00NSR02", b"\x00TEA01"]):
+        put(image, (16 + index) * 2048, descriptor)
+    path = tmp_path / "cd.iso"
+    path.write_bytes(bytes(image))
+    result = probe_image(str(path))
+    assert result.filesystems == ["iso9660", "udf"]
+    assert result.details == ["ISO9660", "UDF (NSR02)"]
+
+
+def test_apple_partition_map(tmp_path):
+    image = bytearray(512 * 200)
+    put(image, 0, b"ER" + struct.pack(">H", 512))
+    for index, (partition_type, name, start, count) in enumerate([
+        (b"Apple_partition_map", b"Apple", 1, 63), (b"Apple_HFS", b"Disk", 64, 100)
+    ]):
+        entry = bytearray(512)
+        put(entry, 0, b"PM")
+        put(entry, 4, struct.pack(">III", 2, start, count))
+        put(entry, 16, name)
+        put(entry, 48, partition_type)
+        put(image, 512 * (index + 1), entry)
+    put(image, 64 * 512 + 1024, b"H+")
+    path = tmp_path / "mac.img"
+    path.write_bytes(bytes(image))
+    result = probe_image(str(path))
+    assert result.scheme == "apm"
+    assert [(p.slot, p.description, p.filesystems) for p in result.partitions] == [("001", "Apple_HFS Disk", ["hfs plus"])]
+    assert Partition.from_dict(result.partitions[0].as_dict()).as_dict() == result.partitions[0].as_dict()
+
+
+def test_nothing_recognized(tmp_path):
+    path = tmp_path / "random.img"
+    path.write_bytes(bytes(range(256)) * 64)
+    result = probe_image(str(path))
+    assert not result.found_filesystems()
+    assert result.report().endswith("No known file system found\n")
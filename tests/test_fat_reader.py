@@ -0,0 +1,113 @@
+import datetime
+import os
+import time
+
+import pytest
+
+from fat_images import Floppy, dos_date, dos_time, short_entry
+from reuther_born_digital_utils.dfxml_io import DfxmlWriter, iter_file_hashes
+from reuther_born_digital_utils.fat_reader import FatError, FatVolume, safe_name
+
+
+def extract(tmp_path, floppy, include_deleted=False):
+    image_path = floppy.write(str(tmp_path / "floppy.img"))
+    out_folder = str(tmp_path / "out")
+    dfxml_file = str(tmp_path / "dfxml.xml")
+    dfxml = DfxmlWriter(dfxml_file, "test", "1", image_path)
+    with open(image_path, "rb") as f:
+        volume = FatVolume(f, include_deleted=include_deleted)
+        volume.walk(out_folder, dfxml)
+    dfxml.close()
+    return volume, out_folder, dfxml_file
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_extracts_files_long_names_and_subdirectories(tmp_path):
+    floppy = Floppy()
+    floppy.add_file(b"HELLOW~1TXT", b"Hello, world\n", long_name="Hello World.txt")
+    sub = floppy.add_directory(b"SUB        ")
+    data = bytes(range(256)) * 5
+    floppy.add_file(b"A       BIN", data, directory=sub, date=dos_date(2001, 2, 3), time_of_day=dos_time(4, 5, 6))
+    volume, out_folder, dfxml_file = extract(tmp_path, floppy)
+
+    assert read(os.path.join(out_folder, "Hello World.txt")) == b"Hello, world\n"
+    assert read(os.path.join(out_folder, "SUB", "A.BIN")) == data
+    assert volume.files == 2
+    assert volume.bytes == 13 + len(data)
+    assert os.path.getmtime(os.path.join(out_folder, "SUB", "A.BIN")) == time.mktime(datetime.datetime(2001, 2, 3, 4, 5, 6).timetuple())
+    hashes = {filename: md5 for filename, _, md5 in iter_file_hashes(dfxml_file)}
+    assert set(hashes) == {"Hello World.txt", "SUB/A.BIN"}
+
+
+def test_deleted_files_only_when_asked(tmp_path):
+    floppy = Floppy()
+    cluster = floppy.add_file(b"ONE     TXT", b"deleted!")
+    # mark it deleted and free its cluster, as DOS does
+    floppy.directories[0][0] = 0xE5
+    floppy.set_fat(cluster, 0)
+    volume, out_folder, _ = extract(tmp_path, floppy)
+    assert os.listdir(out_folder) == []
+
+    volume, out_folder, _ = extract(tmp_path, floppy, include_deleted=True)
+    assert read(os.path.join(out_folder, "_NE.TXT")) == b"deleted!"
+
+
+def test_names_cannot_leave_the_output_folder(tmp_path):
+    floppy = Floppy()
+    floppy.add_file(b"ESCAPE~1TXT", b"outside", long_name="../escape.txt")
+    floppy.add_file(b"AB/CD   TXT", b"slash")
+    floppy.add_file(b"CTRL~1  TXT", b"control", long_name="bell\x07.txt")
+    volume, out_folder, dfxml_file = extract(tmp_path, floppy)
+
+    assert not os.path.exists(tmp_path / "escape.txt")
+    assert sorted(os.listdir(out_folder)) == [".._escape.txt", "AB_CD.TXT", "bell_.txt"]
+    assert read(os.path.join(out_folder, "AB_CD.TXT")) == b"slash"
+    assert ("../escape.txt", ".._escape.txt") in volume.renamed
+    assert {filename for filename, _, _ in iter_file_hashes(dfxml_file)} == {".._escape.txt", "AB_CD.TXT", "bell_.txt"}
+
+
+def test_safe_name():
+    assert safe_name("..") == "__"
+    assert safe_name("a\\b\x00c") == "a_b_c"
+    assert safe_name("ordinary name.txt") == "ordinary name.txt"
+
+
+def test_directory_cycle_is_skipped(tmp_path):
+    floppy = Floppy()
+    sub = floppy.add_directory(b"SUB        ")
+    floppy.add_file(b"KEEP    TXT", b"kept", directory=sub)
+    floppy.add_directory(b"LOOP       ", directory=sub, cluster=sub)
+    volume, out_folder, _ = extract(tmp_path, floppy)
+
+    assert read(os.path.join(out_folder, "SUB", "KEEP.TXT")) == b"kept"
+    assert not os.path.exists(os.path.join(out_folder, "SUB", "LOOP"))
+    assert len(volume.warnings) == 1 and "directory cycle" in volume.warnings[0]
+
+
+def test_cluster_past_the_end_of_the_fat(tmp_path):
+    floppy = Floppy()
+    floppy.add_file(b"GOOD    TXT", b"good")
+    floppy.add_raw_entry(short_entry(b"BAD     TXT", 0x20, 3500, 10))
+    image_path = floppy.write(str(tmp_path / "floppy.img"))
+    with open(image_path, "rb") as f:
+        volume = FatVolume(f)
+        volume.cluster_count = 4000
+        with pytest.raises(FatError):
+            volume.next_cluster(4000)
+        dfxml = DfxmlWriter(str(tmp_path / "dfxml.xml"), "test", "1")
+        volume.walk(str(tmp_path / "out"), dfxml)
+        dfxml.close()
+    assert os.listdir(tmp_path / "out") == ["GOOD.TXT"]
+    assert len(volume.warnings) == 1 and volume.warnings[0].startswith("BAD.TXT")
+
+
+def test_not_a_fat_volume(tmp_path):
+    path = tmp_path / "blank.img"
+    path.write_bytes(b"\0" * 4096)
+    with open(path, "rb") as f:
+        with pytest.raises(FatError):
+            FatVolume(f)
@@ -0,0 +1,47 @@
+import struct
+
+from reuther_born_digital_utils.image_triage import SHORT_TOLERANCE, triage_image
+
+
+def write_iso(path, volume_blocks, size):
+    """ A minimal ISO9660 image declaring volume_blocks 2048-byte blocks, cut or padded to size bytes """
+    data = bytearray(max(size, 32768 + 2048))
+    data[32768:32774] = b"\x01CD001"
+    data[32768 + 80:32768 + 84] = struct.pack("<I", volume_blocks)
+    data[32768 + 128:32768 + 130] = struct.pack("<H", 2048)
+    data[40000:40005] = b"files"
+    path.write_bytes(bytes(data[:size]))
+    return str(path)
+
+
+def test_empty_and_blank_images(tmp_path):
+    empty = tmp_path / "empty.img"
+    empty.write_bytes(b"")
+    zeros = tmp_path / "zeros.img"
+    zeros.write_bytes(b"\0" * 1474560)
+    unwritten = tmp_path / "unwritten.img"
+    unwritten.write_bytes(b"\xff" * 1474560)
+    assert triage_image(str(empty))[0] == "empty"
+    assert triage_image(str(zeros)) == ("blank", "Disk image appears blank (all zero bytes in the whole image)")
+    assert triage_image(str(unwritten))[0] == "blank"
+
+
+def test_partial_sector_is_truncated(tmp_path):
+    path = tmp_path / "odd.img"
+    path.write_bytes(b"\x01" * 1000)
+    assert triage_image(str(path))[0] == "truncated"
+
+
+def test_whole_iso_is_worth_probing(tmp_path):
+    assert triage_image(write_iso(tmp_path / "cd.iso", 100, 100 * 2048)) is None
+
+
+def test_track_at_once_shortfall_is_only_noted(tmp_path):
+    verdict, message = triage_image(write_iso(tmp_path / "cd.iso", 100, 98 * 2048))
+    assert verdict == "short"
+    assert message == "Disk image is 4096 bytes short of the 204800 bytes its file system declares"
+
+
+def test_substantially_short_iso_is_truncated(tmp_path):
+    size = 100 * 2048 - SHORT_TOLERANCE - 2048
+    assert triage_image(write_iso(tmp_path / "cd.iso", 100, size))[0] == "truncated"
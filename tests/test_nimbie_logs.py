@@ -0,0 +1,38 @@
+import pytest
+
+from reuther_born_digital_utils.nimbie_logs import NimbieLogParser, status_for_text
+
+
+@pytest.mark.parametrize("text, status", [
+    ("UR1_CD1 read complete", "ok"),
+    ("UR1_CD1 read incomplete", "errors"),
+    ("UR1_CD1 undone", None),
+    ("UR1_CD1 done", "ok"),
+    ("UR1_CD1 read FAILED", "failed"),
+    ("UR1_CD1 read failed, retrying", "errors"),
+    ("UR1_CD1 finished with 0 errors", "ok"),
+    ("UR1_CD1 blank disc", "empty"),
+    ("UR1_CD1 terrors", None)
+])
+def test_status_words_match_whole_words(text, status):
+    assert status_for_text(text) == status
+
+
+def test_latest_line_and_result_field_decide(tmp_path):
+    log_file = tmp_path / "batch.log"
+    log_file.write_text(
+        "10:00:01 UR1_CD1 read failed, retrying\n"
+        "10:00:09 UR1_CD1 read complete, 650 MB in 120 s\n"
+        "10:01:00 UR1_CD2 read complete\n"
+        "10:01:05 UR1_CD2 Result: failed\n"
+        "10:02:00 UR1_CD10 could not read disc\n",
+        encoding="utf-8"
+    )
+    parser = NimbieLogParser(["UR1_CD1", "UR1_CD2", "UR1_CD10"])
+    parser.parse_log(str(log_file))
+    records = parser.records
+    assert records["UR1_CD1"].status == "errors"
+    assert records["UR1_CD1"].bytes == 650 * 1024 ** 2
+    assert records["UR1_CD1"].duration == 120
+    assert records["UR1_CD2"].status == "failed"
+    assert records["UR1_CD10"].status == "failed"
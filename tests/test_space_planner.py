@@ -0,0 +1,73 @@
+import os
+
+from reuther_born_digital_utils.space_planner import MIN_ITEM_OVERHEAD, SpaceAdmission, SpaceHistory, SpacePlanner, directory_size, format_size
+
+MB = 1024 * 1024
+
+
+def make_items(parent, sizes):
+    item_dirs = []
+    for name, size in sizes.items():
+        item_dir = os.path.join(parent, name)
+        os.makedirs(item_dir)
+        with open(os.path.join(item_dir, "data.bin"), "wb") as f:
+            f.truncate(size)
+        item_dirs.append(item_dir)
+    return item_dirs
+
+
+def planner_with_free_space(tmp_path, free, transfer_type="disk_images"):
+    planner = SpacePlanner(str(tmp_path), transfer_type, margin=0, history=SpaceHistory(str(tmp_path / "history.json")))
+    planner.free_space = lambda: free
+    return planner
+
+
+def test_format_and_directory_size(tmp_path):
+    make_items(str(tmp_path), {"A": 1000})
+    assert directory_size(str(tmp_path)) == 1000
+    assert format_size(1536) == "1.5 KB"
+    assert format_size(3 * 1024 ** 5) == "3072.0 TB"
+
+
+def test_schedule_alternates_large_and_small_items(tmp_path):
+    item_dirs = make_items(str(tmp_path), {"S": 1 * MB, "L": 40 * MB, "M": 20 * MB, "XL": 80 * MB})
+    planner = planner_with_free_space(tmp_path, 1024 * MB)
+    schedule = planner.schedule(item_dirs)
+    assert [os.path.basename(item.item_dir) for item in schedule] == ["XL", "S", "L", "M"]
+    # disk images expect to grow by a quarter, and every item by at least the overhead
+    assert schedule[0].estimate == 100 * MB
+    assert schedule[1].estimate == MIN_ITEM_OVERHEAD
+
+
+def test_history_replaces_the_default_growth_ratio(tmp_path):
+    history = SpaceHistory(str(tmp_path / "history.json"))
+    for _ in range(10):
+        history.record("folders", 100, 50)
+    assert SpaceHistory(str(tmp_path / "history.json")).growth_ratio("folders") == 0.5
+    assert history.growth_ratio("disk_images") == 1.25
+
+
+def test_items_too_large_for_the_volume_are_reported_in_the_plan(tmp_path):
+    item_dirs = make_items(str(tmp_path), {"SMALL": 8 * MB, "HUGE": 200 * MB})
+    planner = planner_with_free_space(tmp_path, 100 * MB)
+    rows, peak, budget = planner.simulate(planner.schedule(item_dirs), workers=2)
+    starts = {os.path.basename(item.item_dir): start for item, start in rows}
+    assert starts == {"HUGE": None, "SMALL": 0.0}
+    assert peak == 10 * MB and budget == 100 * MB
+
+
+def test_admission_holds_items_until_space_is_released(tmp_path):
+    item_dirs = make_items(str(tmp_path), {"A": 40 * MB, "B": 40 * MB})
+    planner = planner_with_free_space(tmp_path, 120 * MB)
+    pending = planner.schedule(item_dirs)
+    admission = SpaceAdmission(planner, workers=2)
+    first, fits = admission.next_item(pending)
+    assert fits and admission.reserved == 50 * MB
+    admission.release(first, 10 * MB)
+    assert admission.budget == 110 * MB and admission.reserved == 0
+    second, fits = admission.next_item(pending)
+    assert fits and not pending
+
+    admission = SpaceAdmission(planner_with_free_space(tmp_path, 1 * MB), workers=2)
+    item, fits = admission.next_item([second])
+    assert item is second and not fits
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+
+from reuther_born_digital_utils.stages import CANCELLED, DONE, FAILED, NOT_NEEDED, UP_TO_DATE, Stage, StageRunner
+
+
+def recorder(order, name, lock=threading.Lock()):
+    def func():
+        with lock:
+            order.append(name)
+    return func
+
+
+def statuses(stages):
+    return {name: stage.status for name, stage in stages.items()}
+
+
+def test_stages_run_after_what_they_require():
+    order = []
+    stages = StageRunner([
+        Stage("bag", recorder(order, "bag"), requires=["premis", "brunnhilde"]),
+        Stage("premis", recorder(order, "premis"), requires=["extract"]),
+        Stage("brunnhilde", recorder(order, "brunnhilde"), requires=["extract"]),
+        Stage("extract", recorder(order, "extract"))
+    ]).run()
+    assert order[0] == "extract" and order[-1] == "bag"
+    assert set(order[1:3]) == {"premis", "brunnhilde"}
+    assert set(statuses(stages).values()) == {DONE}
+
+
+def test_failure_cancels_dependents_but_not_always_stages():
+    errors = []
+
+    def fail():
+        raise RuntimeError("tool crashed")
+
+    stages = StageRunner([
+        Stage("extract", fail),
+        Stage("brunnhilde", lambda: None, requires=["extract"]),
+        Stage("premis", lambda: None, requires=["brunnhilde"], always=True),
+        Stage("bag", lambda: None, requires=["premis"]),
+        Stage("unrelated", lambda: None)
+    ], on_error=lambda stage, error: errors.append((stage.name, str(error)))).run()
+    assert statuses(stages) == {"extract": FAILED, "brunnhilde": CANCELLED, "premis": DONE, "bag": DONE, "unrelated": DONE}
+    assert errors == [("extract", "tool crashed")]
+    assert isinstance(stages["extract"].error, RuntimeError)
+
+
+def test_should_continue_stops_later_stages():
+    state = {"skipped": False}
+
+    def skip():
+        state["skipped"] = True
+
+    stages = StageRunner([
+        Stage("triage", skip),
+        Stage("extract", lambda: None, requires=["triage"]),
+        Stage("premis", lambda: None, requires=["extract"], always=True)
+    ], should_continue=lambda: not state["skipped"]).run()
+    assert statuses(stages) == {"triage": DONE, "extract": CANCELLED, "premis": DONE}
+
+
+def test_when_and_up_to_date_stages_are_not_run(tmp_path):
+    source = tmp_path / "image.img"
+    source.write_bytes(b"image")
+    output = tmp_path / "disktype.txt"
+    output.write_text("done")
+    os.utime(source, (1000, 1000))
+    order = []
+    stages = StageRunner([
+        Stage("disktype", recorder(order, "disktype"), inputs=[str(source)], outputs=[str(output)]),
+        Stage("fiwalk", recorder(order, "fiwalk"), requires=["disktype"], when=lambda: False),
+        Stage("extract", recorder(order, "extract"), requires=["fiwalk"])
+    ]).run()
+    assert statuses(stages) == {"disktype": UP_TO_DATE, "fiwalk": NOT_NEEDED, "extract": DONE}
+    assert order == ["extract"]
+
+    # a newer input makes the stage run again
+    os.utime(source, (os.path.getmtime(output) + 10,) * 2)
+    assert not Stage("disktype", None, inputs=[str(source)], outputs=[str(output)]).is_up_to_date()
+
+
+def test_bad_requirements_are_errors():
+    with pytest.raises(ValueError):
+        StageRunner([Stage("bag", lambda: None, requires=["premis"])])
+    with pytest.raises(ValueError):
+        StageRunner([Stage("a", lambda: None, requires=["b"]), Stage("b", lambda: None, requires=["a"])]).run()
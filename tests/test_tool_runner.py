@@ -0,0 +1,63 @@
+import sys
+import time
+
+import pytest
+
+from reuther_born_digital_utils.tool_runner import ToolTimeout, ToolTimeouts, run_tool
+
+
+def is_running(pid):
+    """ True if pid is alive and not just a zombie waiting to be reaped """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_timeouts_scale_with_size():
+    timeouts = ToolTimeouts({"fiwalk": {"base": 100, "per_gb": 10}, "new_tool": {"base": 5}}, scale=2)
+    assert timeouts.for_tool("fiwalk", 3 * 1024 ** 3) == 260
+    assert timeouts.for_tool("new_tool") == 10
+    assert ToolTimeouts({"bagit": {"base": None}}).for_tool("bagit", 1024 ** 4) is None
+    with pytest.raises(KeyError):
+        timeouts.for_tool("unknown")
+
+
+def test_timeouts_file(tmp_path):
+    timeouts_file = tmp_path / "timeouts.json"
+    timeouts_file.write_text('{"brunnhilde": {"per_gb": 0}}')
+    timeouts = ToolTimeouts.from_file(str(timeouts_file))
+    assert timeouts.for_tool("brunnhilde", 1024 ** 3) == 3600
+    timeouts_file.write_text("not json")
+    with pytest.raises(SystemExit):
+        ToolTimeouts.from_file(str(timeouts_file))
+
+
+def test_run_tool_captures_output():
+    result = run_tool([sys.executable, "-c", "print('hello'); raise SystemExit(3)"], "test", capture_output=True)
+    assert result.returncode == 3
+    assert result.stdout.strip() == b"hello"
+
+
+def test_timeout_kills_the_whole_process_group(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    # the child outlives its parent unless the process group is killed
+    script = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(60)\n"
+    )
+    started = time.time()
+    with pytest.raises(ToolTimeout) as excinfo:
+        run_tool([sys.executable, "-c", script], "sleeper", timeout=1, event_type="metadata extraction")
+    assert time.time() - started < 30
+    assert excinfo.value.event_type == "metadata extraction"
+    child_pid = int(pid_file.read_text())
+    for _ in range(50):
+        if not is_running(child_pid):
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("the tool's child process survived the timeout")